@@ -0,0 +1,133 @@
+##################################################################################
+# run_benchmarks.py -- Speed and memory of the simulator (see SimCore/Benchmark.py)
+#
+# Usage: python Benchmarks/run_benchmarks.py run [--suite quick] [--backend numba]
+#        [--rule up] [--NE 100 1000] [--batch 1 16] [--precision float64 float32]
+#        [--api SimRun Simulator] [--e2e fig4E] [--e2e-trials 4] [--e2e-t-max 1e5] [--out path] [--baseline]
+#    or: python Benchmarks/run_benchmarks.py compare [current] [--baseline path]
+#        [--threshold 0.1]
+# "run" times SimRun for every combination of rule (stdp, up, frozen), backend,
+# number of neurons NE, batch size, precision (default: float64 only) and API
+# (default: SimRun only, see SimCore/Simulator.py), and run_code.py of the figures
+# given with --e2e. The suite "quick" takes NE up to 10^4 and no run_code.py, the suite "full"
+# NE up to 10^5 and run_code.py of Figure4E; the other options replace the values
+# of the suite. The results go to Benchmarks/Results/<date>.json (or --out), and
+# with --baseline also to Benchmarks/baseline.json.
+#
+# "compare" compares a run (by default the latest in Benchmarks/Results/) with the
+# baseline, prints every metric of every case and exits with status 1 if any of
+# them is worse than the baseline by more than the threshold (10%).
+##################################################################################
+
+
+import os, sys, glob, shutil
+import argparse
+from time import strftime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+sys.path.insert(0,ROOT)
+from SimCore import Benchmark, StepKernel
+
+
+HERE = os.path.join(ROOT,'Benchmarks')
+RESULTS = os.path.join(HERE,'Results')
+BASELINE = os.path.join(HERE,'baseline.json')
+
+SUITES = {
+	'quick': {'NE': [100,1000,10000], 'batch': [1,16], 'e2e': []},
+	'full':  {'NE': [100,1000,10000,100000], 'batch': [1,16,64], 'e2e': ['fig4E']}}
+
+
+def run (args):
+	suite = SUITES[args.suite]
+	backends = args.backend or [b for b in ('numpy','numba') if b == 'numpy' or StepKernel.available()]
+	NEs = args.NE or suite['NE']
+	batches = args.batch or suite['batch']
+	figures = suite['e2e'] if args.e2e is None else args.e2e
+
+	results = []
+	print('{0:40s} {1:>12s} {2:>12s} {3:>10s}'.format('case','steps/s','trials/s','peak MB'))
+	for rule in args.rule:
+		for backend in backends:
+			for NE in NEs:
+				for B in batches:
+					for precision in args.precision:
+						for api in args.api:
+							r = Benchmark.step_case(rule,backend,NE,B,args.min_time,args.repeats,precision,api)
+							results.append(r)
+							print('{0:40s} {1:12.1f} {2:12.4f} {3:10.1f}'.format(r['name'],r['steps_per_s'],r['trials_per_s'],r['peak_mb']))
+	for figure in figures:
+		for backend in backends:
+			e2e_args = [args.e2e_trials] if figure == 'fig4E' else []
+			r = Benchmark.e2e_case(figure,backend,e2e_args,args.e2e_t_max)
+			results.append(r)
+			print('{0:40s} wall {1:.1f} s, max RSS {2:.1f} MB'.format(r['name'],r['wall_s'],r['max_rss_mb']))
+
+	meta = Benchmark.environment()
+	meta.update({'suite': args.suite, 'min_time': args.min_time, 'repeats': args.repeats, 'e2e_t_max': args.e2e_t_max})
+	out = args.out or os.path.join(RESULTS,strftime('%Y%m%d-%H%M%S')+'.json')
+	Benchmark.save(out,meta,results)
+	print('Results written to {0}'.format(out))
+	if args.baseline:
+		shutil.copyfile(out,BASELINE)
+		print('Baseline written to {0}'.format(BASELINE))
+
+def compare (args):
+	current = args.current
+	if current is None:
+		found = sorted(glob.glob(os.path.join(RESULTS,'*.json')))
+		if not found:
+			sys.exit('No results in {0}, run the benchmarks first'.format(RESULTS))
+		current = found[-1]
+	baseline, results = Benchmark.load(args.baseline), Benchmark.load(current)
+	for name,run in (('Baseline',baseline),('Current',results)):
+		m = run['meta']
+		print('{0}: {1} ({2}, commit {3:.10s}, numpy {4}, numba {5})'.format(name,m['date'],m['host'],m['commit'],m['numpy'],m['numba']))
+	if baseline['meta']['host'] != results['meta']['host']:
+		print('Warning: the runs are from different machines')
+
+	rows = Benchmark.compare(baseline,results,args.threshold)
+	print('')
+	print('{0:40s} {1:>13s} {2:>12s} {3:>12s} {4:>8s}'.format('case','metric','baseline','current','change'))
+	for name,metric,b,v,change,regression in rows:
+		print('{0:40s} {1:>13s} {2:12.4g} {3:12.4g} {4:+7.1f}% {5}'.format(name,metric,b,v,100.*change,
+			'REGRESSION' if regression else ''))
+	regressions = [row for row in rows if row[5]]
+	missing = set(r['name'] for r in baseline['results']) - set(r['name'] for r in results['results'])
+	print('')
+	if missing:
+		print('Cases of the baseline not run: {0}'.format(', '.join(sorted(missing))))
+	print('{0} regressions in {1} comparisons (threshold {2:.0f}%)'.format(len(regressions),len(rows),100.*args.threshold))
+	sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks of the simulator')
+	commands = parser.add_subparsers(dest='command')
+	commands.required = True
+
+	p_run = commands.add_parser('run',help='run the benchmarks')
+	p_run.add_argument('--suite',default='quick',choices=sorted(SUITES),help='default values of the cases')
+	p_run.add_argument('--rule',nargs='+',default=sorted(Benchmark.RULES),choices=sorted(Benchmark.RULES),help='rules')
+	p_run.add_argument('--backend',nargs='+',default=None,choices=['numpy','numba'],help='backends (default: all available)')
+	p_run.add_argument('--NE',nargs='+',type=int,default=None,help='numbers of neurons')
+	p_run.add_argument('--batch',nargs='+',type=int,default=None,help='numbers of trials simulated at once')
+	p_run.add_argument('--precision',nargs='+',default=['float64'],choices=['float64','float32'],help='precisions of the step cases')
+	p_run.add_argument('--api',nargs='+',default=['SimRun'],choices=['SimRun','Simulator'],help='how the step cases advance the batch')
+	p_run.add_argument('--e2e',nargs='*',default=None,choices=sorted(Benchmark.FIGURES),help='figures whose run_code.py is run')
+	p_run.add_argument('--e2e-trials',type=int,default=4,help='number of trials of run_code.py of Figure4E')
+	p_run.add_argument('--e2e-t-max',type=float,default=None,help='[ms] duration of the simulations of run_code.py (default: params.py)')
+	p_run.add_argument('--min-time',type=float,default=0.5,help='[s] shortest timed run of a case')
+	p_run.add_argument('--repeats',type=int,default=3,help='timed runs of a case (the fastest is kept)')
+	p_run.add_argument('--out',default=None,help='file of the results (default: Benchmarks/Results/<date>.json)')
+	p_run.add_argument('--baseline',action='store_true',help='also keep the results as the baseline')
+	p_run.set_defaults(func=run)
+
+	p_cmp = commands.add_parser('compare',help='compare a run with the baseline')
+	p_cmp.add_argument('current',nargs='?',default=None,help='results of the run (default: the latest)')
+	p_cmp.add_argument('--baseline',default=BASELINE,help='results of the baseline')
+	p_cmp.add_argument('--threshold',type=float,default=0.1,help='largest relative loss that is not a regression')
+	p_cmp.set_defaults(func=compare)
+
+	args = parser.parse_args()
+	args.func(args)
@@ -6,6 +6,19 @@
 # On these simulations, synaptic weights are updated following the Up-state-mediated 
 # plasticity described in the paper.
 #
+# Usage: python UP-state-mediated_plast_fig4CD_sleep.py [trial] [--checkpoint path [--resume]]
+#        [--metrics path] [--stop drift|sn]
+# or, from run_code.py, simulate(Wpre,trial), with Wpre the weights of the wake phase.
+# trial (default 0) selects the random streams of the run (see SimCore/Streams.py).
+# With --checkpoint, the run is saved in path every p.checkpoint_every steps, and
+# --resume continues it from there (see SimCore/Checkpoint.py).
+# With --metrics, the time spent in each phase of the step, the spikes, the
+# clipped weights and the progress of the run are written in path (see
+# SimCore/Metrics.py).
+# With --stop (or p.stop_criterion), the run ends once the weights are stationary
+# (see SimCore/Convergence.py), and the step at which it ended and the criterion
+# are written in Data/Syn_weights_sleep_plast_stop.json.
+#
 # Author: Victor Pedrosa
 # Imperial College London, London, UK - Dec 2017
 ##################################################################################
@@ -15,6 +28,7 @@
 
 import numpy as np
 from time import time as time_now
+import sys, argparse
 from matplotlib import rcParams
 rcParams.update({'figure.autolayout': True})
 
@@ -25,62 +39,110 @@ from imp import reload
 import params; reload(params); import params as p
 import SimStep; reload(SimStep); import SimStep as SS
 
-time_in = time_now()
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Initialization of time-dependent variables -------------------------------------
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def simulate (Wpre,trial=0,recorder=None,raster=None,checkpoint=None,resume=False,stop=None):
+	# ----------------------------------------------------------------------------
+	# Simulates the sleep phase starting from the last weights of Wpre (the output
+	# of the wake phase, [nSnap x 1 x NE]) with the random streams of the given
+	# trial, and returns the synaptic weights kept by recorder (by default, every
+	# second, [nSnap x 1 x NE])
+	# If raster (SS.Spikes.SpikeRaster(p.NE+1,dt=p.dt)) is given, the spikes are
+	# recorded in it.
+	# If checkpoint (a path) is given, the run is saved there every
+	# p.checkpoint_every steps, and with resume=True it continues from there.
+	# stop (a Convergence.Stop, by default SS.stopper()) ends the run once the
+	# weights are stationary; the recorder then keeps the weights up to that step.
+	# ----------------------------------------------------------------------------
+	SS.set_trials(trial)
+
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Initialization of time-dependent variables ---------------------------------
+
+	# Synaptic weights -----------------------------------------------------------
+
+	WEE = np.zeros((1,p.NE))	# E-E connections
+
+	WEE[:] = Wpre[-1]
+	WEE = SS.cast(SS._rect(WEE) - SS._rect(WEE-p.w_max))	# in the precision of the run (see SimStep.set_precision)
+
+	# Other variables ------------------------------------------------------------
+
+	xbar_pre = np.zeros(p.NE) 		# Synaptic traces for presynaptic events
+	xbar_post = np.zeros(1) 		# Synaptic traces for postsynaptic events
+	Vmemb = np.zeros(p.NE+1)		# [mV] Membrane potential
+	ref = np.zeros(p.NE+1)			# Variable to identify the neurons going over refractory time
+	gSynE = np.zeros(p.NE)			# Synaptic conductance for excitatory connections
+	Iext = np.zeros(p.NE+1)		    # [pA] External current for each neuron
+
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Choose what is saved of the weights ----------------------------------------
+
+	# By default, the weights every 1 s. Any recorder of SimCore/Recorders.py can
+	# be given instead (e.g. Final(), Ring(k,M) or Stream(path,k)).
+
+	if recorder is None:
+		recorder = SS.Recorders.Every(int(round(1000/p.dt)))
 
-# Synaptic weights ---------------------------------------------------------------
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Run the code ---------------------------------------------------------------
 
-Wpre = np.load('./Data/Syn_weights_wake_plast.npy')
+	# The variables are kept by a Simulator, which advances them in place (see
+	# SimCore/Simulator.py) with the backend selected in SimStep.py (NumPy or
+	# compiled). The steps between two saved snapshots are advanced in one call.
 
-WEE = np.zeros((1,p.NE))	# E-E connections
+	sim = SS.simulator(Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,"up",raster=raster)
 
-WEE[:] = Wpre[-1]
-WEE = SS._rect(WEE) - SS._rect(WEE-p.w_max)
+	if stop is None:
+		stop = SS.stopper()
+	recorders = [recorder] + ([] if stop is None else [stop])
 
-# Other variables ----------------------------------------------------------------
+	if checkpoint is not None:
+		checkpoint = SS.checkpoint(checkpoint,sim.variables,recorders,raster,resume=resume)
+	SS.Recorders.run(sim.run,lambda: sim.WEE,p.nSteps,recorders,checkpoint,SS.Monitor)
 
-xbar_pre = np.zeros(p.NE) 		# Synaptic traces for presynaptic events
-xbar_post = np.zeros(1) 		# Synaptic traces for postsynaptic events
-Vmemb = np.zeros(p.NE+1)		# [mV] Membrane potential
-ref = np.zeros(p.NE+1)			# Variable to identify the neurons going over refractory time
-gSynE = np.zeros(p.NE)			# Synaptic conductance for excitatory connections
-Iext = np.zeros(p.NE+1)		    # [pA] External current for each neuron
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Create variables to "save" the results -----------------------------------------
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
-subsampling = 1000 # To save weights only after specific intervals 
-WEE_all = np.zeros((int(p.nSteps/subsampling)+1,1,p.NE))
-WEE_all[0] = WEE
+	return recorder.result()
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Run the code -------------------------------------------------------------------
 
-for step in range(p.nSteps):
-	Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext \
-	= SS.SimStep (Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,"up")
-	
-	if (((step+1) % subsampling) == 0):
-		WEE_all[int(step/subsampling)+1,:] = WEE # save the synaptic weights
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Sleep phase of Figure 4CD')
+	parser.add_argument('trial',type=int,nargs='?',default=0,help='trial (random streams) of the run')
+	parser.add_argument('--checkpoint',default=None,help='file of the checkpoints of the run')
+	parser.add_argument('--resume',action='store_true',help='continue from the checkpoint')
+	parser.add_argument('--metrics',default=None,help='file of the timers, counters and progress of the run (JSON lines)')
+	parser.add_argument('--stop',default=p.stop_criterion,choices=['drift','sn'],help='end the run once this criterion is stationary')
+	args = parser.parse_args()
+	if args.metrics:
+		SS.set_metrics(args.metrics,label='sleep trial {0}'.format(args.trial))
 
-	
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	p.stop_criterion = args.stop
+	stop = SS.stopper()
 
+	time_in = time_now()
+	Wpre = np.load('./Data/Syn_weights_wake_plast.npy')
+	WEE_all = simulate(Wpre,args.trial,checkpoint=args.checkpoint,resume=args.resume,stop=stop)
 
-# Compute the total time spent with the simulation -------------------------------
+	# Compute the total time spent with the simulation -----------------------
 
-time_end = time_now()
-time_total = time_end - time_in
+	time_end = time_now()
+	time_total = time_end - time_in
 
-print('')
-print('Sleep plasticity >> Total time = {0:.3f} segundos'.format(time_total))
-print("")
+	print('')
+	print('Sleep plasticity >> Total time = {0:.3f} segundos'.format(time_total))
+	print("")
 
 
-# Save results -------------------------------------------------------------------
+	# Save results -----------------------------------------------------------
 
-np.save('./Data/Syn_weights_sleep_plast',WEE_all)
+	np.save('./Data/Syn_weights_sleep_plast',WEE_all)
+	if stop is not None:
+		record = stop.record(p.dt)
+		SS.Convergence.save('./Data/Syn_weights_sleep_plast_stop.json',record)
+		print('Stopped at t = {0:.0f} ms ({1}, converged: {2})'.format(record['time_ms'],record['criterion'],record['converged']))
@@ -26,11 +26,19 @@ NE = 100                    # Number of excitatory neurons in the input layer
 # Simulation parameters -----------------------------------------------------------------------------
 t_max = 8e5 		   	    # [ms] Total time of simulation
 dt = 1. 		          	# [ms] Simulation time step
-nSteps = np.int(t_max/dt)	# Number of steps in simulation
+nSteps = int(round(t_max/dt))	# Number of steps in simulation
+integrator = "euler"		# "euler" or "exponential" (see SimCore/Integrator.py)
+precision = "float64"		# "float64" or "float32" (see SimStep.set_precision)
+
+# Random streams (see SimCore/Streams.py) -----------------------------------------------------------
+seed = 0					# Base seed of the random streams
+experiment = "fig4CD"		# Label of the experiment in the random streams
+phase = "sleep"				# Label of the external current of this simulation
 
 # Excitatory plasticity -----------------------------------------------------------------------------
 tp_plast = 20.         	# [ms] Decay time for pre->post activity
 tm_plast = 20. 		   	# [ms] Decay time for post->pre activity
+rule = "up"					# Plasticity rule (see SimCore/Plasticity.py)
 
 a_pre = {}		      		# Pre-synaptic activity term (non-Hebbian)
 a_post = {}	     			# Post-synaptic activity term
@@ -61,6 +69,22 @@ tauSynEx = 10.				# [ms] Time constant for excitatory postsynaptic potential
 tauSynIn = 10.				# [ms] Time constant for inhibitory postsynaptic potential
 gBarEx = .5 				# Peak synaptic conductance for excitatory synapses
 
+# External current (see SimCore/NoiseSource.py) -----------------------------------------------------
+taufilt = 20.				# [ms] Filtering time constant
+std_pre = 1.8				# Std of the gaussian noise (cubed and rectified) of presynaptic neurons
+mean_post = 9.				# [pA] Mean external current of the postsynaptic neuron
+std_post = 0.0001			# [pA] Std of the (rectified) gaussian noise of the postsynaptic neuron
+noise_block = 10000			# Number of steps of external current generated at once
+
+# Checkpoints (see SimCore/Checkpoint.py) ------------------------------------------------------------
+checkpoint_every = 100000	# [steps] Interval between the checkpoints of a run
+
+# Early termination (see SimCore/Convergence.py) -----------------------------------------------------
+stop_criterion = None		# None (run all the steps), "drift" or "sn": end the run once it is stationary
+stop_every = 10000			# [steps] Interval between two checks of the criterion
+stop_window = 5				# Number of checks over which the criterion must hold
+stop_tol = 1e-3				# Tolerance of the criterion
+
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # Parameters for speeding up the simulation +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
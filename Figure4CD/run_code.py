@@ -1,16 +1,24 @@
 # ====================================================================================================
 # run_code.py -- Simulates a feedforward network of excitatory neurons as in
 #
-# Ref: González-Rueda, A., Pedrosa, V., Feord, R., Clopath, C., Paulsen, O. Activity-dependent 
-# downscaling of subthreshold synaptic inputs during slow wave sleep-like activity in vivo. 
+# Ref: González-Rueda, A., Pedrosa, V., Feord, R., Clopath, C., Paulsen, O. Activity-dependent
+# downscaling of subthreshold synaptic inputs during slow wave sleep-like activity in vivo.
 # Neuron (2018).
 #
-# This code executes the following:
-#  1. UP-state-mediated_plast_fig1CD_wake.py, which generates Syn_weights_wake_plast.npy
-#  2. UP-state-mediated_plast_fig1CD_sleep.py, which generates Syn_weights_sleep_plast.npy
-#     and takes Syn_weights_wake_plast.npy as input
-#  3. Make_fig1CD.py, which generates one figure file and takes both Syn_weights_wake_plast.npy
+# This code executes the following, in one process:
+#  1. UP-state-mediated_plast_fig4CD_wake.py, which generates the weights of the wake phase
+#  2. UP-state-mediated_plast_fig4CD_sleep.py, which takes the weights of the wake phase
+#     (in memory) and generates the weights of the sleep phase
+#  3. Make_fig4CD.py, which generates one figure file and takes both Syn_weights_wake_plast.npy
 #     and Syn_weights_sleep_plast.npy as input
+# The output of each step is cached in Data/cache/ (see SimCore/Pipeline.py), and a step is run
+# again only if its parameters, its code or the output of a previous step changed.
+# With p.stop_criterion set in the params.py of a phase, the phase ends once its weights are
+# stationary (see SimCore/Convergence.py), and the step at which it ended is written in
+# Data/Syn_weights_<phase>_plast_stop.json.
+#
+# Usage: python run_code.py [trial] [--force]
+# trial (default 0) selects the random streams; --force runs all the steps again.
 # -----------------------------------------------------------------------
 #
 # Author: Victor Pedrosa <v.pedrosa15@imperial.ac.uk>
@@ -19,36 +27,86 @@
 
 
 # Import modules -------------------------------------------------------------------------------------
-import subprocess
-import os
+import os, sys, json, runpy
+import numpy as np
 from time import time as time_now
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(HERE,os.pardir))
+from SimCore import Pipeline
+
+args = [a for a in sys.argv[1:] if a != '--force']
+trial = int(args[0]) if args else 0
+force = '--force' in sys.argv[1:]
+
 # Create new directories if they don't exist ---------------------------------------------------------
-newpath = r'Data/' 
+newpath = r'Data/'
 if not os.path.exists(newpath):
     os.makedirs(newpath)
-    
-newpath = r'Figures/' 
+
+newpath = r'Figures/'
 if not os.path.exists(newpath):
     os.makedirs(newpath)
 
 # start to count the time spent with simulations -----------------------------------------------------
-time_in = time_now() 
+time_in = time_now()
 
 
 # ====================================================================================================
-# Run the simulations
+# Define the steps
 # ====================================================================================================
 
-# Run the main code for wake plasticity --------------------------------------------------------------
-subprocess.call('python Step1-wake_learning/UP-state-mediated_plast_fig4CD_wake.py',shell=True)
+def stage_files (folder,script):
+    # The script of a step, with its params.py and SimStep.py
+    return [os.path.join(HERE,folder,f) for f in (script,'params.py','SimStep.py')]
+
+def simulate_phase (script,*inputs):
+    # The weights of a phase and, if it can end early, the record of where it ended (JSON text)
+    stop = script.SS.stopper()
+    out = {'WEE_all': script.simulate(*inputs,stop=stop)}
+    if stop is not None:
+        out['stop'] = np.array(json.dumps(stop.record(script.p.dt)))
+    return out
+
+def save_data (wake_out,sleep_out):
+    np.save('./Data/Syn_weights_wake_plast',wake_out['WEE_all'])
+    np.save('./Data/Syn_weights_sleep_plast',sleep_out['WEE_all'])
+    for name,out in (('wake',wake_out),('sleep',sleep_out)):
+        if 'stop' in out:
+            with open('./Data/Syn_weights_{0}_plast_stop.json'.format(name),'w') as f:
+                f.write(str(out['stop']))
+
+def make_figure (wake_out,sleep_out):
+    save_data(wake_out,sleep_out)
+    runpy.run_path(os.path.join(HERE,'Step3-figures','Make_fig4CD.py'),run_name='__main__')
+    return {}
+
+# Wake plasticity ------------------------------------------------------------------------------------
+files = stage_files('Step1-wake_learning','UP-state-mediated_plast_fig4CD_wake.py')
+wake = Pipeline.load_script(files[0])
+wake_stage = Pipeline.Stage('wake',lambda: simulate_phase(wake,trial),
+    files+Pipeline.dependencies(wake,wake.SS),wake.p)
+
+# Sleep plasticity -----------------------------------------------------------------------------------
+files = stage_files('Step2-sleep_learning','UP-state-mediated_plast_fig4CD_sleep.py')
+sleep = Pipeline.load_script(files[0])
+sleep_stage = Pipeline.Stage('sleep',lambda w: simulate_phase(sleep,w['WEE_all'],trial),
+    files+Pipeline.dependencies(sleep,sleep.SS),sleep.p,upstream=[wake_stage])
+
+# Figures --------------------------------------------------------------------------------------------
+figure_stage = Pipeline.Stage('figure',make_figure,[os.path.join(HERE,'Step3-figures','Make_fig4CD.py')],
+    upstream=[wake_stage,sleep_stage],outputs=['./Figures/fig4CD.png'])
 
-# Run the main code for sleep plasticity -------------------------------------------------------------
-subprocess.call('python Step2-sleep_learning/UP-state-mediated_plast_fig4CD_sleep.py',shell=True)
 
-# Run the code to generate the figures ---------------------------------------------------------------
+# ====================================================================================================
+# Run the steps that are not in the cache
+# ====================================================================================================
 
-subprocess.call('python Step3-figures/Make_fig4CD.py',shell=True)
+stages = [wake_stage,sleep_stage,figure_stage]
+results = Pipeline.run(stages,Pipeline.Cache('./Data/cache'),
+    settings={'trial': trial, 'backend': wake.SS.Backend},
+    force=[s.name for s in stages] if force else ())
+save_data(results['wake'],results['sleep'])
 
 
 # stop counting the time and show the total time spent -----------------------------------------------
@@ -58,6 +116,3 @@ total_time = (time_end-time_in)/60. # [min]
 print('\n')
 print('Simulation finally finished!')
 print('Total time = {0:.2f} minutes'.format(total_time))
-
-
-
@@ -10,12 +10,14 @@
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 rcParams.update({'figure.autolayout': True})
-import os
+import os, sys
 import numpy as np
 from matplotlib.gridspec import GridSpec
 from matplotlib.pyplot import cm
 import matplotlib as mpl
 
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+from SimCore import Moments, Pipeline, TrialStore
 
 mpl.rcParams['axes.linewidth'] = 2
 mpl.rcParams['xtick.major.width'] = 2
@@ -37,9 +39,6 @@ plt.ion()
 cmap = cm.inferno
 color0 = cmap(70)
 
-fig = plt.figure(num=1,figsize=(7*0.7, 6*0.7), dpi=100, facecolor='w')
-gs1 = GridSpec(1, 1)
-
 def hide_frame(ax):
 	ax.spines['right'].set_visible(False)
 	ax.spines['top'].set_visible(False)
@@ -50,42 +49,65 @@ def hide_frame(ax):
 # Use the data generated with 1-Neuromodulation_and_plasticity.py 
 # ================================================================================================================
 
-# ----------------------------------------------------------------------------------------------------------------
-# Plot the weights after a fixed time
-
-# Choose the directory and rearrange the files
-Dir = 'Data/'
-fnames = os.listdir(Dir)
-fnames.sort()
-
-
-# Create the first subplot to show the weights
-ax1 = plt.subplot(gs1[0, 0])
-hide_frame(ax1)
-
-plt.xlabel(r'Initial weight, $w_0$',fontsize='20',fontweight=900)
-plt.ylabel(r'Rel. weight change, $\Delta w/w_0$', fontsize='19')
-plt.xlim((0,1.05))
-
-W0 = np.array([])
-Wend = np.array([])
-
-for i in range(len(fnames)):
-	data = np.load(Dir+fnames[i])
-	W0 = np.append(W0,data[0,0])
-	Wend = np.append(Wend,data[1,0])
-
-n_trials = len(fnames)
-
-W0_mean = np.mean(np.reshape(W0,(n_trials,100)),axis=0)
-Wend_mean = np.mean(np.reshape((Wend-W0)/W0,(n_trials,100)),axis=0)
-
-Wend_std = np.std(np.reshape((Wend-W0)/W0,(n_trials,100)),axis=0)
-
-plt.plot(W0_mean,Wend_mean,color=color0,lw=1.5)
-plt.fill_between(W0_mean,Wend_mean-Wend_std,Wend_mean+Wend_std,alpha=.3,color=color0)
-
-
-# ----------------------------------------------------------------------------------------------------------------
-# Choose the directory and save the figures
-plt.savefig('Figures/fig4E.png',dpi=400)
\ No newline at end of file
+def summary(data):
+	# Initial weight and relative weight change of each synapse, [NTrials x 2 x NE], from the
+	# initial and final weights of the trials, [NTrials x 2 x 1 x NE]
+	w0 = data[:,0,0]
+	return np.stack((w0,(data[:,1,0]-w0)/w0),axis=1)
+
+def moments(blocks):
+	# The trials are read in blocks (e.g. memory-mapped) and only the running mean and
+	# variance of each synapse are kept (see SimCore/Moments.py): w0 and dw/w0
+	S = Moments.Moments()
+	for data in blocks:
+		S.add_block(summary(data))
+	return split(S)
+
+def split(S):
+	# The Moments of w0 and of dw/w0 from the Moments of summary()
+	if S.n == 0:
+		return Moments.Moments(), Moments.Moments()
+	return Moments.Moments(S.n,S.mean[0],S.M2[0]), Moments.Moments(S.n,S.mean[1],S.M2[1])
+
+def open_store(Dir='Data/'):
+	# Open the store of the trials (see SimCore/TrialStore.py). If there is none, it is created by
+	# trial_store of SimStep.py, which imports the trials saved one per file (Data/Wall_XXX.npy).
+	if not os.path.exists(Dir+'Wall.store'):
+		SS = Pipeline.load_stage(os.path.dirname(os.path.abspath(__file__)))[1]
+		return SS.trial_store(Dir+'Wall.store')
+	return TrialStore.TrialStore(Dir+'Wall.store')
+
+def plot(W0,dW,path='Figures/fig4E.png'):
+	# ------------------------------------------------------------------------------------------------------------
+	# Plot the weights after a fixed time
+
+	fig = plt.figure(num=1,figsize=(7*0.7, 6*0.7), dpi=100, facecolor='w')
+	gs1 = GridSpec(1, 1)
+
+	# Create the first subplot to show the weights
+	ax1 = plt.subplot(gs1[0, 0])
+	hide_frame(ax1)
+
+	plt.xlabel(r'Initial weight, $w_0$',fontsize='20',fontweight=900)
+	plt.ylabel(r'Rel. weight change, $\Delta w/w_0$', fontsize='19')
+	plt.xlim((0,1.05))
+
+	W0_mean = W0.mean
+	Wend_mean = dW.mean
+
+	Wend_std = dW.std()
+
+	plt.plot(W0_mean,Wend_mean,color=color0,lw=1.5)
+	plt.fill_between(W0_mean,Wend_mean-Wend_std,Wend_mean+Wend_std,alpha=.3,color=color0)
+
+	# --------------------------------------------------------------------------------------------------------
+	# Choose the directory and save the figures
+	plt.savefig(path,dpi=400)
+
+
+if __name__ == '__main__':
+	store = open_store('Data/')
+	if not len(store.trials()):
+		sys.exit('No trials in Data/: run UP-state-mediated_plast_fig4E.py or run_code.py first')
+	W0, dW = moments(store.blocks())
+	plot(W0,dW)
@@ -14,16 +14,159 @@ import numpy as np
 from imp import reload
 import params; reload(params); import params as p
 
+# ------------------------ Select the backend ------------------------------------
+# "numpy": one call to SimStep per integration step (default)
+# "numba": fused and compiled time loop from SimCore/StepKernel.py. Falls back to
+#          "numpy" if Numba is not installed.
+# The default can be changed with the environment variable SIMSTEP_BACKEND.
+
+import os, sys, warnings
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+from SimCore import StepKernel, Integrator, NoiseSource, Streams, Plasticity, Network, Simulator, Recorders, Spikes, Checkpoint, Metrics, TrialCache, TrialStore
+
+def set_backend (name):
+	global Backend
+	Backend = StepKernel.resolve_backend(name)
+
+set_backend(os.environ.get('SIMSTEP_BACKEND','numpy'))
+
+# ------------------------ Select the integrator ---------------------------------
+# "euler" (default) or "exponential", and the time step dt, for this run. Updates the
+# step factors and nSteps in params (see SimCore/Integrator.py). The defaults
+# can be changed with the environment variables SIMSTEP_INTEGRATOR and SIMSTEP_DT.
+
+def set_integrator (method,dt=None):
+	global Rules
+	Integrator.configure(p,method,dt)
+	if method == "exponential":
+		warnings.warn('The exponential integrator is not valid for Figure 4E: the depression of the largest '
+			'weights is 2-4 times weaker than with "euler" (see SimCore/Integrator.py)',RuntimeWarning,stacklevel=2)
+	Rules = {} # the rules keep step factors that depend on dt
+
+set_integrator(os.environ.get('SIMSTEP_INTEGRATOR',p.integrator),os.environ.get('SIMSTEP_DT',p.dt))
+
+# ------------------------ External current --------------------------------------
+# The noise of the external current is generated in blocks of p.noise_block steps
+# (see SimCore/NoiseSource.py). Each trial draws it from its own random stream,
+# keyed by (p.experiment, trial, p.phase) (see SimCore/Streams.py). A new source
+# is created when the shape of the current, the trials or the integrator change.
+
+Noise = None
+Trials = None
+
+def set_trials (trials):
+	# ----------------------------------------------------------------------------
+	# Trial numbers of the simulations that follow: an int for variables without
+	# a trial axis, or one int per entry of the leading trial axis. By default,
+	# trial 0 or trials 0, 1, ..., NTrials-1. The streams restart from the beginning.
+	# ----------------------------------------------------------------------------
+	global Trials, Noise
+	Trials = trials
+	Noise = None
+
+def _source (shape):
+	global Noise
+	if Noise is None or Noise.shape != shape or (Noise.a,Noise.substeps) != NoiseSource.resolution(p):
+		trials = Trials
+		if trials is None:
+			trials = 0 if len(shape) == 1 else range(shape[0])
+		Noise = NoiseSource.from_params(p,shape,Streams.generators(p,trials,p.phase))
+	return Noise
+
+# ------------------------ Select the precision ----------------------------------
+# "float64" (default) or "float32": dtype of the state variables, the external
+# current and what the recorders keep, in the runs that follow. It is kept in
+# p.precision, so it enters the keys of the caches. The default can be changed
+# with the environment variable SIMSTEP_PRECISION. Validation/check_precision.py
+# compares both.
+
+def set_precision (name):
+	global Rules, Noise
+	if name not in ("float64","float32"):
+		raise ValueError('Unknown precision "{0}", use "float64" or "float32"'.format(name))
+	p.precision = name
+	Rules, Noise = {}, None
+
+set_precision(os.environ.get('SIMSTEP_PRECISION',p.precision))
+
+def cast (x):
+	# x in the precision of the runs (not copied if it already is)
+	return np.asarray(x,dtype=p.precision)
+
+# ------------------------ Checkpoints -------------------------------------------
+# A long run can save its state every p.checkpoint_every steps in path and, with
+# resume=True, continue from the last checkpoint (see SimCore/Checkpoint.py).
+# state is the list of the state variables of the run, in the order of SimStep.
+
+def checkpoint (path,state,recorders=(),raster=None,arrays=None,resume=False):
+	return Checkpoint.Checkpoint(path,p.checkpoint_every,state,lambda: _source(state[6].shape),
+		recorders,raster,arrays,Checkpoint.meta(p,Trials),resume)
+
+# ------------------------ Instrumentation ---------------------------------------
+# With a metrics file, the runs that follow time the phases of the step, count
+# the spikes and the clipped weights, and report their progress every `every`
+# steps (see SimCore/Metrics.py). Off by default; the environment variable
+# SIMSTEP_METRICS gives a file.
+
+Monitor = None
+
+def set_metrics (path,every=None,label=''):
+	global Monitor
+	Monitor = None if not path else Metrics.Monitor(path,every,label)
+
+set_metrics(os.environ.get('SIMSTEP_METRICS'))
+
+# ------------------------ Cache of the trials -----------------------------------
+# Results of single trials are cached under a key hashing the parameters, the
+# trial and the code of this figure (see SimCore/TrialCache.py). The results of
+# a run are written in one store (see SimCore/TrialStore.py), whose header keeps
+# the experiment, seed and parameters that produced them. The code version is
+# only in the keys of the cache, so a change of the code does not lock out the
+# existing store.
+
+Engine = None
+
+def engine ():
+	global Engine
+	if Engine is None:
+		here = os.path.dirname(os.path.abspath(__file__))
+		Engine = TrialCache.engine([os.path.join(here,f)
+			for f in ('UP-state-mediated_plast_fig4E.py','SimStep.py','params.py')],globals())
+	return Engine
+
+def trial_key (trial):
+	return TrialCache.key(p,trial,engine())
+
+def trial_store (path='Data/Wall.store'):
+	# ----------------------------------------------------------------------------
+	# Store of the initial and final weights of the trials, [2 x 1 x NE] per trial.
+	# If it does not exist, the trials archived one per file next to it
+	# (Wall_XXX.npy) are imported into it, as trials of the current parameters.
+	# A store of other parameters raises an error.
+	# ----------------------------------------------------------------------------
+	meta = {'experiment': p.experiment, 'seed': p.seed, 'params': TrialCache.params_record(p)}
+	if not os.path.exists(path):
+		fnames,trials = TrialStore.archived(os.path.dirname(path) or '.','Wall')
+		TrialStore.import_files(path,fnames,trials,meta,shape=(2,1,p.NE),dtype=p.precision)
+	store = TrialStore.TrialStore(path)
+	if {k: store.meta.get(k) for k in meta} != meta:
+		raise ValueError('{0} holds trials of other parameters, remove it first'.format(path))
+	return store
 
 # ================================================================================
 # Main code ----------------------------------------------------------------------
 def _rect (x): return x*(x>0.)
 
-def _Iext (Ipre):
-	taufilt = 20 # [ms] filtering time constant
-	Iext = Ipre - (Ipre-_rect((np.random.normal(0,1.8,p.NE+1))**3.))*p.dt/taufilt
-	Iext[-1] = Ipre[-1] - (Ipre[-1]-(9+_rect((np.random.normal(0,0.0001,1)))))*p.dt/taufilt
-	return Iext
+# ------------------------ Plasticity rule ---------------------------------------
+# p.rule (see SimCore/Plasticity.py), with the coefficients of each state of the
+# network s resolved once.
+
+Rules = {}
+
+def _rule (s):
+	if s not in Rules:
+		Rules[s] = Plasticity.make(p.rule,p,s)
+	return Rules[s]
 
 def SimStep (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,s):
 	# ----------------------------------------------------------------------------
@@ -35,6 +178,10 @@ def SimStep (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,s):
 	# WEE: [NExNE] Excitatory synaptic weights
 	# Iext: [NE] External current for each neuron
 	# s: [str] "up" or "down" - state of the network
+	#
+	# All the state variables may carry a leading trial axis (batched mode), e.g.
+	# u: [NTrials x NE+1], gSynE: [NTrials x NE], WEE: [NTrials x 1 x NE]. Each
+	# trial is then advanced independently within the same call.
 	# ----------------------------------------------------------------------------
 	# - Returns as output: (all variables for time t+dt)
 	# u_out: 
@@ -42,43 +189,30 @@ def SimStep (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,s):
 	# xbar_post_out 
 	# gSynE_out 
 	# WEE_out
+	# The step itself is in SimCore/Network.py.
+	# ----------------------------------------------------------------------------
+	return Network.step(p,_rule(s),u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,_source(Iext.shape))
+
+def SimRun (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,s,nSteps,Wacc=None,raster=None):
+	# ----------------------------------------------------------------------------
+	# Advances nSteps integration steps with the selected backend and returns the
+	# variables after the last step, in the same order as SimStep.
+	# raster: SpikeRaster recording the spikes (see SimCore/Spikes.py), or None
+	# Wacc: [1xNE] if given, WEE is kept fixed and the changes it would undergo
+	#   are added to Wacc in place
+	# ----------------------------------------------------------------------------
+	u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext = [cast(x) for x in (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext)]
+	rule = _rule(s) if Wacc is None else Plasticity.Frozen(_rule(s),Wacc)
+	return Network.run(p,Backend,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,
+		_source(Iext.shape),raster=raster,metrics=Monitor)
+
+def simulator (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,s,Wacc=None,raster=None):
+	# ----------------------------------------------------------------------------
+	# Simulator owning a copy of the variables given, which its run(nSteps) and
+	# step() advance in place with the selected backend (see SimCore/Simulator.py).
+	# Its variables are views of them, in the same order as SimStep.
+	# Wacc: as in SimRun
 	# ----------------------------------------------------------------------------
-	
-	spikes = (u>p.Vth) # Verify all the neurons that fired an action potential
-	spikesE = spikes[:p.NE] # Excitatory neurons
-	ref += spikes*p.Tref  # update the refractory variable
-	
-	# Update the synaptic conductances
-	gSynE_out = gSynE + p.gBarEx * spikesE
-	gSynE_out = gSynE_out - gSynE_out*p.step_tauSynEx
-	
-	# Update the membrane potential
-	IsynE = -(u[-1] - p.EsynE)*np.dot(WEE,gSynE)
-	Isyn = IsynE 
-	Iext = _Iext(Iext)
-	
-	u = u + (p.Vres-u)*spikes # reset the voltage for those who spiked
-	u_out = u + (-u + p.R*Iext)*p.step_tau_m
-	u_out[-1] = u_out[-1] + (Isyn)*p.step_tau_m
-	u_out[(ref>0.001)] = p.Vres
-	u_out = u_out + (p.Vspike-u_out+p.Vth)*(u_out>p.Vth) # add a constant to "see" the spikes
-	
-	ref = _rect(ref - p.dt)
-	ref_out = ref
-	
-	# Update the synaptic traces
-	xbar_pre_out = xbar_pre + (10.-xbar_pre)*spikesE
-	xbar_pre_out = _rect(xbar_pre_out - p.dt)
-	xbar_post_out = xbar_post 
-	
-	# Update the synaptic weights
-	auxMat = np.ones((1,p.NE))
-	WEE_out = WEE + p.a_pre[s]*(auxMat*spikesE) \
-		+ (-1.*p.a_pre[s])*(auxMat*spikes[-1]) * (xbar_pre>0.)  
-	
-	if spikes[-1] > 0:
-		xbar_pre_out[:] = 0.
-	
-	WEE_out = _rect(WEE_out) - _rect(WEE_out-p.w_max) # apply bounds
-		
-	return u_out,ref_out,xbar_pre_out,xbar_post_out,gSynE_out,WEE_out,Iext
\ No newline at end of file
+	rule = _rule(s) if Wacc is None else Plasticity.Frozen(_rule(s),Wacc)
+	return Simulator.Simulator(p,Backend,rule,(u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext),
+		_source(np.shape(Iext)),raster=raster,metrics=Monitor)
@@ -6,6 +6,22 @@
 # On these simulations, synaptic weights are updated following the Up-state-mediated 
 # plasticity described in the paper.
 #
+# Usage: python UP-state-mediated_plast_fig4E.py trial [n_trials] [--checkpoint path [--resume]]
+#        [--metrics path]
+# or, when imported (e.g. by SimCore/Sweep.py), simulate(trials).
+# Runs trials trial, trial+1, ..., trial+n_trials-1 as one batch, i.e. all the state
+# variables carry a leading trial axis and every trial is advanced in the same call
+# to SimStep. The initial and final weights of each trial are written in the store
+# Data/Wall.store (see SimCore/TrialStore.py), and in the cache of trials in Cache/
+# (see SimCore/TrialCache.py).
+# Each trial draws its random numbers from its own streams (see SimCore/Streams.py),
+# so its results do not depend on how the trials are split into batches.
+# With --checkpoint, the batch is saved in path every p.checkpoint_every steps, and
+# --resume continues it from there (see SimCore/Checkpoint.py).
+# With --metrics, the time spent in each phase of the step, the spikes, the
+# clipped weights and the progress of the run are written in path (see
+# SimCore/Metrics.py).
+#
 # Author: Victor Pedrosa
 # Imperial College London, London, UK - Dec 2017
 ##################################################################################
@@ -23,82 +39,113 @@ clearall()
 
 import numpy as np
 from time import time as time_now
-import sys
+import sys, argparse
 
 from matplotlib import rcParams
 rcParams.update({'figure.autolayout': True})
 
-args = sys.argv
-trial = int(args[1])
-
 # ------------------------ Import parameters -------------------------------------
 
 from imp import reload
 import params; reload(params); import params as p
 import SimStep; reload(SimStep); import SimStep as SS
 
-time_in = time_now()
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Initialization of time-dependent variables -------------------------------------
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def simulate (trials,checkpoint=None,resume=False):
+	# ----------------------------------------------------------------------------
+	# Simulates the trials given (a list of trial numbers) as one batch and
+	# returns their initial and final weights, [2 x NTrials x 1 x NE]
+	# If checkpoint (a path) is given, the run is saved there every
+	# p.checkpoint_every steps, and with resume=True it continues from there.
+	# ----------------------------------------------------------------------------
+	NTrials = len(trials)
+	SS.set_trials(trials)
+
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Initialization of time-dependent variables ---------------------------------
+
+	# Synaptic weights -----------------------------------------------------------
+
+	WEE = np.zeros((NTrials,1,p.NE))	# E-E connections
+
+	WEE[:] = np.linspace(0.1,1.0,p.NE)
+
+	WEE += np.array([SS.Streams.generator(p,trials[tr],"init").normal(0,0.000001,(1,p.NE)) for tr in range(NTrials)])
+	WEE = SS.cast(SS._rect(WEE) - SS._rect(WEE-p.w_max))	# in the precision of the run (see SimStep.set_precision)
+
+
+	# Other variables ------------------------------------------------------------
 
-# Synaptic weights ---------------------------------------------------------------
+	xbar_pre = np.zeros((NTrials,p.NE)) 	# Synaptic traces for presynaptic events
+	xbar_post = np.zeros((NTrials,1)) 	# Synaptic traces for postsynaptic events
+	Vmemb = np.zeros((NTrials,p.NE+1))	# [mV] Membrane potential
+	ref = np.zeros((NTrials,p.NE+1))	# Variable to identify the neurons within the refractory time
+	gSynE = np.zeros((NTrials,p.NE))	# Synaptic conductance for excitatory connections
+	Iext = np.zeros((NTrials,p.NE+1))	# [pA] External current for each neuron
 
-WEE = np.zeros((1,p.NE))	# E-E connections
 
-WEE[:] = np.linspace(0.1,1.0,p.NE)
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Choose what is saved of the weights ----------------------------------------
 
-WEE += np.random.normal(0,0.000001,(1,p.NE))
-WEE = SS._rect(WEE) - SS._rect(WEE-p.w_max)
+	# Only the initial and final weights are saved, so only those are kept (see
+	# SimCore/Recorders.py for the other recorders).
 
+	WEE_var = 1.*WEE
+	recorder = SS.Recorders.Final()
 
-# Other variables ----------------------------------------------------------------
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# Run the code ---------------------------------------------------------------
 
-xbar_pre = np.zeros(p.NE) 		# Synaptic traces for presynaptic events
-xbar_post = np.zeros(1) 		# Synaptic traces for postsynaptic events
-Vmemb = np.zeros(p.NE+1)		# [mV] Membrane potential
-ref = np.zeros(p.NE+1)			# Variable to identify the neurons within the refractory time
-gSynE = np.zeros(p.NE)			# Synaptic conductance for excitatory connections
-Iext = np.zeros(p.NE+1)		# [pA] External current for each neuron
+	# The variables are kept by a Simulator, which advances them in place (see
+	# SimCore/Simulator.py) with the backend selected in SimStep.py (NumPy or
+	# compiled). The steps between two saved snapshots are advanced in one call.
+	# WEE is kept fixed and the weight changes are accumulated in WEE_var.
 
+	sim = SS.simulator(Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,"up",Wacc=WEE_var)
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Create variables to "save" the results -----------------------------------------
+	if checkpoint is not None:
+		checkpoint = SS.checkpoint(checkpoint,sim.variables,[recorder],arrays={'WEE_var': WEE_var},resume=resume)
+	SS.Recorders.run(sim.run,lambda: WEE_var,p.nSteps,[recorder],checkpoint,SS.Monitor)
+	WEE_all = recorder.result()	# [2 x NTrials x 1 x NE] initial and final weights
 
-subsampling = 100
-WEE_all = np.zeros((int(p.nSteps/subsampling)+1,1,p.NE))
-WEE_all[0] = WEE
-WEE_var = 1.*WEE
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+	# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# Run the code -------------------------------------------------------------------
+	return WEE_all
 
-for step in range(p.nSteps):
-	WEE_in = WEE
-	
-	Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext \
-	= SS.SimStep (Vmemb,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,"up")
-	
-	WEE_diff = WEE - WEE_in
-	WEE_var = WEE_var + WEE_diff
-	WEE = WEE_in
-		
-	if (((step+1) % subsampling) == 0):
-		WEE_all[int(step/subsampling)+1,:] = WEE_var # save the synaptic weights
 
-	
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# ++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Trials of Figure 4E')
+	parser.add_argument('trial',type=int,help='first trial of the batch')
+	parser.add_argument('n_trials',type=int,nargs='?',default=1,help='number of trials of the batch')
+	parser.add_argument('--checkpoint',default=None,help='file of the checkpoints of the run')
+	parser.add_argument('--resume',action='store_true',help='continue from the checkpoint')
+	parser.add_argument('--metrics',default=None,help='file of the timers, counters and progress of the run (JSON lines)')
+	args = parser.parse_args()
+	if args.metrics:
+		SS.set_metrics(args.metrics,label='fig4E trials {0}-{1}'.format(args.trial,args.trial+args.n_trials-1))
+	trial = args.trial
+	NTrials = args.n_trials	# Number of trials simulated in this batch
 
+	time_in = time_now()
+	WEE_all = simulate(list(range(trial,trial+NTrials)),args.checkpoint,args.resume)
 
-# Compute the total time spent with the simulation -------------------------------
+	# Compute the total time spent with the simulation ---------------------------
 
-time_end = time_now()
-time_total = time_end - time_in
+	time_end = time_now()
+	time_total = time_end - time_in
 
-np.save('Data/Wall_{0:03d}'.format(trial),WEE_all[[0,-1]])
+	store = SS.trial_store()
+	cache = SS.TrialCache.TrialCache('Cache')
+	for tr in range(NTrials):
+		store.write(trial+tr,WEE_all[:,tr])
+		cache.put(SS.trial_key(trial+tr),WEE_all[:,tr],{'trial': trial+tr,
+			'engine': SS.engine(), 'time': time_total/NTrials, 'params': SS.TrialCache.params_record(p)})
 
-print('')
-print('Trial = {1:3d} \n Total time = {0:.3f} segundos'.format(time_total,trial))
-print("finished")
\ No newline at end of file
+	print('')
+	print('Trials = {1:3d}-{2:3d} \n Total time = {0:.3f} segundos'.format(time_total,trial,trial+NTrials-1))
+	print("finished")
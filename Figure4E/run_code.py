@@ -1,6 +1,31 @@
 # ============================================================================================================
+# run_code.py -- Simulates the trials of figure 4E and generates the figure
 #
-#
+# Usage: python run_code.py [n_trials] [--chunk 5] [--processes 8] [--memory 16] [--retries 2]
+#        [--collect store|rows|summary] [--no-save] [--status] [--service [ADDRESS]]
+# Trials 0, ..., n_trials-1 (default 200) are taken from Data/Wall.store (see SimCore/TrialStore.py)
+# or from the cache of trials in Cache/ (see SimCore/TrialCache.py), and only those that are in
+# neither are simulated. The store is kept from one run to the next (if there is none, the trials
+# archived one per file, Data/Wall_XXX.npy, are imported into a new one), and only the trials that
+# are not in it are written, for Make_fig4E.py. A store of other parameters is not overwritten:
+# remove it to start again.
+# The trials are simulated in chunks by a pool of worker processes (see SimCore/Scheduler.py),
+# sized by the CPUs and the memory available (--processes, --memory in GB). A chunk that fails
+# is run again up to --retries times, and the state of every trial (done, failed or pending)
+# is kept in Data/status.json; --status prints it. Running the script again simulates only the
+# trials that are not done.
+# --collect chooses how the results reach this process (see SimCore/SharedResults.py):
+#   store:   (default) pickled through the pool and written in the store and the cache as each
+#            chunk is done; Make_fig4E.py then reads the store
+#   rows:    written by the workers in an array in shared memory, from which the figure is made
+#            directly; the store and the cache are written once at the end (not with --no-save)
+#   summary: only the running mean and variance of w0 and dw/w0 of each chunk are kept, in shared
+#            memory; the figure is made from them, and they are saved in Data/moments.npz at the
+#            end (not with --no-save). The new trials are not added to the cache.
+# --service sends the chunks as jobs to the worker service started with Service/run_service.py
+# serve (see SimCore/Service.py) instead of starting a pool, so the workers are already warm and
+# are shared with other clients (e.g. notebooks). A failed chunk is not run again; running the
+# script again retries it.
 # -----------------------------------------------------------------------
 #
 # Author: Victor Pedrosa <v.pedrosa15@imperial.ac.uk>
@@ -11,9 +36,38 @@
 # Import modules -------------------------------------------------------------------------------------
 import subprocess
 import numpy as np
-import os
+import os, sys, argparse
 from time import time as time_now
-import multiprocessing as mp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,os.path.join(HERE,os.pardir))
+from SimCore import Pipeline, Scheduler, SharedResults, Service
+
+parser = argparse.ArgumentParser(description='Trials of Figure 4E and the figure')
+parser.add_argument('n_trials',type=int,nargs='?',default=200,help='number of trials')
+parser.add_argument('--chunk',type=int,default=None,help='most trials simulated at once by a worker')
+parser.add_argument('--processes',type=int,default=None,help='most worker processes (default: CPUs - 1)')
+parser.add_argument('--memory',type=float,default=None,help='[GB] memory of all the workers (default: 80%% of the available)')
+parser.add_argument('--retries',type=int,default=2,help='times a failed chunk is run again')
+parser.add_argument('--collect',default='store',choices=['store','rows','summary'],help='how the results are collected')
+parser.add_argument('--no-save',action='store_true',help='with --collect rows or summary, do not write the results in files')
+parser.add_argument('--status',action='store_true',help='print the state of the trials of the last run and exit')
+parser.add_argument('--service',nargs='?',const='',default=None,metavar='ADDRESS',help='run the chunks in the worker service')
+args = parser.parse_args()
+if args.no_save and args.collect == 'store':
+	parser.error('--no-save needs --collect rows or summary')
+if args.service is not None and args.collect != 'store':
+	parser.error('--service needs --collect store')
+
+NTrials = args.n_trials
+CacheSize = 2**30	# [bytes] Size above which the least recently used trials are removed from the cache
+StatusFile = 'Data/status.json'
+
+if args.status:
+	if not os.path.exists(StatusFile):
+		sys.exit('No run in {0}'.format(StatusFile))
+	print(Scheduler.Status.load(StatusFile).report())
+	sys.exit(0)
 
 # Create new directories to store data ---------------------------------------------------------------
 
@@ -33,15 +87,123 @@ time_in = time_now()
 # Run the simulations
 # ====================================================================================================
 
+# Find the trials that are not in the store or the cache ---------------------------------------------
+# The keys are computed with the same params.py and SimStep.py (and environment) as the simulations.
+
+p, SS = Pipeline.load_stage(HERE)
+cache = SS.TrialCache.TrialCache('Cache',CacheSize)
+store = SS.trial_store()
+stored = set(int(tr) for tr in store.trials() if tr < NTrials)
+keys = [SS.trial_key(tr) for tr in range(NTrials)]
+missing = [tr for tr in range(NTrials) if tr not in stored and not cache.has(keys[tr])]
+print('{0} of {1} trials found in the store, {2} in the cache, {3} to simulate'.format(
+	len(stored),NTrials,NTrials-len(stored)-len(missing),len(missing)))
+
 # Run the main code for homogeneous stimulation ------------------------------------------------------
-def run_trial(tr):
-	subprocess.call('python UP-state-mediated_plast_fig4E.py {0}'.format(tr),shell=True)
+# The missing trials are simulated in chunks by worker processes (see SimCore/Scheduler.py), which
+# load UP-state-mediated_plast_fig4E.py once and send back the weights of each chunk; this process
+# writes them in the store and the cache. Each chunk keeps a checkpoint in Data/ (see
+# SimCore/Checkpoint.py), so a chunk interrupted in a previous run of this script continues from it.
+
+# With --collect rows or summary the workers write the results in shared memory instead (see
+# SimCore/SharedResults.py), where the trials in the store and the cache are also put, and nothing
+# is written until all the chunks are done.
+done = sorted(set(range(NTrials))-set(missing))
+
+def result (tr):
+	# Result of a trial done before, from the store or the cache
+	return store.W[tr] if tr in stored else cache.get(keys[tr])
+
+chunk = Scheduler.chunk_size(NTrials,args.processes,args.chunk)
+collect = None
+if args.collect == 'rows':
+	collect = SharedResults.Rows(NTrials,(2,1,p.NE),p.precision)
+	for tr in done:
+		collect.put(tr,[tr],result(tr)[None])
+elif args.collect == 'summary':
+	# One slot per chunk, and one for the trials of the store and the cache
+	collect = SharedResults.Summary(NTrials,chunk,(2,p.NE),(os.path.join(HERE,'Make_fig4E.py'),'summary'))
+	for tr in done:
+		collect.add(result(tr)[None])
+
+def save_trial (tr,w,seconds):
+	cache.put(keys[tr],w,{'trial': tr, 'engine': SS.engine(), 'time': seconds,
+		'params': SS.TrialCache.params_record(p)})
+
+if collect is None:
+	# The trials of the cache that are not in the store are written in it, and the others as their
+	# chunks are done
+	for tr in done:
+		if tr not in stored:
+			store.write(tr,cache.get(keys[tr]))
+
+times = {}
+def save_chunk (trials,W,seconds):
+	if collect is None:
+		for tr,w in zip(trials,W):
+			store.write(tr,w)
+			save_trial(tr,w,seconds/len(trials))
+	for tr in trials:
+		times[tr] = seconds/len(trials)
+
+def run_service (address):
+	# The chunks are jobs of the worker service, with the backend and precision of this process
+	status = Scheduler.Status(StatusFile,range(NTrials),done)
+	status.save()
+	if not missing:
+		return status
+	with Service.Client(address or None) as client:
+		jobs = {}
+		for first,n in Scheduler.chunks(missing,args.chunk or 10):
+			trials = list(range(first,first+n))
+			jobs[client.submit({'script': 'fig4E', 'args': (trials,), 'backend': SS.Backend,
+				'params': {'precision': p.precision}})] = trials
+		print('Service: {0} trials in {1} jobs'.format(len(missing),len(jobs)))
+		for message in client.messages(jobs):
+			trials = jobs[message[1]]
+			if message[0] == 'result':
+				save_chunk(trials,np.moveaxis(message[2],1,0),message[3])
+				status.set(trials,'done')
+				print('Service: trials {0} done ({1:.1f} s)'.format(Scheduler.ranges(trials),message[3]))
+			elif message[0] == 'error':
+				status.set(trials,'failed',message[2])
+				print('Service: trials {0} failed: {1}'.format(Scheduler.ranges(trials),message[2].strip().splitlines()[-1]))
+			status.save()
+	return status
+
+try:
+	if args.service is not None:
+		status = run_service(args.service)
+	else:
+		status = Scheduler.run(os.path.join(HERE,'UP-state-mediated_plast_fig4E.py'),missing,save_chunk,
+			chunk,args.processes,None if args.memory is None else args.memory*2**30,args.retries,
+			StatusFile,'Data/checkpoint_{0}_{1}.pkl',done=done,collect=collect)
+	print(status.report())
 
-NTrials = 200
-quant_proc = np.max((mp.cpu_count()-1,1))
-pool = mp.Pool(processes=quant_proc)
+	# The results in shared memory are persisted once (or not at all with --no-save)
+	if args.collect == 'rows' and not args.no_save:
+		for tr in map(int,collect.done()):
+			if tr in stored:
+				continue
+			store.write(tr,collect.W.array[tr])
+			if tr in times:
+				save_trial(tr,collect.W.array[tr],times[tr])
+	elif args.collect == 'summary' and not args.no_save:
+		collect.total().save('Data/moments.npz')
+	if collect is None or not args.no_save:
+		cache.evict(keep=keys)
 
-res = pool.map(run_trial,[i for i in range(NTrials)])
+	# Figure from the results in memory
+	if collect is not None:
+		Make = Pipeline.load_script(os.path.join(HERE,'Make_fig4E.py'))
+		if args.collect == 'rows':
+			W0, dW = Make.moments([collect.get(None,collect.done())])
+		else:
+			W0, dW = Make.split(collect.total())
+		Make.plot(W0,dW)
+finally:
+	if collect is not None:
+		collect.close()
 
 # stop counting the time and show the total time spent -----------------------------------------------
 time_end = time_now()
@@ -54,4 +216,5 @@ print('Total time = {0:.2f} minutos'.format(total_time))
 
 # Run the code to generate the figures ---------------------------------------------------------------
 
-subprocess.call('python Make_fig4E.py',shell=True)
+if collect is None:
+	subprocess.call('python Make_fig4E.py',shell=True)
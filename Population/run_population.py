@@ -0,0 +1,89 @@
+##################################################################################
+# run_population.py -- Plasticity in a population of postsynaptic neurons with
+# sparse connectivity (see SimCore/Population.py)
+#
+# Usage: python Population/run_population.py [--phase sleep] [--pre 1000]
+#        [--post 1000] [--p-conn 0.1] [--t-max 10000] [--trial 0] [--drive event]
+#        [--plasticity lazy] [--save path]
+# N_post postsynaptic neurons each receive, with probability p_conn, each of N_pre
+# presynaptic neurons driven by external noise, with the model and parameters of
+# Figure4CD/Step1-wake_learning (phase "wake", STDP) or of
+# Figure4CD/Step2-sleep_learning (phase "sleep", Up-state-mediated plasticity).
+# The initial weights are 0.2 +- 0.02 (wake) or uniform between 0.1 and 1.0 (sleep).
+# The backend and integrator are selected as in SimStep.py (SIMSTEP_BACKEND), and
+# the synaptic drive is summed every step ("dense") or updated at the spikes
+# ("event"), and the weights are updated every step ("step") or at the spikes only
+# ("lazy"), see SimCore/Population.py.
+#
+# Prints the number of synapses, the time per step, the firing rates and the mean
+# relative weight change; --save writes the connectivity and the initial and
+# final weights (.npz).
+##################################################################################
+
+
+import os, sys
+import argparse
+import numpy as np
+from time import time as time_now
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+sys.path.insert(0,ROOT)
+from SimCore import Pipeline, Population, Plasticity, Streams, Spikes
+
+
+STAGES = {'wake': ('Step1-wake_learning',"wake"), 'sleep': ('Step2-sleep_learning',"up")}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Plasticity in a population with sparse connectivity')
+	parser.add_argument('--phase',default='sleep',choices=sorted(STAGES),help='parameters and rule of the run')
+	parser.add_argument('--pre',type=int,default=1000,help='number of presynaptic neurons')
+	parser.add_argument('--post',type=int,default=1000,help='number of postsynaptic neurons')
+	parser.add_argument('--p-conn',type=float,default=None,help='connection probability (default: 100 inputs per neuron)')
+	parser.add_argument('--t-max',type=float,default=1e4,help='[ms] duration of the run')
+	parser.add_argument('--trial',type=int,default=0,help='trial (random streams) of the run')
+	parser.add_argument('--drive',default='dense',choices=Population.DRIVES,help='computation of the synaptic drive')
+	parser.add_argument('--plasticity',default='step',choices=Population.PLASTICITY,help='updates of the weights')
+	parser.add_argument('--save',default=None,help='file of the results (.npz)')
+	args = parser.parse_args()
+
+	folder,s = STAGES[args.phase]
+	p, SS = Pipeline.load_stage(os.path.join(ROOT,'Figure4CD',folder))
+	p.t_max = args.t_max
+	SS.set_integrator(p.integrator,p.dt)
+	p_conn = args.p_conn if args.p_conn is not None else min(1.,100./args.pre)
+
+	# Connectivity and initial weights -------------------------------------------
+	rng = Streams.generator(p,args.trial,"init")
+	conn = Population.random(args.pre,args.post,p_conn,rng)
+	if args.phase == 'wake':
+		W = 0.2 + 0.02*rng.random(conn.nSyn) - 0.02*rng.random(conn.nSyn)
+	else:
+		W = rng.uniform(0.1,1.0,conn.nSyn)
+	W = np.clip(W,0.,p.w_max)
+	W0 = W.copy()
+
+	state = Population.initial_state(conn,W)
+	source = Population.source(p,conn,Streams.generator(p,args.trial,p.phase))
+	rule = Plasticity.make(p.rule,p,s)
+	raster = Spikes.SpikeRaster(conn.N_pre+conn.N_post,dt=p.dt)
+	nbytes = conn.nbytes() + state[2].nbytes + state[5].nbytes
+	print('Population: {0} x {1} neurons, {2} synapses ({3:.1f} MB), {4} steps, backend {5}, {6} drive, {7} plasticity'.format(
+		conn.N_pre,conn.N_post,conn.nSyn,nbytes/2.**20,p.nSteps,SS.Backend,args.drive,args.plasticity))
+
+	# Run ------------------------------------------------------------------------
+	time_in = time_now()
+	state[:] = Population.run(p,SS.Backend,rule,conn,*state,p.nSteps,source,raster=raster,
+		drive=args.drive,plasticity=args.plasticity)
+	time_total = time_now() - time_in
+
+	rates = raster.rates()
+	W = state[5]
+	print('Time per step = {0:.3f} ms ({1:.1f} ns per synapse)'.format(
+		1000.*time_total/p.nSteps,1e9*time_total/p.nSteps/max(conn.nSyn,1)))
+	print('Rates: presynaptic {0:.2f} Hz, postsynaptic {1:.2f} +- {2:.2f} Hz'.format(
+		rates[:conn.N_pre].mean(),rates[conn.N_pre:].mean(),rates[conn.N_pre:].std()))
+	print('Mean weight {0:.4f} -> {1:.4f}, dw/w0 = {2:.5f}'.format(W0.mean(),W.mean(),np.mean((W-W0)/W0)))
+
+	if args.save:
+		np.savez(args.save,indptr=conn.indptr,pre=conn.pre,W0=W0,W=W,rates=rates)
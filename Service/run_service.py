@@ -0,0 +1,75 @@
+##################################################################################
+# run_service.py -- Starts, queries and stops the worker service (see SimCore/Service.py)
+#
+# Usage: python Service/run_service.py serve [--processes 8] [--scripts fig4E wake]
+#        [--backend numba] [--address ADDRESS]
+#        python Service/run_service.py status|stop [--address ADDRESS]
+#        python Service/run_service.py fig4E [--trials 0 1 2 3] [--param gBarEx 0.5]
+#        [--seed 1] [--progress 0] [--address ADDRESS]
+# serve keeps a pool of workers with the scripts loaded until stop (or Ctrl-C).
+# fig4E runs trials of Figure 4E in the service (one job per trial) and prints
+# the mean relative weight change; from Python, the same is
+#   with Service.Client() as client:
+#       W = client.run({'script': 'fig4E', 'args': ([0,1,2],), 'params': {'gBarEx': 0.5}})
+# The address (a Unix socket in the temporary folder by default, or host:port)
+# and the key (by default a random key of the user in ~/.simcore/service.key)
+# can also be set with SIMSTEP_SERVICE and SIMSTEP_SERVICE_KEY. host:port must
+# be a loopback address (e.g. localhost:6150).
+##################################################################################
+
+
+import os, sys, ast
+import argparse
+import numpy as np
+from time import time as time_now
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+sys.path.insert(0,ROOT)
+from SimCore import Service
+
+
+def value (text):
+	# Numbers (and other Python literals) are parsed; anything else is kept as text
+	try:
+		return ast.literal_eval(text)
+	except (ValueError,SyntaxError):
+		return text
+
+def show (k,record):
+	if record['event'] == 'progress':
+		print('  trial {0}: {1:5.1f}% ({2}/{3} steps), {4:.0f} steps/s'.format(
+			args.trials[k],100.*record['step']/record['nSteps'],record['step'],record['nSteps'],record['steps_per_s']))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Worker service of the simulations')
+	parser.add_argument('command',choices=['serve','status','stop','fig4E'],help='what to do')
+	parser.add_argument('--address',default=None,help='Unix socket or host:port (default: SIMSTEP_SERVICE)')
+	parser.add_argument('--processes',type=int,default=None,help='serve: number of workers (default: CPUs - 1)')
+	parser.add_argument('--scripts',nargs='+',default=list(Service.SCRIPTS),help='serve: scripts loaded by the workers')
+	parser.add_argument('--backend',default=None,help='serve: "numpy" or "numba" (default: SIMSTEP_BACKEND)')
+	parser.add_argument('--trials',type=int,nargs='+',default=[0,1,2,3],help='fig4E: trials to simulate')
+	parser.add_argument('--param',nargs=2,action='append',default=[],metavar=('NAME','VALUE'),help='fig4E: parameter value')
+	parser.add_argument('--seed',type=int,default=None,help='fig4E: seed of the random streams')
+	parser.add_argument('--progress',type=int,default=None,help='fig4E: steps between progress reports (0: every 5%%)')
+	args = parser.parse_args()
+
+	if args.command == 'serve':
+		Service.Server(args.address,args.processes,args.scripts,args.backend).serve()
+		sys.exit(0)
+
+	with Service.Client(args.address) as client:
+		if args.command == 'status':
+			for k,v in client.status().items():
+				print('{0:>10s}: {1}'.format(k,v))
+		elif args.command == 'stop':
+			client.shutdown()
+			print('Service stopping')
+		else:
+			time_in = time_now()
+			params = {name: value(v) for name,v in args.param}
+			W = client.map([{'script': 'fig4E', 'args': ([tr],), 'params': params, 'seed': args.seed,
+				'progress': args.progress} for tr in args.trials],show)
+			W = np.concatenate(W,axis=1)	# [2 x NTrials x 1 x NE]
+			print('{0} trials: mean dw/w0 = {1:.5f} ({2:.1f} s)'.format(
+				len(args.trials),np.mean((W[1]-W[0])/W[0]),time_now()-time_in))
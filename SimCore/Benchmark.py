@@ -0,0 +1,221 @@
+##################################################################################
+# Benchmark.py -- Speed and memory of the simulator, and regressions between runs
+#
+# Two kinds of cases:
+#   step: SimRun of a figure (see the SimStep.py of each figure) for a number of
+#         neurons NE, a batch of trials, a rule and a backend:
+#           "stdp":   wake STDP (Figure4CD/Step1-wake_learning)
+#           "up":     Up-state-mediated plasticity (Figure4E)
+#           "frozen": Up-state-mediated plasticity with the weights kept fixed and
+#                     their changes accumulated (Figure4E, Wacc)
+#         and a precision (float64, or float32, see SimStep.set_precision), with
+#         SimRun or with a Simulator (see SimCore/Simulator.py) advancing the
+#         batch in place.
+#         Each case runs steps until min_time seconds have passed, repeats that
+#         `repeats` times and keeps the fastest. It gives steps_per_s (of the
+#         whole batch), trials_per_s (complete trials of p.nSteps steps) and
+#         peak_mb, the peak of the memory allocated during a short run (tracemalloc,
+#         measured apart so that it does not slow the timed runs).
+#   e2e:  run_code.py of a figure on a copy of the repository (so that the cache
+#         and data of the figure are not used nor changed), in a new process. It
+#         gives wall_s and max_rss_mb, the memory high-water mark of the processes.
+#
+# The results of a run are saved as JSON, {'meta': ..., 'results': [case]}, with
+# every case named by its parameters (e.g. "step/up/numba/NE=1000/B=16", with
+# "/float32" added in single precision and "/Simulator" with a Simulator), and
+# compare matches the cases of two runs by name.
+##################################################################################
+
+
+import os, sys, json, time, shutil, platform, subprocess, tempfile, tracemalloc
+import numpy as np
+
+from SimCore import Pipeline, StepKernel
+
+
+ROOT = os.path.dirname(Pipeline.CORE)
+
+RULES = {'stdp': (os.path.join('Figure4CD','Step1-wake_learning'),"wake"),
+	'up': ('Figure4E',"up"), 'frozen': ('Figure4E',"up")}
+
+# Metrics: 1 if larger is better, -1 if smaller is better
+METRICS = {'steps_per_s': 1, 'trials_per_s': 1, 'peak_mb': -1, 'wall_s': -1, 'max_rss_mb': -1}
+
+
+# ================================================================================
+# Step cases ---------------------------------------------------------------------
+
+Stages = {}
+
+def _stage (rule):
+	folder = RULES[rule][0]
+	if folder not in Stages:
+		Stages[folder] = Pipeline.load_stage(os.path.join(ROOT,folder))
+	return Stages[folder]
+
+def _state (p,B):
+	# Initial state of a batch of B trials, with the weights of Figure4E
+	WEE = np.zeros((B,1,p.NE),dtype=p.precision)
+	WEE[:] = np.linspace(0.1,1.0,p.NE)
+	return [np.zeros(shape,dtype=p.precision) for shape in ((B,p.NE+1),(B,p.NE+1),(B,p.NE),(B,1),(B,p.NE))] \
+		+ [WEE,np.zeros((B,p.NE+1),dtype=p.precision)]
+
+def _runner (rule,backend,NE,B,precision='float64',api='SimRun'):
+	# ----------------------------------------------------------------------------
+	# Function advancing a batch of B trials by n steps, and the params module.
+	# Every call continues the same batch, so that the noise source generates its
+	# blocks at the same rate as in a long run.
+	#   api: "SimRun", or "Simulator" for a Simulator created once
+	# ----------------------------------------------------------------------------
+	p, SS = _stage(rule)
+	s = RULES[rule][1]
+	SS.set_backend(backend)
+	SS.set_precision(precision)
+	SS.set_trials(range(B))
+	state, sim = None, None
+	def run (n):
+		nonlocal state, sim
+		NE0, p.NE = p.NE, NE
+		try:
+			if state is None:
+				state = _state(p,B)
+				SS.SimRun(*state,s,1) # creates the noise source
+			kw = {'Wacc': state[5].copy()} if rule == 'frozen' else {}
+			if api == 'Simulator':
+				if sim is None:
+					sim = SS.simulator(*state,s,**kw)
+				t = time.perf_counter()
+				sim.run(n)
+				return time.perf_counter() - t
+			t = time.perf_counter()
+			state[:] = SS.SimRun(*state,s,n,**kw)
+			return time.perf_counter() - t
+		finally:
+			p.NE = NE0
+	return run, p
+
+def step_case (rule,backend,NE,B,min_time=0.5,repeats=3,precision='float64',api='SimRun'):
+	# ----------------------------------------------------------------------------
+	# Speed and memory of SimRun (or a Simulator) for NE neurons and a batch of B
+	# trials
+	# ----------------------------------------------------------------------------
+	run, p = _runner(rule,backend,NE,B,precision,api)
+	run(2) # compiles the kernel, if any
+	n = 2
+	while True:
+		t = run(n)
+		if t >= min_time/4.:
+			break
+		n *= 4
+	n = max(int(n*min_time/max(t,1e-9)),1)
+	t = min(run(n) for _ in range(repeats))
+
+	run, p = _runner(rule,backend,NE,B,precision,api)
+	tracemalloc.start()
+	try:
+		run(min(n,p.noise_block))
+		peak = tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+	name = 'step/{0}/{1}/NE={2}/B={3}'.format(rule,backend,NE,B) + ('' if precision == 'float64' else '/'+precision) \
+		+ ('' if api == 'SimRun' else '/'+api)
+	return {'name': name, 'kind': 'step', 'rule': rule, 'backend': backend, 'NE': NE, 'B': B,
+		'precision': precision, 'api': api, 'steps': n,
+		'steps_per_s': n/t, 'trials_per_s': B*n/t/p.nSteps, 'peak_mb': peak/2.**20}
+
+
+# ================================================================================
+# End-to-end cases ---------------------------------------------------------------
+
+FIGURES = {'fig4E': 'Figure4E', 'fig4CD': 'Figure4CD'}
+
+# Runs a command and prints the memory high-water mark of its processes [kB]
+_RUSAGE = ('import resource, subprocess, sys; code = subprocess.call(sys.argv[1:]); '
+	'print(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss); sys.exit(code)')
+
+def e2e_case (figure,backend,args=(),t_max=None):
+	# ----------------------------------------------------------------------------
+	# Wall time and memory of run_code.py of a figure ("fig4E" or "fig4CD"), with
+	# the arguments args (e.g. the number of trials of Figure4E). t_max, if given,
+	# replaces the duration of the simulations in the params.py of the copy.
+	# ----------------------------------------------------------------------------
+	folder = FIGURES[figure]
+	ignore = shutil.ignore_patterns('__pycache__','Cache','Data','Figures','*.store','*.pkl')
+	with tempfile.TemporaryDirectory() as tmp:
+		shutil.copytree(os.path.join(ROOT,'SimCore'),os.path.join(tmp,'SimCore'),ignore=ignore)
+		shutil.copytree(os.path.join(ROOT,folder),os.path.join(tmp,folder),ignore=ignore)
+		if t_max is not None:
+			for path,dirs,files in os.walk(os.path.join(tmp,folder)):
+				if 'params.py' in files:
+					with open(os.path.join(path,'params.py'),'a') as f:
+						f.write('\nt_max = {0!r}\nnSteps = int(t_max/dt)\n'.format(float(t_max)))
+		env = dict(os.environ,SIMSTEP_BACKEND=backend)
+		t = time.perf_counter()
+		out = subprocess.run([sys.executable,'-c',_RUSAGE,sys.executable,'run_code.py']+[str(a) for a in args],
+			cwd=os.path.join(tmp,folder),env=env,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,
+			universal_newlines=True)
+		wall = time.perf_counter() - t
+	lines = out.stdout.strip().splitlines()
+	if not lines or not lines[-1].isdigit():
+		print(out.stdout)
+		raise RuntimeError('run_code.py of {0} could not be run'.format(folder))
+	if out.returncode != 0:
+		print('\n'.join(lines[-20:-1]))
+		print('Warning: run_code.py of {0} ended with exit status {1}'.format(folder,out.returncode))
+	return {'name': 'e2e/{0}/{1}/{2}'.format(figure,backend,' '.join(str(a) for a in args) or '-'),
+		'kind': 'e2e', 'figure': figure, 'backend': backend, 'args': list(args), 't_max': t_max,
+		'status': out.returncode, 'wall_s': wall, 'max_rss_mb': int(lines[-1])/2.**10}
+
+
+# ================================================================================
+# Results ------------------------------------------------------------------------
+
+def environment ():
+	# What the results depend on besides the code: machine, versions, commit
+	try:
+		commit = subprocess.run(['git','rev-parse','HEAD'],cwd=ROOT,stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL,universal_newlines=True).stdout.strip()
+	except OSError:
+		commit = ''
+	try:
+		import numba
+		numba_version = numba.__version__
+	except ImportError:
+		numba_version = None
+	return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(),
+		'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+		'python': platform.python_version(), 'numpy': np.__version__, 'numba': numba_version,
+		'numba_available': StepKernel.available(), 'commit': commit, 'engine': Pipeline.code_hash(Pipeline.core_files())}
+
+def save (path,meta,results):
+	folder = os.path.dirname(path)
+	if folder:
+		os.makedirs(folder,exist_ok=True)
+	with open(path+'.tmp','w') as f:
+		json.dump({'meta': meta, 'results': results},f,indent=1)
+	os.replace(path+'.tmp',path)
+
+def load (path):
+	with open(path) as f:
+		return json.load(f)
+
+def compare (baseline,current,threshold=0.1):
+	# ----------------------------------------------------------------------------
+	# Compares the results of two runs ({'meta', 'results'}, see save), case by
+	# case and metric by metric. Returns [(name, metric, base, value, change,
+	# regression)], change being the relative improvement (negative if worse), and
+	# regression True if the value is worse than the baseline by more than threshold.
+	# ----------------------------------------------------------------------------
+	base = {r['name']: r for r in baseline['results']}
+	rows = []
+	for r in current['results']:
+		if r['name'] not in base:
+			continue
+		for metric,sign in METRICS.items():
+			if metric not in r or metric not in base[r['name']]:
+				continue
+			b, v = base[r['name']][metric], r[metric]
+			change = sign*(v-b)/b if b else 0.
+			rows.append((r['name'],metric,b,v,change,change < -threshold))
+	return rows
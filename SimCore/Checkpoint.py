@@ -0,0 +1,100 @@
+##################################################################################
+# Checkpoint.py -- Periodic checkpoints of a run, to continue it after a crash
+#
+# Every `every` steps, a checkpoint saves all that a run needs to continue:
+#   state:     the state variables (Vmemb, ref, xbar_pre, xbar_post, gSynE, WEE, Iext)
+#   source:    the random generators and the rest of the block of the noise
+#              source (see SimCore/NoiseSource.py)
+#   recorders: what the recorders kept so far (see SimCore/Recorders.py), and the
+#              spikes recorded (see SimCore/Spikes.py)
+#   arrays:    other arrays changed in place by the run (e.g. accumulated weights)
+#   step:      the number of steps done
+# The checkpoint is written to a temporary file that then replaces the previous
+# one, so a run killed while saving still has the last complete checkpoint. A run
+# resumed from it continues with the same numbers as a run never interrupted.
+# The checkpoint is removed once the run finishes.
+##################################################################################
+
+
+import os, pickle
+import numpy as np
+
+from SimCore import Pipeline, Recorders
+
+
+def meta (p,trials):
+	# ----------------------------------------------------------------------------
+	# What identifies a run: its trials and the values of the params module p
+	# (except the interval between checkpoints, which does not change the results)
+	# ----------------------------------------------------------------------------
+	values = Pipeline.params_values(p)
+	values.pop('checkpoint_every',None)
+	return {'trials': Pipeline.canonical(trials),
+		'params': {name: Pipeline.canonical(value) for name,value in sorted(values.items())}}
+
+
+class Checkpoint (Recorders.Recorder):
+	# ----------------------------------------------------------------------------
+	# Checkpoints of a run in path, every `every` steps:
+	#   state:     list of the state variables of the run (overwritten in place when
+	#              resumed, e.g. the views of a Simulator, see SimCore/Simulator.py)
+	#   source:    function giving the NoiseSource of the run
+	#   recorders: recorders of the run
+	#   raster:    SpikeRaster of the run, or None
+	#   arrays:    {name: array} other arrays changed in place by the run
+	#   meta:      dict identifying the run (see meta); a checkpoint of another run
+	#              is not resumed
+	#   resume:    continue from the checkpoint in path, if there is one (otherwise
+	#              it is overwritten)
+	# Given to Recorders.run (checkpoint=...), which saves and restores it.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,path,every,state,source,recorders=(),raster=None,arrays=None,meta=None,resume=False):
+		self.path, self.every = path, int(every)
+		self.state, self.source = state, source
+		self.recorders, self.raster = list(recorders), raster
+		self.arrays = arrays or {}
+		self.meta = meta or {}
+		self.resume = resume
+
+	def save (self,step):
+		data = {'meta': self.meta, 'step': step,
+			'state': [np.copy(x) for x in self.state],
+			'source': self.source().state(),
+			'recorders': [r.state() for r in self.recorders],
+			'raster': None if self.raster is None else self.raster.state(),
+			'arrays': {name: np.copy(x) for name,x in self.arrays.items()}}
+		tmp = '{0}.{1}.tmp'.format(self.path,os.getpid())
+		with open(tmp,'wb') as f:
+			pickle.dump(data,f,pickle.HIGHEST_PROTOCOL)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp,self.path)
+
+	def restore (self):
+		# Restores the run from the checkpoint and returns its step (0 if none)
+		if not self.resume or not os.path.exists(self.path):
+			return 0
+		with open(self.path,'rb') as f:
+			data = pickle.load(f)
+		if data['meta'] != self.meta:
+			raise ValueError('{0} is a checkpoint of another run, remove it first'.format(self.path))
+		for x,saved in zip(self.state,data['state']):
+			x[...] = saved
+		self.source().restore(data['source'])
+		for r,state in zip(self.recorders,data['recorders']):
+			r.restore(state)
+		if self.raster is not None:
+			self.raster.restore(data['raster'])
+		for name,x in data['arrays'].items():
+			self.arrays[name][...] = x
+		print('Resumed from {0} at step {1}'.format(self.path,data['step']))
+		return data['step']
+
+	def sample (self,step,x):
+		self.save(step)
+
+	def finish (self,step,x):
+		# The run is complete, its checkpoint is no longer needed
+		if os.path.exists(self.path):
+			os.remove(self.path)
@@ -0,0 +1,119 @@
+##################################################################################
+# Convergence.py -- Early termination of a run once the weights are stationary
+#
+# A Stop given to Recorders.run with the recorders checks a statistic of the
+# weights every `every` steps and ends the run when it is stationary:
+#   "drift": relative change of the weights between two checks,
+#            |W - W_prev| / |W_prev|; stationary when it stays below tol for
+#            `window` checks in a row
+#   "sn":    S/N of the weights, max(W)/mean(W) (as in Make_fig4CD.py)
+#   f:       any function of the weights giving one value per trial
+#            (f(W) -> [NTrials]); "sn" and f are stationary when their relative
+#            range, (max - min)/|mean|, over the last `window` checks is below tol
+# With a batch of trials (first axis), the run ends when all of them are
+# stationary. The recorders then end at that step (Every keeps the snapshots
+# taken so far), and record() gives the criterion, the step and the time at
+# which the run ended, to be saved with the results.
+##################################################################################
+
+
+import json
+import numpy as np
+
+from SimCore import Recorders
+
+
+# ================================================================================
+# Statistics ---------------------------------------------------------------------
+
+def _rows (x):
+	x = np.asarray(x,dtype=float)
+	return x.reshape(len(x),-1) if x.ndim > 1 else x.reshape(1,-1)
+
+def drift (x,previous):
+	# Relative change of the weights of each trial, |x - previous| / |previous|
+	x, previous = _rows(x), _rows(previous)
+	norm = np.sqrt(np.sum(previous**2,axis=1))
+	return np.sqrt(np.sum((x-previous)**2,axis=1))/np.maximum(norm,1e-300)
+
+def sn (x):
+	# S/N of the weights of each trial, max/mean
+	x = _rows(x)
+	return np.max(x,axis=1)/np.mean(x,axis=1)
+
+STATISTICS = {'sn': sn}
+
+
+# ================================================================================
+# Stopping criterion -------------------------------------------------------------
+
+class Stop (Recorders.Recorder):
+	# ----------------------------------------------------------------------------
+	#   criterion: "drift", "sn" or a function of the weights (see above)
+	#   every:     [steps] interval between two checks
+	#   window:    number of checks over which the statistic must be stationary
+	#   tol:       tolerance (see above)
+	#   min_steps: the run is not ended before this step
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,criterion,every,window=5,tol=1e-3,min_steps=0):
+		if not callable(criterion) and criterion != 'drift' and criterion not in STATISTICS:
+			raise ValueError('Unknown stopping criterion "{0}"'.format(criterion))
+		self.criterion = criterion
+		self.every, self.window, self.tol = int(every), int(window), float(tol)
+		self.min_steps = int(min_steps)
+
+	@property
+	def name (self):
+		return self.criterion if isinstance(self.criterion,str) else getattr(self.criterion,'__name__','custom')
+
+	def start (self,x,nSteps):
+		self.nSteps = nSteps
+		self.steps, self.values = [], []
+		self.previous = np.copy(x)
+		self.stopped = None
+		if self.criterion != 'drift':
+			self.sample(0,x)
+
+	def sample (self,step,x):
+		if self.criterion == 'drift':
+			value = drift(x,self.previous)
+			self.previous = np.copy(x)
+		else:
+			f = STATISTICS.get(self.criterion,self.criterion)
+			value = np.asarray(f(x),dtype=float).reshape(-1)
+		self.steps.append(step)
+		self.values.append(value)
+		if step >= self.min_steps and self.stationary():
+			self.stopped = step
+
+	def stationary (self):
+		if len(self.values) < self.window:
+			return False
+		last = np.array(self.values[-self.window:])
+		if self.criterion == 'drift':
+			return bool(np.all(last <= self.tol))
+		spread = (last.max(axis=0)-last.min(axis=0))/np.maximum(np.abs(last.mean(axis=0)),1e-300)
+		return bool(np.all(spread <= self.tol))
+
+	def stop (self):
+		return self.stopped is not None
+
+	def finish (self,step,x):
+		self.ended = step
+
+	def result (self):
+		# The statistic at every check, [checks x NTrials]
+		return np.array(self.values)
+
+	def record (self,dt=None):
+		# What the results keep of the early termination
+		return {'criterion': self.name, 'every': self.every, 'window': self.window, 'tol': self.tol,
+			'converged': self.stopped is not None, 'step': int(self.ended), 'nSteps': int(self.nSteps),
+			'time_ms': None if dt is None else self.ended*dt}
+
+
+def save (path,record):
+	# Writes a record of Stop (see Stop.record) as JSON
+	with open(path,'w') as f:
+		json.dump(record,f,indent=1)
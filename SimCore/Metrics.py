@@ -0,0 +1,141 @@
+##################################################################################
+# Metrics.py -- Instrumentation of a run: where the time goes and how far it is
+#
+# A Monitor given to a run (SimStep.set_metrics, or monitor=... of Recorders.run
+# and metrics=... of Network.run) keeps:
+#   timers:   seconds spent in each phase of the step. With the NumPy backend:
+#               conductance: spikes, refractory variable, conductances, synaptic input
+#               noise:       external current (including the generation of its blocks)
+#               membrane:    membrane potentials
+#               plasticity:  synaptic traces, weights and their bounds
+#             (the "exponential" integrator is timed as one phase, step). The compiled
+#             backend fuses the phases in one loop, timed as kernel, with noise
+#             apart. In both, recording: the spikes, the recorders and the
+#             checkpoints.
+#   counters: steps, presynaptic and postsynaptic spikes, and the weight updates
+#             clipped at the lower (0) or upper (w_max) bound
+#   progress: every `every` steps (default: every 5% of the run), the steps per
+#             second of the run so far and the time left (ETA)
+# The progress is printed, and the progress and a summary at the end of the run
+# (timers, counters, firing rates) are appended to a metrics file as JSON lines,
+# one object per line with its "event" ("progress" or "summary").
+# Without a Monitor the NumPy step does no timing nor counting, and the compiled
+# kernel keeps its counts in local variables that it does not store.
+##################################################################################
+
+
+import os, json, time
+
+from SimCore import Recorders
+
+
+COUNTERS = ('steps','spikes_pre','spikes_post','clipped_low','clipped_high')
+
+
+class Monitor (Recorders.Recorder):
+	# ----------------------------------------------------------------------------
+	#   path:  metrics file (JSON lines, appended), or None to only print
+	#   every: steps between two progress reports (default: nSteps/20)
+	#   label: name of the run in the reports (e.g. "fig4E trials 0-9")
+	#   quiet: do not print the progress
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,path=None,every=None,label='',quiet=False):
+		self.path, self.label, self.quiet = path, label, quiet
+		self.every_given = every
+		self.every = every
+		self.step0, self.nSteps = 0, 0
+		self.reset()
+		self.t0 = self._t
+
+	def reset (self):
+		self.timers = {}
+		self.counts = dict.fromkeys(COUNTERS,0)
+		self.neurons = (0,0)
+		self.dt = None
+		self._t = time.perf_counter()
+
+	# ---- hot path ----
+
+	def mark (self):
+		self._t = time.perf_counter()
+
+	def lap (self,phase):
+		# Time since the last mark or lap, added to phase
+		t = time.perf_counter()
+		self.timers[phase] = self.timers.get(phase,0.) + t - self._t
+		self._t = t
+
+	def count (self,name,n):
+		self.counts[name] += int(n)
+
+	def network (self,n_pre,n_post,dt):
+		# Numbers of presynaptic and postsynaptic neurons (all trials) and dt [ms]
+		self.neurons, self.dt = (n_pre,n_post), dt
+
+	# ---- progress (called by Recorders.run) ----
+
+	def begin (self,step,nSteps):
+		self.reset()
+		self.step0, self.nSteps = step, nSteps
+		self.every = self.every_given or max(nSteps//20,1)
+		self.t0 = time.perf_counter()
+
+	def sample (self,step,x):
+		if step < self.nSteps:
+			self.report('progress',step)
+
+	def finish (self,step,x):
+		self.report('summary',step)
+
+	def report (self,event,step):
+		elapsed = time.perf_counter() - self.t0
+		rate = (step-self.step0)/elapsed if elapsed > 0. else 0.
+		eta = (self.nSteps-step)/rate if rate > 0. else None
+		record = {'event': event, 'label': self.label, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+			'step': step, 'nSteps': self.nSteps, 'elapsed_s': elapsed, 'steps_per_s': rate, 'eta_s': eta}
+		if event == 'summary':
+			record.update(self.summary(elapsed))
+		if not self.quiet:
+			if event == 'progress':
+				print('{0}{1:5.1f}% ({2}/{3} steps), {4:.0f} steps/s, ETA {5:.1f} s'.format(
+					self.label+': ' if self.label else '',100.*step/self.nSteps,step,self.nSteps,rate,eta))
+			else:
+				print(self.text(record))
+		if self.path:
+			folder = os.path.dirname(self.path)
+			if folder:
+				os.makedirs(folder,exist_ok=True)
+			with open(self.path,'a') as f:
+				f.write(json.dumps(record)+'\n')
+		return record
+
+	def summary (self,elapsed):
+		# Timers (s and fraction of the run), counters and firing rates
+		timed = sum(self.timers.values())
+		timers = dict(self.timers,other=max(elapsed-timed,0.))
+		result = {'timers': timers,
+			'fractions': {k: v/elapsed if elapsed > 0. else 0. for k,v in timers.items()},
+			'counts': dict(self.counts)}
+		T = self.counts['steps']*(self.dt or 0.)/1000. # [s]
+		n_pre,n_post = self.neurons
+		result['rates'] = {'pre': self.counts['spikes_pre']/(n_pre*T) if n_pre and T else None,
+			'post': self.counts['spikes_post']/(n_post*T) if n_post and T else None}
+		return result
+
+	def text (self,record):
+		lines = ['{0}{1} steps in {2:.2f} s ({3:.0f} steps/s)'.format(
+			record['label']+': ' if record['label'] else '',record['step']-self.step0,record['elapsed_s'],record['steps_per_s'])]
+		lines.append('  time: ' + ', '.join('{0} {1:.1f}%'.format(k,100.*v)
+			for k,v in sorted(record['fractions'].items(),key=lambda kv: -kv[1])))
+		c, r = record['counts'], record['rates']
+		lines.append('  spikes: {0} pre, {1} post'.format(c['spikes_pre'],c['spikes_post'])
+			+ ('' if r['pre'] is None else ' ({0:.2f} Hz, {1:.2f} Hz)'.format(r['pre'],r['post'])))
+		lines.append('  clipped weight updates: {0} at 0, {1} at w_max'.format(c['clipped_low'],c['clipped_high']))
+		return '\n'.join(lines)
+
+
+def load (path):
+	# The records of a metrics file, [dict]
+	with open(path) as f:
+		return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,61 @@
+##################################################################################
+# Moments.py -- Running mean and variance of arrays, in constant memory
+#
+# Moments keeps the number of samples n, their mean and the sum of squared
+# deviations M2 (element-wise), updated one sample at a time (Welford) or one
+# block of samples at a time. Aggregates of disjoint sets of samples (e.g. of
+# different workers) are combined with merge (Chan et al.), which gives the same
+# result as aggregating all the samples at once, up to rounding.
+##################################################################################
+
+
+import numpy as np
+
+
+class Moments:
+
+	def __init__ (self,n=0,mean=0.,M2=0.):
+		self.n = int(n)
+		self.mean = np.array(mean,dtype=float)
+		self.M2 = np.array(M2,dtype=float)
+
+	def add (self,x):
+		# Adds one sample x (an array of the shape of the aggregate)
+		self.n += 1
+		delta = x - self.mean
+		self.mean = self.mean + delta/self.n
+		self.M2 = self.M2 + delta*(x - self.mean)
+		return self
+
+	def add_block (self,x):
+		# Adds the samples x[0], x[1], ... of a block
+		x = np.asarray(x,dtype=float)
+		if len(x):
+			mean = np.mean(x,axis=0)
+			self.merge(Moments(len(x),mean,np.sum((x-mean)**2,axis=0)))
+		return self
+
+	def merge (self,other):
+		# Adds the samples aggregated in other
+		if other.n == 0:
+			return self
+		n = self.n + other.n
+		delta = other.mean - self.mean
+		self.mean = self.mean + delta*(other.n/n)
+		self.M2 = self.M2 + other.M2 + delta**2*(self.n*other.n/n)
+		self.n = n
+		return self
+
+	def var (self,ddof=0):
+		return self.M2/(self.n-ddof)
+
+	def std (self,ddof=0):
+		return np.sqrt(self.var(ddof))
+
+	def save (self,path):
+		np.savez(path,n=self.n,mean=self.mean,M2=self.M2)
+
+	@classmethod
+	def load (cls,path):
+		with np.load(path) as data:
+			return cls(data['n'],data['mean'],data['M2'])
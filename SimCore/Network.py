@@ -0,0 +1,148 @@
+##################################################################################
+# Network.py -- Feedforward network simulator shared by all the figures
+#
+# NE presynaptic neurons driven by an external current project with plastic
+# conductance-based synapses onto one postsynaptic neuron. The figures differ
+# only in their parameters, plasticity rule (see SimCore/Plasticity.py) and gain
+# of the external current, which are given by their SimStep.py.
+#
+# step advances one integration step and run advances nSteps steps, with the
+# backend and integrator selected.
+##################################################################################
+
+
+import numpy as np
+
+from SimCore import StepKernel, Integrator
+
+
+def _rect (x): return x*(x>0.)
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def _step_euler (p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred=1.,metrics=None):
+	# ----------------------------------------------------------------------------
+	# Forward Euler step; see step. metrics: Monitor timing the phases of the step
+	# and counting the spikes and clipped weights (see SimCore/Metrics.py), or None
+	# ----------------------------------------------------------------------------
+	spikes = (u>p.Vth) # Verify all the neurons that fired an action potential
+	spikesE = spikes[...,:p.NE] # Excitatory neurons
+	spost = spikes[...,-1:] # Postsynaptic neuron
+	if metrics is not None:
+		metrics.count('spikes_pre',np.count_nonzero(spikesE))
+		metrics.count('spikes_post',np.count_nonzero(spost))
+	ref += spikes*p.Tref  # update the refractory variable
+
+	# Update the synaptic conductances
+	gSynE_out = gSynE + np.multiply(p.gBarEx,spikesE,dtype=gSynE.dtype)
+	gSynE_out = gSynE_out - gSynE_out*p.step_tauSynEx
+
+	# Update the membrane potential
+	IsynE = -(u[...,-1] - p.EsynE)*np.einsum('...ij,...j->...',WEE,gSynE)
+	Isyn = IsynE
+	if metrics is not None:
+		metrics.lap('conductance')
+	Iext = source.next(Iext)
+	if metrics is not None:
+		metrics.lap('noise')
+
+	u = u + (p.Vres-u)*spikes # reset the voltage for those who spiked
+	u_out = u + (-u + p.R*preferred*Iext)*p.step_tau_m # presynaptic neurons receive only external input
+	u_out[...,-1] = u_out[...,-1] + (Isyn)*p.step_tau_m # the postsynaptic neuron also receives the synaptic input
+	u_out[(ref>0.001)] = p.Vres
+	u_out = u_out + (p.Vspike-u_out+p.Vth)*(u_out>p.Vth) # add a constant to "see" the spikes
+
+	ref = _rect(ref - p.dt)
+	ref_out = ref
+	if metrics is not None:
+		metrics.lap('membrane')
+
+	# Update the synaptic traces and weights
+	WEE_out,xbar_pre_out,xbar_post_out = rule.update(WEE,spikesE,spost,xbar_pre,xbar_post)
+	if metrics is not None:
+		metrics.count('clipped_low',np.count_nonzero(WEE_out<0.))
+		metrics.count('clipped_high',np.count_nonzero(WEE_out>p.w_max))
+	WEE_out = _rect(WEE_out) - _rect(WEE_out-p.w_max) # apply bounds
+	WEE_out = rule.commit(WEE,WEE_out)
+	if metrics is not None:
+		metrics.lap('plasticity')
+
+	return u_out,ref_out,xbar_pre_out,xbar_post_out,gSynE_out,WEE_out,Iext
+
+def step (p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred=1.):
+	# ----------------------------------------------------------------------------
+	# Takes as the input:
+	#   p:         params module
+	#   rule:      plasticity rule (see SimCore/Plasticity.py)
+	#   u:         [NE+1] Membrane potential at time t
+	#   ref:       [NE+1] Refractory variable
+	#   xbar_pre:  [NE] synaptic traces for presynaptic events
+	#   xbar_post: [1] synaptic traces for postsynaptic events
+	#   gSynE:     [NE] synaptic conductances of excitatory connections
+	#   WEE:       [1xNE] Excitatory synaptic weights
+	#   Iext:      [NE+1] External current for each neuron
+	#   source:    NoiseSource giving the external current (see SimCore/NoiseSource.py)
+	#   preferred: [NE+1] gain of the external current
+	#
+	# All the state variables may carry a leading trial axis (batched mode).
+	# ----------------------------------------------------------------------------
+	# Returns the state variables at time t+dt, in the same order. The method is
+	# taken from p.integrator (see SimCore/Integrator.py).
+	# ----------------------------------------------------------------------------
+	step_fn = _step_euler if p.integrator == "euler" else Integrator.step
+	return step_fn(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred)
+
+def run (p,backend,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,source,preferred=None,raster=None,metrics=None):
+	# ----------------------------------------------------------------------------
+	# Advances nSteps integration steps with the backend given ("numpy" or "numba")
+	# and returns the variables after the last step, in the same order as step.
+	# If raster (a SpikeRaster, see SimCore/Spikes.py) is given, the spikes of
+	# every step are added to it. If metrics (a Monitor, see SimCore/Metrics.py)
+	# is given, the phases of the steps are timed and the spikes and clipped
+	# weights counted.
+	# ----------------------------------------------------------------------------
+	if metrics is not None:
+		NTrials = u.shape[0] if u.ndim == 2 else 1
+		metrics.network(NTrials*p.NE,NTrials,p.dt)
+		metrics.count('steps',nSteps)
+	if backend == "numba":
+		StepKernel.run(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,source,preferred,raster,metrics)
+		return u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext
+
+	if preferred is None:
+		preferred = 1.
+	if metrics is not None:
+		return _run_timed(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,source,preferred,raster,metrics)
+	step_fn = _step_euler if p.integrator == "euler" else Integrator.step
+	for i in range(nSteps):
+		if raster is not None:
+			raster.add(u > p.Vth)
+		u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext \
+		= step_fn(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred)
+
+	return u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext
+
+def _run_timed (p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,source,preferred,raster,metrics):
+	# ----------------------------------------------------------------------------
+	# The loop of run with the NumPy backend, timing every phase of the step
+	# ----------------------------------------------------------------------------
+	euler = (p.integrator == "euler")
+	for i in range(nSteps):
+		metrics.mark()
+		if raster is not None:
+			raster.add(u > p.Vth)
+			metrics.lap('recording')
+		if euler:
+			u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext \
+			= _step_euler(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred,metrics)
+		else:
+			spikes = (u>p.Vth)
+			metrics.count('spikes_pre',np.count_nonzero(spikes[...,:p.NE]))
+			metrics.count('spikes_post',np.count_nonzero(spikes[...,-1:]))
+			u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext \
+			= Integrator.step(p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,source,preferred)
+			metrics.lap('step')
+
+	return u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext
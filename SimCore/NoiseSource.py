@@ -0,0 +1,200 @@
+##################################################################################
+# NoiseSource.py -- External current of the neurons, generated in blocks
+#
+# The external current of each neuron is a low-pass filtered noise: every
+# sampling interval a sample
+#     xi = mean + rect(x^3)   (cube = True,  presynaptic neurons)
+#     xi = mean + rect(x)     (cube = False, postsynaptic neuron)
+# with x gaussian of zero mean is drawn, and the current is updated as
+#     I <- a*I + (1-a)*xi,   a = 1 - (sampling interval)/taufilt
+# Instead of drawing the samples at every integration step, NoiseSource draws
+# them for a block of steps at once (p.noise_block steps) and filters the whole
+# block in one pass, vectorized over neurons and trials (see lowpass). The time loop then takes
+# the current of each step (next) or of several steps (take) from the block.
+#
+# With the "exponential" integrator the samples keep the 1 ms interval of the reference
+# and only the current at the end of each integration step is kept.
+# With dtype float32 the samples are drawn and filtered in single precision
+# (np.random.Generator draws them directly, np.random in double and converts),
+# which halves the memory of a block.
+##################################################################################
+
+
+import numpy as np
+
+from SimCore import Integrator, StepKernel
+
+
+max_elements = 2**22	# largest number of samples drawn at once (32 MB)
+
+
+def _recurse (x,a):
+	# x[k] += a*x[k-1] for k = 1, 2, ..., row by row (x: [n x m], contiguous)
+	for k in range(1,len(x)):
+		x[k] += a*x[k-1]
+
+def _recurse_loop (x,a):
+	# Same as _recurse, element by element, compiled
+	n,m = x.shape
+	for k in range(1,n):
+		for j in range(m):
+			x[k,j] = x[k,j] + a*x[k-1,j]
+
+_recurse_compiled = StepKernel.njit(cache=True)(_recurse_loop) if StepKernel.available() else None
+
+def lowpass (x,a,carry):
+	# ----------------------------------------------------------------------------
+	# y[k] = a*y[k-1] + (1-a)*x[k] along the first axis of x, with y[-1] = carry.
+	# x is overwritten with y. The recursion is compiled when Numba is available
+	# (one pass over the block, in the dtype of x, with the same results), and
+	# runs over the rows, each one updated as a whole, otherwise.
+	# ----------------------------------------------------------------------------
+	x *= (1.-a)
+	x[0] += a*carry
+	if _recurse_compiled is not None and x.flags.c_contiguous and len(x) > 1:
+		_recurse_compiled(x.reshape(len(x),-1),x.dtype.type(a))
+	else:
+		_recurse(x,a)
+	return x
+
+
+class NoiseSource:
+	# ----------------------------------------------------------------------------
+	# Filtered external current of an array of neurons.
+	#   shape: shape of the current in one step, e.g. [NE+1] or [NTrials x NE+1]
+	#   mean, std, cube: [NE+1] parameters of the samples of each neuron
+	#   a: filtering factor per sample; substeps: samples per integration step
+	#   block: integration steps generated at once (reduced for large shapes)
+	#   rng: random generator (np.random or a np.random.Generator), or a list with
+	#        one generator per entry of the leading (trial) axis of shape. Each
+	#        trial then draws its samples from its own generator, in the same order
+	#        whatever the block size and the other trials of the batch.
+	#   dtype: dtype of the current (float64 or float32)
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,shape,mean,std,cube,a,substeps=1,block=10000,rng=np.random,dtype=np.float64):
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.mean, self.std, self.cube = mean, std, cube
+		self.a, self.substeps, self.rng = a, substeps, rng
+		if isinstance(rng,(list,tuple)) and len(rng) != self.shape[0]:
+			raise ValueError('{0} generators given for {1} trials'.format(len(rng),self.shape[0]))
+		size = int(np.prod(self.shape))*substeps
+		self.block = int(max(1,min(block,max_elements//size)))
+		self._rows = np.zeros((0,)+self.shape,dtype=self.dtype)
+		self._pos = 0
+		self._last = np.zeros(self.shape,dtype=self.dtype) # current of the last step given out
+		self._same = np.zeros(self.shape,dtype=bool)
+
+	def _generate (self):
+		# Draws and filters the samples of the next block
+		n = self.block*self.substeps
+		if isinstance(self.rng,(list,tuple)):
+			x = np.stack([_normal(rng,(n,)+self.shape[1:],self.dtype) for rng in self.rng],axis=1)
+		else:
+			x = _normal(self.rng,(n,)+self.shape,self.dtype)
+		x *= self.std
+		np.multiply(x,x*x,out=x,where=self.cube)
+		np.maximum(x,0.,out=x)
+		x += self.mean
+		y = lowpass(x,self.a,self._last)
+		self._rows = np.ascontiguousarray(y[self.substeps-1::self.substeps])
+		self._pos = 0
+
+	def _sync (self,Ipre):
+		# The current in the block continues from the last one given out. If the
+		# caller changed it (e.g. reset it to zero), the rest of the block is
+		# corrected with the decay of the difference.
+		np.equal(Ipre,self._last,out=self._same)
+		if self._same.all():
+			return
+		rest = self._rows[self._pos:]
+		decay = (self.a**self.substeps)**np.arange(1,len(rest)+1)
+		rest += decay.reshape((-1,)+(1,)*len(self.shape))*(Ipre-self._last)
+		self._last = np.array(Ipre,dtype=self.dtype)
+
+	def next (self,Ipre):
+		# Current at t+dt, given the current Ipre at time t
+		return self.take(Ipre,1)[0].copy()
+
+	def next_into (self,I):
+		# Same as next, in place: I, the current at time t, is overwritten with the
+		# current at t+dt. Nothing is allocated, except when a block is generated.
+		self._sync(I)
+		if self._pos == len(self._rows):
+			self._generate()
+		np.copyto(I,self._rows[self._pos])
+		np.copyto(self._last,I)
+		self._pos += 1
+
+	def take (self,Ipre,n):
+		# ----------------------------------------------------------------------------
+		# Current of the next (at most) n steps, [n x shape], given the current Ipre
+		# before them. Fewer rows are returned at the end of a block.
+		# ----------------------------------------------------------------------------
+		self._sync(Ipre)
+		if self._pos == len(self._rows):
+			self._generate()
+		rows = self._rows[self._pos:self._pos+n]
+		self._pos += len(rows)
+		self._last = rows[-1].copy()
+		return rows
+
+	# ---- checkpoints ----
+
+	def state (self):
+		# Generators, rest of the block and last current (see SimCore/Checkpoint.py)
+		rngs = self.rng if isinstance(self.rng,(list,tuple)) else [self.rng]
+		return {'rng': [_rng_state(rng) for rng in rngs], 'rows': self._rows[self._pos:].copy(),
+			'last': self._last.copy()}
+
+	def restore (self,state):
+		rngs = self.rng if isinstance(self.rng,(list,tuple)) else [self.rng]
+		for rng,s in zip(rngs,state['rng']):
+			_set_rng_state(rng,s)
+		self._rows, self._pos = state['rows'].copy(), 0
+		self._last = state['last'].copy()
+
+
+def _normal (rng,shape,dtype):
+	# Standard normal samples of the given dtype
+	if isinstance(rng,np.random.Generator):
+		return rng.standard_normal(shape,dtype=dtype)
+	return rng.standard_normal(shape).astype(dtype,copy=False)
+
+def _rng_state (rng):
+	# State of a np.random.Generator, or of np.random
+	return rng.bit_generator.state if isinstance(rng,np.random.Generator) else rng.get_state()
+
+def _set_rng_state (rng,state):
+	if isinstance(rng,np.random.Generator):
+		rng.bit_generator.state = state
+	else:
+		rng.set_state(state)
+
+
+def resolution (p):
+	# Filtering factor per sample and samples per integration step
+	if getattr(p,'integrator','euler') == "exponential":
+		return 1. - Integrator.dt_ref/p.taufilt, p.noise_substeps
+	return 1. - p.dt/p.taufilt, 1
+
+def from_params (p,shape,rng=np.random):
+	# ----------------------------------------------------------------------------
+	# Noise source with the parameters of the params module p:
+	#   std_pre: std of the presynaptic noise (a number or one value per neuron)
+	#   mean_post, std_post: mean and std of the postsynaptic input
+	#   taufilt: filtering time constant; noise_block: steps generated at once
+	#   N_post: number of postsynaptic neurons, after the NE presynaptic ones
+	#           (1 if not given, see SimCore/Population.py)
+	#   precision: dtype of the current ("float64" if not given)
+	# ----------------------------------------------------------------------------
+	N = p.NE + getattr(p,'N_post',1)
+	mean = np.zeros(N)
+	mean[p.NE:] = p.mean_post
+	std = np.zeros(N)
+	std[:p.NE] = p.std_pre
+	std[p.NE:] = p.std_post
+	cube = np.arange(N) < p.NE
+	a, substeps = resolution(p)
+	return NoiseSource(shape,mean,std,cube,a,substeps,p.noise_block,rng,getattr(p,'precision','float64'))
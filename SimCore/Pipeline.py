@@ -0,0 +1,213 @@
+##################################################################################
+# Pipeline.py -- Runs the steps of a figure in one process and caches their output
+#
+# A figure is a list of Stage objects, each one with a function computing its
+# output (a dict of arrays) from the outputs of its upstream stages, which are
+# passed in memory. The output of a stage is stored in a cache directory under a
+# key hashing:
+#   - the values of its params module (after the integrator is configured)
+#   - the code it depends on (the content of its files)
+#   - the keys of its upstream stages
+#   - any other setting given to run (e.g. backend and trial)
+# A stage whose key is found in the cache is not run again, so changing e.g. only
+# a parameter of the sleep phase reruns the sleep phase and what depends on it.
+##################################################################################
+
+
+import os, sys, glob, json, hashlib, importlib.util, types
+import numpy as np
+from time import time as time_now
+
+
+CORE = os.path.dirname(os.path.abspath(__file__))
+
+
+# ================================================================================
+# Loading the scripts of a stage -------------------------------------------------
+
+def load_stage (path):
+	# ----------------------------------------------------------------------------
+	# Imports params.py and SimStep.py from a stage directory. Every stage has its
+	# own modules with these names, so they are removed from sys.modules after
+	# the import and the next stage gets new ones.
+	# ----------------------------------------------------------------------------
+	sys.path.insert(0,path)
+	for name in ('params','SimStep'):
+		sys.modules.pop(name,None)
+	try:
+		import params, SimStep
+	finally:
+		sys.path.remove(path)
+		for name in ('params','SimStep'):
+			sys.modules.pop(name,None)
+	return params, SimStep
+
+def load_script (path,name=None):
+	# ----------------------------------------------------------------------------
+	# Imports a script of a stage (the file names need not be valid module names)
+	# with the params.py and SimStep.py of its directory, as p and SS. The code
+	# under "if __name__ == '__main__'" is not run.
+	# ----------------------------------------------------------------------------
+	path = os.path.abspath(path)
+	folder = os.path.dirname(path)
+	name = name or os.path.splitext(os.path.basename(path))[0].replace('-','_')
+	sys.path.insert(0,folder)
+	for mod in ('params','SimStep'):
+		sys.modules.pop(mod,None)
+	try:
+		spec = importlib.util.spec_from_file_location(name,path)
+		script = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(script)
+	finally:
+		sys.path.remove(folder)
+		for mod in ('params','SimStep'):
+			sys.modules.pop(mod,None)
+	return script
+
+
+# ================================================================================
+# Keys ---------------------------------------------------------------------------
+
+def canonical (x):
+	# Text that identifies a value (dicts in sorted order, arrays by their content)
+	if isinstance(x,dict):
+		return '{'+','.join(canonical(k)+':'+canonical(x[k]) for k in sorted(x,key=repr))+'}'
+	if isinstance(x,(list,tuple)):
+		return type(x).__name__+'('+','.join(canonical(v) for v in x)+')'
+	if isinstance(x,np.ndarray):
+		return 'array({0},{1},{2})'.format(x.dtype,x.shape,hashlib.sha256(np.ascontiguousarray(x).tobytes()).hexdigest())
+	if isinstance(x,np.generic):
+		return repr(x.item())
+	return repr(x)
+
+def params_values (p):
+	# Public values of a params module (modules, functions and classes excluded)
+	return {name: value for name,value in vars(p).items()
+		if not name.startswith('_') and not isinstance(value,(types.ModuleType,types.FunctionType,type))}
+
+def code_hash (files):
+	# Hash of the content of the files given (the code version of a stage)
+	h = hashlib.sha256()
+	for path in sorted(files):
+		h.update(os.path.relpath(path,os.path.dirname(CORE)).replace(os.sep,'/').encode())
+		with open(path,'rb') as f:
+			h.update(hashlib.sha256(f.read()).digest())
+	return h.hexdigest()
+
+def core_files ():
+	# All the files of SimCore
+	return glob.glob(os.path.join(CORE,'*.py'))
+
+def dependencies (*namespaces):
+	# ----------------------------------------------------------------------------
+	# Files of the SimCore modules used by the modules given (or by their
+	# globals(), a dict), directly or through each other. Only these enter the
+	# code version of a simulation, so a change in a module it does not import
+	# (e.g. Service.py or Benchmark.py) keeps its cached results.
+	# ----------------------------------------------------------------------------
+	found = {}
+	todo = [vars(ns) if isinstance(ns,types.ModuleType) else ns for ns in namespaces]
+	while todo:
+		for value in todo.pop().values():
+			module = value if isinstance(value,types.ModuleType) else sys.modules.get(getattr(value,'__module__',None) or '')
+			path = getattr(module,'__file__',None)
+			if path is None or os.path.dirname(os.path.abspath(path)) != CORE or path in found:
+				continue
+			found[path] = os.path.abspath(path)
+			todo.append(vars(module))
+	return list(found.values())
+
+
+class Stage:
+	# ----------------------------------------------------------------------------
+	# One step of a pipeline.
+	#   name:     [str] name of the stage (and of its cache entries)
+	#   compute:  function of the outputs of the upstream stages (in order),
+	#             returning a dict of arrays
+	#   code:     files whose content enters the key
+	#   params:   params module whose values enter the key (or None)
+	#   upstream: stages whose outputs are the inputs of compute
+	#   outputs:  files written by compute; the cache entry is valid only if they
+	#             exist
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,name,compute,code,params=None,upstream=(),outputs=()):
+		self.name, self.compute, self.code, self.params = name, compute, list(code), params
+		self.upstream, self.outputs = tuple(upstream), tuple(outputs)
+
+	def key (self,upstream_keys,settings):
+		h = hashlib.sha256()
+		h.update(self.name.encode())
+		h.update(code_hash(self.code).encode())
+		if self.params is not None:
+			h.update(canonical(params_values(self.params)).encode())
+		for k in upstream_keys:
+			h.update(k.encode())
+		h.update(canonical(settings).encode())
+		return h.hexdigest()
+
+
+# ================================================================================
+# Cache --------------------------------------------------------------------------
+
+class Cache:
+	# ----------------------------------------------------------------------------
+	# Outputs of the stages in a directory: <stage>-<key>.npz with the arrays and
+	# <stage>-<key>.json with the full key, the settings and the time spent.
+	# Entries are written to a temporary file and renamed, so an interrupted run
+	# leaves no partial entry.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,folder):
+		self.folder = folder
+		os.makedirs(folder,exist_ok=True)
+
+	def _path (self,name,key,ext):
+		return os.path.join(self.folder,'{0}-{1}.{2}'.format(name,key[:20],ext))
+
+	def get (self,name,key):
+		path = self._path(name,key,'json')
+		if not os.path.exists(path):
+			return None
+		with open(path) as f:
+			if json.load(f).get('key') != key:
+				return None
+		with np.load(self._path(name,key,'npz')) as data:
+			return {k: data[k] for k in data.files}
+
+	def put (self,name,key,arrays,meta):
+		for ext,write in (('npz',lambda f: np.savez(f,**arrays)),
+				('json',lambda f: f.write(json.dumps(dict(meta,key=key),indent=1).encode()))):
+			path = self._path(name,key,ext)
+			with open(path+'.tmp','wb') as f:
+				write(f)
+			os.replace(path+'.tmp',path)
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def run (stages,cache,settings=None,force=()):
+	# ----------------------------------------------------------------------------
+	# Runs the stages (given in order, upstream stages first) whose output is not
+	# in the cache, and returns the outputs of all of them, {name: dict of arrays}.
+	#   settings: values that enter the key of every stage (e.g. backend, trial)
+	#   force:    names of the stages run even if they are in the cache
+	# ----------------------------------------------------------------------------
+	settings = settings or {}
+	results, keys = {}, {}
+	for stage in stages:
+		key = keys[stage.name] = stage.key([keys[s.name] for s in stage.upstream],settings)
+		out = None
+		if stage.name not in force and all(os.path.exists(f) for f in stage.outputs):
+			out = cache.get(stage.name,key)
+		if out is not None:
+			print('{0}: cached ({1})'.format(stage.name,key[:12]))
+		else:
+			print('{0}: running ({1})'.format(stage.name,key[:12]))
+			time_in = time_now()
+			out = stage.compute(*[results[s.name] for s in stage.upstream]) or {}
+			cache.put(stage.name,key,out,{'stage': stage.name, 'settings': settings,
+				'upstream': [keys[s.name] for s in stage.upstream], 'time': time_now()-time_in})
+		results[stage.name] = out
+	return results
@@ -0,0 +1,187 @@
+##################################################################################
+# Plasticity.py -- Plasticity rules of the simulator
+#
+# A rule object is created from the params module for one state of the network
+# s ("wake", "up", ...). It reads its coefficients p.a_pre[s], p.a_post[s], ...
+# and the step factors of its traces once, and keeps only the terms whose
+# coefficient is not zero, so that the time loop neither looks them up nor
+# multiplies through unused terms.
+#   "stdp": classic STDP with exponential pre and post traces (wake)
+#   "up":   Up-state-mediated plasticity: a presynaptic spike changes the weight
+#           by a_pre and opens a 10 ms window, in which a postsynaptic spike
+#           changes it by -a_pre and closes the window (sleep, Figure 4E)
+# Frozen(rule,Wacc) keeps the weights fixed and adds the changes given by rule to
+# Wacc (Figure 4E).
+#
+# Rules are created with make(name,p,s); new ones are added with @register(name).
+# The coefficients have the dtype of p.precision, so that the weights and traces
+# of a float32 run stay in float32.
+##################################################################################
+
+
+import numpy as np
+
+
+def _rect (x): return x*(x>0.)
+
+
+RULES = {}
+
+def register (name):
+	def add (cls):
+		cls.name = name
+		RULES[name] = cls
+		return cls
+	return add
+
+def _scalar (p):
+	# Type of the coefficients: float64, or float32 with p.precision = "float32"
+	return np.dtype(getattr(p,'precision','float64')).type
+
+def make (name,p,s):
+	if name not in RULES:
+		raise ValueError('Unknown plasticity rule "{0}", use one of {1}'.format(name,tuple(RULES)))
+	return RULES[name](p,s)
+
+
+# ================================================================================
+# Rules --------------------------------------------------------------------------
+# update(WEE,spikesE,spost,xbar_pre,xbar_post) performs the forward Euler step of
+# the traces and weights, and returns WEE_out (before the bounds), xbar_pre_out
+# and xbar_post_out.
+#   WEE: [... x 1 x NE]; spikesE, xbar_pre: [... x NE]; spost, xbar_post: [... x 1]
+# commit(WEE,WEE_out) returns the weights kept for the next step.
+#
+# synapses(W,spre,spost,xpre,xpost) is the same step for synapses listed one by
+# one (sparse connectivity, see SimCore/Population.py), and returns W_out (before
+# the bounds) and xpre_out:
+#   W, xpre: [nSyn] weights and presynaptic traces of the synapses
+#   spre, spost, xpost: [nSyn] spikes of their pre- and postsynaptic neurons and
+#                       trace of their postsynaptic neuron
+# post_trace(xbar_post,spost) steps the traces of the postsynaptic neurons.
+
+@register("stdp")
+class STDP:
+	kernel = 0	# id of the rule in SimCore/StepKernel.py
+
+	def __init__ (self,p,s):
+		self.s = s
+		real = _scalar(p)
+		self.a_pre = real(p.a_pre[s])
+		self.a_post = real(p.a_post[s])
+		self.a_plus = real(p.a_plus[s])
+		self.a_minus = real(p.a_minus[s])
+		self.step_pre = p.step_tp_plast
+		self.step_post = p.step_tm_plast
+
+	def coefficients (self):
+		return self.a_pre, self.a_post, self.a_plus, self.a_minus
+
+	def update (self,WEE,spikesE,spost,xbar_pre,xbar_post):
+		WEE_out = WEE
+		if self.a_pre:
+			WEE_out = WEE_out + self.a_pre*spikesE[...,None,:]
+		if self.a_post:
+			WEE_out = WEE_out + self.a_post*spost[...,None]
+		if self.a_plus:
+			WEE_out = WEE_out + (self.a_plus*spost[...,None])*xbar_pre[...,None,:]
+		if self.a_minus:
+			WEE_out = WEE_out + (self.a_minus*xbar_post[...,None])*spikesE[...,None,:]
+
+		xbar_pre_out = xbar_pre + spikesE
+		xbar_pre_out = xbar_pre_out - xbar_pre_out*self.step_pre
+		xbar_post_out = xbar_post + spost
+		xbar_post_out = xbar_post_out - xbar_post_out*self.step_post
+		return WEE_out, xbar_pre_out, xbar_post_out
+
+	def synapses (self,W,spre,spost,xpre,xpost):
+		W_out = W
+		if self.a_pre:
+			W_out = W_out + self.a_pre*spre
+		if self.a_post:
+			W_out = W_out + self.a_post*spost
+		if self.a_plus:
+			W_out = W_out + (self.a_plus*spost)*xpre
+		if self.a_minus:
+			W_out = W_out + (self.a_minus*xpost)*spre
+
+		xpre_out = xpre + spre
+		xpre_out = xpre_out - xpre_out*self.step_pre
+		return W_out, xpre_out
+
+	def post_trace (self,xbar_post,spost):
+		xbar_post_out = xbar_post + spost
+		return xbar_post_out - xbar_post_out*self.step_post
+
+	def commit (self,WEE,WEE_out):
+		return WEE_out
+
+
+@register("up")
+class UpState:
+	kernel = 1	# id of the rule in SimCore/StepKernel.py
+	window = 10.	# [ms] duration of the window opened by a presynaptic spike
+
+	def __init__ (self,p,s):
+		self.s = s
+		self.a_pre = _scalar(p)(p.a_pre[s])
+		self.dt = p.dt
+
+	def coefficients (self):
+		# Only a_pre is used, as potentiation (pre) and depression (post in window)
+		return self.a_pre, 0., 0., 0.
+
+	def update (self,WEE,spikesE,spost,xbar_pre,xbar_post):
+		WEE_out = WEE
+		if self.a_pre:
+			WEE_out = WEE + self.a_pre*spikesE[...,None,:] \
+				+ (-self.a_pre*spost[...,None])*(xbar_pre[...,None,:]>0.)
+
+		xbar_pre_out = xbar_pre + (self.window-xbar_pre)*spikesE
+		xbar_pre_out = _rect(xbar_pre_out - self.dt)
+		xbar_pre_out[spost[...,0]] = 0. # a postsynaptic spike closes the windows
+		return WEE_out, xbar_pre_out, xbar_post
+
+	def synapses (self,W,spre,spost,xpre,xpost):
+		# The window is kept per synapse: it is closed by its postsynaptic neuron
+		W_out = W
+		if self.a_pre:
+			W_out = W + self.a_pre*spre + (-self.a_pre*spost)*(xpre>0.)
+
+		xpre_out = xpre + (self.window-xpre)*spre
+		xpre_out = _rect(xpre_out - self.dt)
+		xpre_out[spost] = 0.
+		return W_out, xpre_out
+
+	def post_trace (self,xbar_post,spost):
+		return xbar_post
+
+	def commit (self,WEE,WEE_out):
+		return WEE_out
+
+
+class Frozen:
+	# ----------------------------------------------------------------------------
+	# Wraps a rule: the weights are kept fixed and the changes that the rule would
+	# apply (after the bounds) are added to Wacc [... x 1 x NE] (or [nSyn]) in place.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,rule,Wacc):
+		self.rule, self.Wacc = rule, Wacc
+		self.name, self.kernel, self.s = rule.name, rule.kernel, rule.s
+
+	def coefficients (self):
+		return self.rule.coefficients()
+
+	def update (self,WEE,spikesE,spost,xbar_pre,xbar_post):
+		return self.rule.update(WEE,spikesE,spost,xbar_pre,xbar_post)
+
+	def synapses (self,W,spre,spost,xpre,xpost):
+		return self.rule.synapses(W,spre,spost,xpre,xpost)
+
+	def post_trace (self,xbar_post,spost):
+		return self.rule.post_trace(xbar_post,spost)
+
+	def commit (self,WEE,WEE_out):
+		self.Wacc += WEE_out - WEE
+		return WEE
@@ -0,0 +1,494 @@
+##################################################################################
+# Population.py -- Network of N_pre inputs and N_post postsynaptic neurons with
+# sparse connectivity
+#
+# The neurons are those of SimCore/Network.py (the same model, parameters and
+# plasticity rules), but with N_post postsynaptic neurons, each receiving its
+# own subset of the N_pre presynaptic neurons. The synapses are kept in CSR
+# layout (one row per postsynaptic neuron, see Connectivity): their weights and
+# presynaptic traces are [nSyn] arrays, so memory and time per step grow with the
+# number of synapses and not with N_pre x N_post.
+#
+# The state variables are those of SimStep.py, with the postsynaptic neurons
+# after the presynaptic ones:
+#   u, ref, Iext: [N_pre+N_post]; gSynE: [N_pre]; xbar_post: [N_post]
+#   W, xbar_pre: [nSyn] weight and presynaptic trace of each synapse
+# step advances one integration step and run advances nSteps steps with the
+# backend selected ("numpy" or "numba"). Only the "euler" integrator is
+# available. With N_post = 1 and all the synapses, the results are those of
+# SimCore/Network.py (with NumPy, up to the rounding of the synaptic input).
+#
+# Drive: the synaptic input of postsynaptic neuron i is proportional to
+# D_i = sum_j W_ij g_j. With drive="dense" it is summed over all the synapses
+# every step. As all the conductances decay with the same time constant, with
+# drive="event" D is instead kept as one decaying quantity per postsynaptic
+# neuron: a presynaptic spike adds gBarEx*W_ij to the D_i of its targets, and a
+# change of W_ij adds the change times g_j. The cost of the drive then grows with
+# the spikes instead of the synapses. D is summed in full at the start of each
+# call to run, and the results differ from the dense sum only by rounding.
+# With the NumPy backend the plasticity still goes over every synapse every step
+# (only the compiled backend has plasticity="lazy"), so event drive saves the
+# sum of the drive but the step stays O(nSyn); the cost of a step follows the
+# spikes only with the compiled backend, event drive and lazy plasticity.
+#
+# Plasticity: with plasticity="step" every synapse is updated every step. With
+# plasticity="lazy" (compiled backend) a weight is updated only at a spike of its
+# presynaptic or postsynaptic neuron, which is the only time it can change, so
+# the cost of plasticity grows with the spikes instead of the synapses:
+#   "stdp": the traces belong to the neurons (xbar_pre is the same for all the
+#           synapses of a presynaptic neuron), and are kept per neuron
+#   "up":   the window of each synapse is kept as the step of the presynaptic
+#           spike that opened it (or closed), instead of a decaying trace
+# The results are the same as with plasticity="step", bit for bit. xbar_pre is
+# written back at the end of each call to run.
+##################################################################################
+
+
+import numpy as np
+
+from SimCore import StepKernel, Plasticity, NoiseSource
+
+njit = StepKernel.njit
+
+RULE_STDP = StepKernel.RULE_STDP
+CLOSED = -2**62	# t_open of a closed Up-state window (lazy plasticity)
+
+
+def _rect (x): return x*(x>0.)
+
+def _segments (ptr,rows):
+	# Indices ptr[r]:ptr[r+1] of all the rows given, concatenated (without a Python loop)
+	lengths = ptr[rows+1] - ptr[rows]
+	ends = np.cumsum(lengths)
+	return np.arange(ends[-1] if len(ends) else 0,dtype=np.int64) + np.repeat(ptr[rows]-ends+lengths,lengths)
+
+
+# ================================================================================
+# Connectivity -------------------------------------------------------------------
+
+class Connectivity:
+	# ----------------------------------------------------------------------------
+	# Synapses from N_pre presynaptic onto N_post postsynaptic neurons:
+	#   indptr: [N_post+1] the synapses onto neuron i are indptr[i]:indptr[i+1]
+	#   pre:    [nSyn] presynaptic neuron of each synapse (increasing in each row)
+	# The weights are a state variable of the run, [nSyn] in the same order.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,N_pre,N_post,indptr,pre):
+		self.N_pre, self.N_post = int(N_pre), int(N_post)
+		self.indptr = np.asarray(indptr,dtype=np.int64)
+		self.pre = np.asarray(pre,dtype=np.int32)
+		self.post = np.repeat(np.arange(self.N_post,dtype=np.int32),np.diff(self.indptr))
+		if len(self.indptr) != self.N_post+1 or self.indptr[-1] != len(self.pre):
+			raise ValueError('indptr does not match the synapses')
+
+	@property
+	def nSyn (self):
+		return len(self.pre)
+
+	def drive (self,W,g):
+		# [N_post] sum of W*g over the synapses onto each postsynaptic neuron
+		return np.bincount(self.post,W*g[self.pre],minlength=self.N_post)
+
+	def outgoing (self):
+		# ----------------------------------------------------------------------------
+		# Synapses of each presynaptic neuron (CSC layout, built when first needed):
+		# those of neuron j are out_syn[out_ptr[j]:out_ptr[j+1]]
+		# ----------------------------------------------------------------------------
+		if not hasattr(self,'out_syn'):
+			self.out_syn = np.argsort(self.pre,kind='stable').astype(np.int64)
+			self.out_ptr = np.zeros(self.N_pre+1,dtype=np.int64)
+			self.out_ptr[1:] = np.cumsum(np.bincount(self.pre,minlength=self.N_pre))
+		return self.out_ptr, self.out_syn
+
+	def dense (self,W):
+		# [N_post x N_pre] weights, zero where there is no synapse
+		out = np.zeros((self.N_post,self.N_pre))
+		out[self.post,self.pre] = W
+		return out
+
+	def nbytes (self):
+		return self.indptr.nbytes + self.pre.nbytes + self.post.nbytes
+
+def full (N_pre,N_post):
+	# All the N_pre x N_post synapses
+	return Connectivity(N_pre,N_post,np.arange(N_post+1)*N_pre,np.tile(np.arange(N_pre),N_post))
+
+def random (N_pre,N_post,p_conn,rng):
+	# Each pair connected with probability p_conn, drawn one row at a time
+	counts = rng.binomial(N_pre,p_conn,N_post)
+	indptr = np.zeros(N_post+1,dtype=np.int64)
+	indptr[1:] = np.cumsum(counts)
+	pre = np.zeros(indptr[-1],dtype=np.int32)
+	for i,k in enumerate(counts):
+		pre[indptr[i]:indptr[i+1]] = np.sort(rng.choice(N_pre,k,replace=False))
+	return Connectivity(N_pre,N_post,indptr,pre)
+
+def from_dense (W):
+	# Connectivity and [nSyn] weights of the nonzero entries of W [N_post x N_pre]
+	post,pre = np.nonzero(W)
+	indptr = np.zeros(W.shape[0]+1,dtype=np.int64)
+	indptr[1:] = np.cumsum(np.bincount(post,minlength=W.shape[0]))
+	return Connectivity(W.shape[1],W.shape[0],indptr,pre), W[post,pre].astype(float)
+
+
+# ================================================================================
+# State --------------------------------------------------------------------------
+
+def initial_state (conn,W):
+	# State variables at rest, with the weights W [nSyn]:
+	# [u, ref, xbar_pre, xbar_post, gSynE, W, Iext]
+	N = conn.N_pre + conn.N_post
+	return [np.zeros(N),np.zeros(N),np.zeros(conn.nSyn),np.zeros(conn.N_post),
+		np.zeros(conn.N_pre),np.array(W,dtype=float),np.zeros(N)]
+
+def source (p,conn,rng):
+	# ----------------------------------------------------------------------------
+	# External current of the N_pre+N_post neurons (see SimCore/NoiseSource.py),
+	# with the parameters of the params module p. Sets p.NE and p.N_post to the
+	# numbers of neurons of conn.
+	# ----------------------------------------------------------------------------
+	p.NE, p.N_post = conn.N_pre, conn.N_post
+	return NoiseSource.from_params(p,(conn.N_pre+conn.N_post,),rng)
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def step (p,rule,conn,u,ref,xbar_pre,xbar_post,gSynE,W,Iext,source,preferred=1.):
+	# ----------------------------------------------------------------------------
+	# Forward Euler step of the population (see SimCore/Network.py for the single
+	# postsynaptic neuron). Returns the state variables at time t+dt, in the same
+	# order.
+	# ----------------------------------------------------------------------------
+	return _step(p,rule,conn,u,ref,xbar_pre,xbar_post,gSynE,W,Iext,source,preferred)[:7]
+
+def _step (p,rule,conn,u,ref,xbar_pre,xbar_post,gSynE,W,Iext,source,preferred,D=None):
+	# Step with the drive D [N_post] at time t (summed if None); also returns D at t+dt
+	NE = conn.N_pre
+	spikes = (u>p.Vth) # Verify all the neurons that fired an action potential
+	spikesE = spikes[:NE] # Presynaptic neurons
+	spost = spikes[NE:] # Postsynaptic neurons
+	ref += spikes*p.Tref  # update the refractory variable
+
+	# Update the synaptic conductances
+	gSynE_out = gSynE + p.gBarEx * spikesE
+	gSynE_out = gSynE_out - gSynE_out*p.step_tauSynEx
+
+	# Update the membrane potential
+	Isyn = -(u[NE:] - p.EsynE)*(conn.drive(W,gSynE) if D is None else D)
+	Iext = source.next(Iext)
+
+	u = u + (p.Vres-u)*spikes # reset the voltage for those who spiked
+	u_out = u + (-u + p.R*preferred*Iext)*p.step_tau_m # presynaptic neurons receive only external input
+	u_out[NE:] = u_out[NE:] + (Isyn)*p.step_tau_m # the postsynaptic neurons also receive the synaptic input
+	u_out[(ref>0.001)] = p.Vres
+	u_out = u_out + (p.Vspike-u_out+p.Vth)*(u_out>p.Vth) # add a constant to "see" the spikes
+
+	ref = _rect(ref - p.dt)
+	ref_out = ref
+
+	# Update the synaptic traces and weights, synapse by synapse
+	W_out,xbar_pre_out = rule.synapses(W,spikesE[conn.pre],spost[conn.post],xbar_pre,xbar_post[conn.post])
+	xbar_post_out = rule.post_trace(xbar_post,spost)
+	W_out = _rect(W_out) - _rect(W_out-p.w_max) # apply bounds
+	W_out = rule.commit(W,W_out)
+
+	# Update the drive: spikes with the weights at time t, then weight changes.
+	# Only the synapses of a neuron that spiked can change: those of the
+	# presynaptic spikes, and those onto the postsynaptic neurons that spiked
+	# (from the presynaptic neurons that did not, counted already).
+	if D is not None:
+		out_ptr,out_syn = conn.outgoing()
+		syn_pre = out_syn[_segments(out_ptr,np.flatnonzero(spikesE))]
+		if len(syn_pre):
+			D = D + p.gBarEx*np.bincount(conn.post[syn_pre],W[syn_pre],minlength=conn.N_post)
+		D = D - D*p.step_tauSynEx
+		syn_post = _segments(conn.indptr,np.flatnonzero(spost))
+		changed = np.concatenate((syn_pre,syn_post[~spikesE[conn.pre[syn_post]]]))
+		if len(changed):
+			D = D + np.bincount(conn.post[changed],(W_out[changed]-W[changed])*gSynE_out[conn.pre[changed]],
+				minlength=conn.N_post)
+
+	return u_out,ref_out,xbar_pre_out,xbar_post_out,gSynE_out,W_out,Iext,D
+
+
+def _run (u,ref,xbar_pre,xbar_post,gSynE,W,Wacc,Iext,Inoise,preferred,indptr,pre,post,out_ptr,out_syn,D,event,
+		lazy,xpre_n,t_open,window,t0,nSteps,
+		Vth,Vres,Vspike,Tref,R,EsynE,gBarEx,dt,step_tauSynEx,step_tau_m,step_tp_plast,step_tm_plast,
+		a_pre,a_post,a_plus,a_minus,w_max,rule,frozen,raster,record):
+	# ----------------------------------------------------------------------------
+	# Compiled time loop, as _run in SimCore/StepKernel.py, with the synapses of
+	# each postsynaptic neuron i in indptr[i]:indptr[i+1] (presynaptic neurons pre).
+	#   Inoise: [nSteps x N_pre+N_post] external current of each step
+	# If event, the drive D [N_post] is updated from the spikes (synapses of each
+	# presynaptic neuron in out_syn[out_ptr[j]:out_ptr[j+1]], postsynaptic neurons
+	# post) and the weight changes, instead of summed over the synapses.
+	# If lazy, the weights are updated at the spikes only, with the presynaptic
+	# traces xpre_n [N_pre] ("stdp") or the steps t_open [nSyn] at which the windows
+	# opened ("up", open while the step - t_open <= window); t0 is the first step.
+	# If record, the spikes of each step are written in raster [nSteps x N_pre+N_post].
+	# ----------------------------------------------------------------------------
+	N = u.shape[0]
+	NE = gSynE.shape[0]
+	NPost = N - NE
+	decay_g = 1. - step_tauSynEx
+	decay_p = 1. - step_tp_plast
+	decay_m = 1. - step_tm_plast
+	spikes = np.zeros(N,dtype=np.bool_)
+	Isyn = np.zeros(NPost)
+
+	for step in range(nSteps):
+
+		# Spikes and synaptic input of the postsynaptic neurons (state at time t)
+		for j in range(N):
+			spikes[j] = u[j] > Vth
+			if record:
+				raster[step,j] = spikes[j]
+		for i in range(NPost):
+			if event:
+				drive = D[i]
+			else:
+				drive = 0.
+				for k in range(indptr[i],indptr[i+1]):
+					drive += W[k]*gSynE[pre[k]]
+			Isyn[i] = -(u[NE+i] - EsynE)*drive
+
+		# Presynaptic conductances (and the drive, with the weights at time t) -----
+		for j in range(NE):
+			g = gSynE[j]
+			if spikes[j]:
+				g += gBarEx
+				if event:
+					for m in range(out_ptr[j],out_ptr[j+1]):
+						k = out_syn[m]
+						D[post[k]] += gBarEx*W[k]
+			gSynE[j] = g*decay_g
+		if event:
+			for i in range(NPost):
+				D[i] *= decay_g
+
+		# Synaptic traces and weights, at the spikes only -------------------------
+		if lazy:
+			t = t0 + step
+			for j in range(NE):
+				if not spikes[j]:
+					continue
+				for m in range(out_ptr[j],out_ptr[j+1]):
+					k = out_syn[m]
+					i = post[k]
+					spost = spikes[NE+i]
+					dW = 0.
+					if rule == RULE_STDP:
+						dW += a_pre + a_minus*xbar_post[i]
+						if spost:
+							dW += a_post + a_plus*xpre_n[j]
+					else:
+						dW += a_pre
+						if spost and t - t_open[k] <= window:
+							dW -= a_pre
+						t_open[k] = CLOSED if spost else t
+					w = W[k] + dW
+					if w < 0.:
+						w = 0.
+					elif w > w_max:
+						w = w_max
+					if frozen:
+						Wacc[k] += w - W[k]
+					else:
+						if event and w != W[k]:
+							D[i] += (w - W[k])*gSynE[j]
+						W[k] = w
+			for i in range(NPost):
+				if not spikes[NE+i]:
+					continue
+				for k in range(indptr[i],indptr[i+1]):
+					j = pre[k]
+					if spikes[j]:
+						continue # updated above
+					dW = 0.
+					if rule == RULE_STDP:
+						dW += a_post + a_plus*xpre_n[j]
+					else:
+						if t - t_open[k] <= window:
+							dW -= a_pre
+						t_open[k] = CLOSED
+					w = W[k] + dW
+					if w < 0.:
+						w = 0.
+					elif w > w_max:
+						w = w_max
+					if frozen:
+						Wacc[k] += w - W[k]
+					else:
+						if event and w != W[k]:
+							D[i] += (w - W[k])*gSynE[j]
+						W[k] = w
+			if rule == RULE_STDP:
+				for j in range(NE):
+					xpre_n[j] = (xpre_n[j] + spikes[j])*decay_p
+				for i in range(NPost):
+					xbar_post[i] = (xbar_post[i] + spikes[NE+i])*decay_m
+
+		else:
+			# Synaptic traces and weights, every step -----------------------------
+			for i in range(NPost):
+				spost = spikes[NE+i]
+				xpost = xbar_post[i]
+				for k in range(indptr[i],indptr[i+1]):
+					spk = spikes[pre[k]]
+					x = xbar_pre[k]
+					if rule == RULE_STDP:
+						dW = 0.
+						if spk:
+							dW += a_pre + a_minus*xpost
+						if spost:
+							dW += a_post + a_plus*x
+						xbar_pre[k] = (x + spk)*decay_p
+					else:
+						dW = 0.
+						xn = x
+						if spk:
+							dW += a_pre
+							xn = 10.
+						if spost and x > 0.:
+							dW -= a_pre
+						xn -= dt
+						if spost or xn < 0.:
+							xn = 0.
+						xbar_pre[k] = xn
+
+					w = W[k] + dW
+					if w < 0.:
+						w = 0.
+					elif w > w_max:
+						w = w_max
+					if frozen:
+						Wacc[k] += w - W[k]
+					else:
+						if event and w != W[k]:
+							D[i] += (w - W[k])*gSynE[pre[k]]
+						W[k] = w
+				if rule == RULE_STDP:
+					xbar_post[i] = (xpost + spost)*decay_m
+
+		# Membrane potentials -----------------------------------------------------
+		for j in range(N):
+			Iext[j] = Inoise[step,j]
+			r = ref[j]
+			v = u[j]
+			if spikes[j]:
+				r += Tref
+				v = Vres
+			v = v + (-v + R*preferred[j]*Iext[j])*step_tau_m
+			if j >= NE:
+				v = v + Isyn[j-NE]*step_tau_m
+			if r > 0.001:
+				v = Vres
+			if v > Vth:
+				v = Vspike + Vth
+			u[j] = v
+			r -= dt
+			ref[j] = r if r > 0. else 0.
+
+
+_run_compiled = njit(cache=True)(_run) if StepKernel.available() else None
+
+_no_raster = np.zeros((1,1),dtype=np.bool_)
+_no_index = np.zeros(1,dtype=np.int64)
+
+DRIVES = ("dense","event")
+PLASTICITY = ("step","lazy")
+
+def _window_steps (dt):
+	# Up-state window: its trace after m = 1, 2, ..., M steps (all > 0), computed
+	# as in the time loop
+	x = [10. - dt]
+	while x[-1] - dt > 0.:
+		x.append(x[-1] - dt)
+	return np.array(x) if x[0] > 0. else np.zeros(0)
+
+def _to_lazy (rule,conn,xbar_pre,dt):
+	# Presynaptic traces per neuron ("stdp") or steps at which the windows opened ("up")
+	if rule.kernel == StepKernel.RULE_STDP:
+		out_ptr,out_syn = conn.outgoing()
+		xpre_n = np.zeros(conn.N_pre)
+		has = np.diff(out_ptr) > 0
+		xpre_n[has] = xbar_pre[out_syn[out_ptr[:-1][has]]]
+		return xpre_n, _no_index
+	x = _window_steps(dt)
+	m = np.minimum(np.searchsorted(-x,-xbar_pre,'left')+1,len(x))
+	return np.zeros(0), np.where(xbar_pre > 0.,-m,CLOSED).astype(np.int64)
+
+def _from_lazy (rule,conn,xbar_pre,xpre_n,t_open,nSteps,dt):
+	if rule.kernel == StepKernel.RULE_STDP:
+		xbar_pre[:] = xpre_n[conn.pre]
+		return
+	x = _window_steps(dt)
+	m = nSteps - t_open
+	opened = (m >= 1) & (m <= len(x))
+	xbar_pre[:] = 0.
+	xbar_pre[opened] = x[m[opened]-1]
+
+def run (p,backend,rule,conn,u,ref,xbar_pre,xbar_post,gSynE,W,Iext,nSteps,source,preferred=None,raster=None,
+		drive="dense",plasticity="step"):
+	# ----------------------------------------------------------------------------
+	# Advances nSteps integration steps with the backend given ("numpy" or "numba")
+	# and returns the variables after the last step, in the same order as step
+	# (the numba backend updates them in place).
+	#   rule:   plasticity rule (see SimCore/Plasticity.py); with Plasticity.Frozen
+	#           the weights are kept fixed and their changes added to rule.Wacc
+	#   source: NoiseSource giving the external current (see source)
+	#   raster: SpikeRaster recording the spikes (see SimCore/Spikes.py), or None
+	#   drive:  "dense" or "event" (see the top of this file)
+	#   plasticity: "step" or "lazy" (see the top of this file); "lazy" needs the
+	#           numba backend, and the NumPy one runs "step" instead
+	# ----------------------------------------------------------------------------
+	if getattr(p,'integrator','euler') != "euler":
+		raise ValueError('Population supports only the "euler" integrator')
+	if drive not in DRIVES:
+		raise ValueError('Unknown drive "{0}", use one of {1}'.format(drive,DRIVES))
+	if plasticity not in PLASTICITY:
+		raise ValueError('Unknown plasticity "{0}", use one of {1}'.format(plasticity,PLASTICITY))
+	if preferred is None:
+		preferred = np.ones(conn.N_pre+conn.N_post)
+	event = (drive == "event")
+	D = conn.drive(W,gSynE) if event else None
+
+	if backend == "numba":
+		if rule.kernel not in (StepKernel.RULE_STDP,StepKernel.RULE_UP):
+			raise ValueError('Rule "{0}" is not in the compiled kernel'.format(rule.name))
+		frozen = isinstance(rule,Plasticity.Frozen)
+		Wacc = rule.Wacc if frozen else W
+		a_pre,a_post,a_plus,a_minus = rule.coefficients()
+		lazy = (plasticity == "lazy")
+		out_ptr,out_syn = conn.outgoing() if (event or lazy) else (_no_index,_no_index)
+		if not event:
+			D = np.zeros(0)
+		xpre_n,t_open = _to_lazy(rule,conn,xbar_pre,p.dt) if lazy else (np.zeros(0),_no_index)
+		window = len(_window_steps(p.dt))
+		done = 0
+		while done < nSteps:
+			Inoise = source.take(Iext,nSteps-done)
+			n = len(Inoise)
+			spikes = _no_raster if raster is None else np.zeros((n,len(u)),dtype=np.bool_)
+			_run_compiled(u,ref,xbar_pre,xbar_post,gSynE,W,Wacc,Iext,Inoise,preferred,conn.indptr,conn.pre,
+				conn.post,out_ptr,out_syn,D,event,lazy,xpre_n,t_open,window,done,n,
+				float(p.Vth),float(p.Vres),float(p.Vspike),float(p.Tref),float(p.R),float(p.EsynE),
+				float(p.gBarEx),float(p.dt),float(p.step_tauSynEx),float(p.step_tau_m),
+				float(p.step_tp_plast),float(p.step_tm_plast),
+				a_pre,a_post,a_plus,a_minus,float(p.w_max),rule.kernel,frozen,spikes,raster is not None)
+			if raster is not None:
+				raster.add_block(spikes)
+			done += n
+		if lazy:
+			_from_lazy(rule,conn,xbar_pre,xpre_n,t_open,nSteps,p.dt)
+		return u,ref,xbar_pre,xbar_post,gSynE,W,Iext
+
+	for i in range(nSteps):
+		if raster is not None:
+			raster.add(u > p.Vth)
+		u,ref,xbar_pre,xbar_post,gSynE,W,Iext,D \
+		= _step(p,rule,conn,u,ref,xbar_pre,xbar_post,gSynE,W,Iext,source,preferred,D)
+
+	return u,ref,xbar_pre,xbar_post,gSynE,W,Iext
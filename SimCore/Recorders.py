@@ -0,0 +1,198 @@
+##################################################################################
+# Recorders.py -- What a run keeps of a variable (e.g. the synaptic weights)
+#
+#   Final(initial=True): the value at the end of the run (and at the start)
+#   Every(k):            the value every k steps, from step 0
+#   Ring(k,M):           the last M values taken every k steps
+#   Stream(path,k):      the value every k steps, written to a .npy file on disk
+#                        as the run goes
+# run(advance,value,nSteps,recorders) advances the simulation in one call from
+# one sampling step of the recorders to the next, so the time loop does not
+# change with the recorders, and each recorder allocates only what it keeps, in
+# the dtype of the variable (e.g. float32, see SimStep.set_precision).
+# With a checkpoint (see SimCore/Checkpoint.py), the run is saved every so many
+# steps and can continue from the last checkpoint, and with a monitor (see
+# SimCore/Metrics.py) it reports its progress and where the time goes. A recorder
+# can also end the run early (e.g. Stop of SimCore/Convergence.py); the others
+# then keep what they took up to that step.
+##################################################################################
+
+
+import numpy as np
+
+
+class Recorder:
+	# ----------------------------------------------------------------------------
+	# A recorder takes the value at steps 0, every, 2*every, ... (or only at the
+	# start and end of the run if every is None):
+	#   start(x,nSteps): value at step 0, before a run of nSteps steps
+	#   sample(step,x):  value after step
+	#   finish(step,x):  value at the end of the run
+	#   result():        what was kept; steps: the steps at which it was taken
+	#   state(), restore(state): what was kept so far, for checkpoints
+	#   stop():          True to end the run after this step
+	# ----------------------------------------------------------------------------
+	every = None
+
+	def next (self,step,nSteps):
+		# Next step at which the value is taken
+		if self.every is None:
+			return nSteps
+		return min((step//self.every+1)*self.every,nSteps)
+
+	def due (self,step):
+		return self.every is not None and step % self.every == 0
+
+	def start (self,x,nSteps):
+		pass
+
+	def sample (self,step,x):
+		pass
+
+	def finish (self,step,x):
+		pass
+
+	def stop (self):
+		return False
+
+	def state (self):
+		return {name: np.copy(x) if isinstance(x,np.ndarray) else x for name,x in vars(self).items()}
+
+	def restore (self,state):
+		vars(self).update(state)
+
+
+class Final (Recorder):
+
+	def __init__ (self,initial=True):
+		self.initial = initial
+
+	def start (self,x,nSteps):
+		self.data = np.zeros((1+self.initial,)+np.shape(x),dtype=np.result_type(x))
+		self.data[0] = x
+		self.steps = np.array([0,nSteps][1-self.initial:])
+
+	def finish (self,step,x):
+		self.data[-1] = x
+		self.steps[-1] = step
+
+	def result (self):
+		return self.data
+
+
+class Every (Recorder):
+
+	def __init__ (self,every):
+		self.every = int(every)
+
+	def _allocate (self,shape,n,dtype):
+		return np.zeros((n,)+shape,dtype=dtype)
+
+	def start (self,x,nSteps):
+		self.steps = np.arange(0,nSteps+1,self.every)
+		self.data = self._allocate(np.shape(x),len(self.steps),np.result_type(x))
+		self.data[0] = x
+
+	def sample (self,step,x):
+		self.data[step//self.every] = x
+
+	def finish (self,step,x):
+		# A run ended early keeps the values taken up to step
+		n = step//self.every+1
+		if n < len(self.steps):
+			self.steps, self.data = self.steps[:n], self.data[:n]
+
+	def result (self):
+		return self.data
+
+
+class Ring (Recorder):
+
+	def __init__ (self,every,M):
+		self.every, self.M = int(every), int(M)
+
+	def start (self,x,nSteps):
+		self.data = np.zeros((self.M,)+np.shape(x),dtype=np.result_type(x))
+		self.taken = np.zeros(self.M,dtype=int)
+		self.n = 0
+		self.sample(0,x)
+
+	def sample (self,step,x):
+		self.data[self.n % self.M] = x
+		self.taken[self.n % self.M] = step
+		self.n += 1
+
+	@property
+	def steps (self):
+		order = np.arange(max(0,self.n-self.M),self.n) % self.M
+		return self.taken[order]
+
+	def result (self):
+		# The values kept, oldest first
+		order = np.arange(max(0,self.n-self.M),self.n) % self.M
+		return self.data[order]
+
+
+class Stream (Every):
+	# The values are written to path ([n x shape] .npy file) as they are taken;
+	# result() is the file, memory-mapped
+
+	def __init__ (self,path,every):
+		Every.__init__(self,every)
+		self.path = path
+
+	def _allocate (self,shape,n,dtype):
+		return np.lib.format.open_memmap(self.path,'w+',dtype,(n,)+shape)
+
+	def sample (self,step,x):
+		Every.sample(self,step,x)
+		self.data.flush()
+
+	def finish (self,step,x):
+		self.data.flush()
+		Every.finish(self,step,x)
+
+	def state (self):
+		# The values taken so far are in the file
+		self.data.flush()
+		return {'every': self.every, 'path': self.path, 'steps': self.steps}
+
+	def restore (self,state):
+		Every.restore(self,state)
+		self.data = np.lib.format.open_memmap(self.path,'r+')
+
+
+def run (advance,value,nSteps,recorders,checkpoint=None,monitor=None):
+	# ----------------------------------------------------------------------------
+	# advance(n) advances the simulation n steps and value() gives the variable
+	# recorded. The steps between two sampling steps are advanced in one call.
+	# checkpoint: Checkpoint saving the run every checkpoint.every steps (see
+	#   SimCore/Checkpoint.py). A resumed run starts from the step it saved.
+	# monitor: Monitor reporting the progress every monitor.every steps, and
+	#   timing the recorders (see SimCore/Metrics.py)
+	# ----------------------------------------------------------------------------
+	step = 0 if checkpoint is None else checkpoint.restore()
+	x = value()
+	if step == 0:
+		for r in recorders:
+			r.start(x,nSteps)
+	if monitor is not None:
+		monitor.begin(step,nSteps)
+	schedule = list(recorders) + [r for r in (checkpoint,monitor) if r is not None]
+	while step < nSteps:
+		n = min([r.next(step,nSteps) for r in schedule]+[nSteps]) - step
+		advance(n)
+		step += n
+		x = value()
+		if monitor is not None:
+			monitor.mark()
+		for r in schedule:
+			if r.due(step):
+				r.sample(step,x)
+		if monitor is not None:
+			monitor.lap('recording')
+		if any(r.stop() for r in schedule):
+			break
+	for r in schedule:
+		r.finish(step,x)
+	return recorders
@@ -0,0 +1,290 @@
+##################################################################################
+# Scheduler.py -- Runs the trials of a figure in a pool of worker processes
+#
+# The trials are grouped in chunks of consecutive trials, and every chunk is
+# simulated as one batch by simulate(trials,checkpoint,resume) of the script of
+# the figure, loaded once in each worker (see Pipeline.load_script). The results
+# come back to the driver, which hands them to on_result as they arrive, either
+# pickled through the pool or, with collect (see SimCore/SharedResults.py),
+# written by the workers in shared memory owned by the driver.
+#   CPUs:     the pool has at most as many workers as the CPUs this process may
+#             use, minus one
+#   memory:   and at most as many as fit in the memory limit (by default 80% of
+#             the available memory), with the memory of a worker estimated from
+#             the size of the chunk (see worker_bytes)
+#   retries:  a chunk that fails (an error in the simulation, or its worker
+#             killed, e.g. for lack of memory) is run again up to `retries`
+#             times. When a worker dies, every chunk running at that moment
+#             counts one attempt.
+#   status:   the state of every trial (done, failed with its error, or pending)
+#             is kept in a JSON file, rewritten after every chunk
+# With checkpoints, each chunk is saved as it runs (see SimCore/Checkpoint.py),
+# and a chunk that is run again (in a retry, or in a new run of the scheduler
+# with the same chunks) continues from its checkpoint. The trials already done
+# are not given to the scheduler again (e.g. run_code.py of Figure 4E skips the
+# trials in its cache), so a new run only does the unfinished work.
+##################################################################################
+
+
+import os, json, math, time, traceback
+import concurrent.futures as cf
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+from SimCore import Pipeline, NoiseSource, SharedResults
+
+
+# ================================================================================
+# Chunks and resources -----------------------------------------------------------
+
+def chunks (trials,size):
+	# ----------------------------------------------------------------------------
+	# Splits the trials into runs of consecutive trials within the same multiple
+	# of size, [(first trial, n)], so that the chunks of a run that is repeated
+	# (and their checkpoints) are the same whatever trials were done before
+	# ----------------------------------------------------------------------------
+	out = []
+	for tr in sorted(trials):
+		if out and out[-1][0]+out[-1][1] == tr and tr % size:
+			out[-1][1] += 1
+		else:
+			out.append([tr,1])
+	return [tuple(c) for c in out]
+
+def chunk_size (NTrials,processes=None,chunk=None):
+	# Most trials of a chunk: chunk, or 4 chunks per worker for NTrials trials
+	n = processes or max(cpus()-1,1)
+	return chunk or max(int(math.ceil(NTrials/(4.*n))),1)
+
+def cpus ():
+	# Number of CPUs this process may use
+	try:
+		return len(os.sched_getaffinity(0))
+	except AttributeError:
+		return os.cpu_count() or 1
+
+def available_memory ():
+	# [bytes] Memory available for new processes (MemAvailable on Linux), or None
+	try:
+		with open('/proc/meminfo') as f:
+			for line in f:
+				if line.startswith('MemAvailable:'):
+					return int(line.split()[1])*1024
+	except OSError:
+		pass
+	try:
+		return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+	except (ValueError,OSError,AttributeError):
+		return None
+
+BASE_BYTES = 200*2**20	# [bytes] Python, NumPy, Numba and the script in a worker
+
+def worker_bytes (p,n):
+	# ----------------------------------------------------------------------------
+	# [bytes] Estimate of the memory of a worker simulating n trials at once with
+	# the params module p: the block of noise (drawn, filtered and kept, and a
+	# copy in the checkpoints) and the state arrays, besides BASE_BYTES
+	# ----------------------------------------------------------------------------
+	N = p.NE + getattr(p,'N_post',1)
+	substeps = NoiseSource.resolution(p)[1]
+	block = min(p.noise_block*substeps*n*N,max(NoiseSource.max_elements,n*N*substeps))
+	return BASE_BYTES + 4*8*block + 16*8*n*N
+
+def workers (n_chunks,size,p,processes=None,memory=None):
+	# ----------------------------------------------------------------------------
+	# Number of workers for n_chunks chunks of up to size trials:
+	#   processes: most workers (default: CPUs - 1)
+	#   memory:    [bytes] memory they may use together (default: 80% of the
+	#              available memory)
+	# ----------------------------------------------------------------------------
+	n = processes or max(cpus()-1,1)
+	if memory is None:
+		free = available_memory()
+		memory = None if free is None else 0.8*free
+	if memory is not None:
+		fit = int(memory//worker_bytes(p,size))
+		if fit < 1:
+			raise MemoryError('A worker with {0} trials needs about {1:.0f} MB, {2:.0f} MB allowed; use smaller chunks'.format(
+				size,worker_bytes(p,size)/2.**20,memory/2.**20))
+		n = min(n,fit)
+	return max(min(n,n_chunks),1)
+
+
+# ================================================================================
+# State of the trials ------------------------------------------------------------
+
+def ranges (trials):
+	# [0,1,2,5,7,8] -> '0-2, 5, 7-8'
+	runs = []
+	for tr in sorted(trials):
+		if runs and runs[-1][0]+runs[-1][1] == tr:
+			runs[-1][1] += 1
+		else:
+			runs.append([tr,1])
+	out = []
+	for first,n in runs:
+		out.append(str(first) if n == 1 else '{0}-{1}'.format(first,first+n-1))
+	return ', '.join(out)
+
+class Status:
+	# ----------------------------------------------------------------------------
+	# State of each trial of a run, {trial: {'state', 'attempts', 'error'}}, with
+	# state "done", "failed" or "pending", kept in path (JSON)
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,path,trials=(),done=()):
+		self.path = path
+		self.trials = {int(tr): {'state': 'pending', 'attempts': 0, 'error': None} for tr in trials}
+		for tr in done:
+			self.trials[int(tr)]['state'] = 'done'
+
+	@classmethod
+	def load (cls,path):
+		status = cls(path)
+		with open(path) as f:
+			status.trials = {int(tr): s for tr,s in json.load(f)['trials'].items()}
+		return status
+
+	def set (self,trials,state,error=None):
+		for tr in trials:
+			s = self.trials[int(tr)]
+			s['state'] = state
+			if state != 'done':
+				s['attempts'] += 1
+				s['error'] = error
+
+	def save (self):
+		if self.path is None:
+			return
+		folder = os.path.dirname(self.path)
+		if folder:
+			os.makedirs(folder,exist_ok=True)
+		with open(self.path+'.tmp','w') as f:
+			json.dump({'updated': time.strftime('%Y-%m-%d %H:%M:%S'), 'counts': self.counts(),
+				'trials': {str(tr): s for tr,s in sorted(self.trials.items())}},f,indent=1)
+		os.replace(self.path+'.tmp',self.path)
+
+	def select (self,state):
+		return sorted(tr for tr,s in self.trials.items() if s['state'] == state)
+
+	def counts (self):
+		return {state: len(self.select(state)) for state in ('done','failed','pending')}
+
+	def report (self):
+		lines = ['Trials: {done} done, {failed} failed, {pending} pending'.format(**self.counts())]
+		for state in ('failed','pending'):
+			if self.select(state):
+				lines.append('  {0}: {1}'.format(state,ranges(self.select(state))))
+		for tr in self.select('failed'):
+			error = (self.trials[tr]['error'] or '').strip().splitlines()
+			lines.append('  trial {0} ({1} attempts): {2}'.format(tr,self.trials[tr]['attempts'],error[-1] if error else ''))
+		return '\n'.join(lines)
+
+
+# ================================================================================
+# Workers ------------------------------------------------------------------------
+
+Worker = {}
+
+def _init (script,backend,collect=None):
+	# Loads the script of the figure in a worker, and attaches the shared results
+	module = Pipeline.load_script(script)
+	if backend is not None:
+		module.SS.set_backend(backend)
+	Worker['script'] = module
+	Worker['collect'] = None if collect is None else SharedResults.attach(collect)
+
+def _run_chunk (task):
+	index,trials,checkpoint = task
+	time_in = time.time()
+	try:
+		W = np.moveaxis(Worker['script'].simulate(list(trials),checkpoint,checkpoint is not None),1,0)
+		if Worker['collect'] is not None:
+			Worker['collect'].put(index,trials,W)
+			W = None
+	except Exception:
+		return trials, None, traceback.format_exc(), time.time()-time_in
+	return trials, W, None, time.time()-time_in
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def run (script,trials,on_result,chunk=None,processes=None,memory=None,retries=2,
+		status=None,checkpoints=None,backend=None,done=(),collect=None):
+	# ----------------------------------------------------------------------------
+	# Runs the trials given and returns their Status.
+	#   script:      script of the figure, with simulate(trials,checkpoint,resume)
+	#                returning [snapshots x NTrials x ...] (e.g. Figure4E)
+	#   on_result:   on_result(trials,W,seconds) is called in this process with the
+	#                results [NTrials x snapshots x ...] of every chunk done
+	#   chunk:       most trials of a chunk (default: 4 chunks per worker for all
+	#                the trials, done or not)
+	#   processes, memory: limits of the pool (see workers)
+	#   retries:     times a failed chunk is run again
+	#   status:      file of the Status (JSON), or None
+	#   checkpoints: name of the checkpoint of a chunk, formatted with its first
+	#                trial and its number of trials (e.g. 'Data/checkpoint_{0}_{1}.pkl'),
+	#                or None for no checkpoints
+	#   done:        trials done before (e.g. found in a cache), kept in the Status
+	#   collect:     SharedResults.Rows or Summary (for chunks of chunk_size trials)
+	#                created by the caller, written by the workers (index: the first
+	#                trial of the chunk); on_result then
+	#                gets collect.get(index,trials) (a view of the rows, or the Moments
+	#                of the chunk) instead of the results pickled through the pool
+	# ----------------------------------------------------------------------------
+	trials = sorted(trials)
+	state = Status(status,sorted(set(trials)|set(done)),done)
+	if not trials:
+		state.save()
+		return state
+	module = Pipeline.load_script(script)
+	chunk = chunk_size(len(state.trials),processes,chunk)
+	todo = chunks(trials,chunk)
+	n = workers(len(todo),chunk,module.p,processes,memory)
+	print('Scheduler: {0} trials in {1} chunks of up to {2} trials, {3} workers'.format(len(trials),len(todo),chunk,n))
+	state.save()
+
+	attempts = dict.fromkeys(todo,0)
+	running = {}
+	pool = None
+	try:
+		while todo or running:
+			if pool is None:
+				pool = cf.ProcessPoolExecutor(n,initializer=_init,initargs=(script,backend,None if collect is None else collect.spec()))
+			while todo and len(running) < n:
+				first,size = c = todo.pop(0)
+				path = None if checkpoints is None else checkpoints.format(first,size)
+				running[pool.submit(_run_chunk,(first,tuple(range(first,first+size)),path))] = c
+			finished,_ = cf.wait(running,return_when=cf.FIRST_COMPLETED)
+			if any(isinstance(f.exception(),BrokenProcessPool) for f in finished):
+				# A worker died: the other chunks of the pool fail with it
+				finished,_ = cf.wait(running)
+				pool.shutdown(wait=False)
+				pool = None
+			for future in finished:
+				c = running.pop(future)
+				if isinstance(future.exception(),BrokenProcessPool):
+					chunk_trials,W,seconds = tuple(range(c[0],c[0]+c[1])),None,0.
+					error = 'The worker process died (killed, or out of memory)'
+				else:
+					chunk_trials,W,error,seconds = future.result()
+				if error is None:
+					if collect is not None:
+						W = collect.get(c[0],chunk_trials)
+					on_result(chunk_trials,W,seconds)
+					state.set(chunk_trials,'done')
+					print('Scheduler: trials {0} done ({1:.1f} s)'.format(ranges(chunk_trials),seconds))
+				else:
+					attempts[c] += 1
+					retry = attempts[c] <= retries
+					state.set(chunk_trials,'pending' if retry else 'failed',error)
+					print('Scheduler: trials {0} failed (attempt {1} of {2}): {3}'.format(
+						ranges(chunk_trials),attempts[c],retries+1,error.strip().splitlines()[-1]))
+					if retry:
+						todo.append(c)
+				state.save()
+	finally:
+		if pool is not None:
+			pool.shutdown(wait=False,cancel_futures=True)
+	return state
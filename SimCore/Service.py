@@ -0,0 +1,546 @@
+##################################################################################
+# Service.py -- Long-lived pool of warm workers serving simulation jobs
+#
+# A Server starts a pool of worker processes that load the scripts of the
+# figures once (NumPy, the params and SimStep modules, and with the compiled
+# backend its kernels) and keep them loaded, and listens on a local socket
+# (multiprocessing.connection, with a per-user authentication key) for the jobs of any
+# number of clients: notebooks, batch drivers, run_code.py of Figure 4E, ...
+# A job is a dict:
+#   script:   "fig4E", "wake" or "sleep" (see SCRIPTS)
+#   args:     positional arguments of simulate in the script (e.g. the trials of
+#             fig4E, or Wpre of sleep), kwargs: its keyword arguments
+#   params:   {name: value} set in the params module for this job, with the names
+#             of SimCore/Sweep.py (e.g. {'gBarEx': 0.5, 'a_pre["up"]': -0.002});
+#             every job starts from the initial params of the script
+#   seed:     shortcut for params['seed']
+#   recorder: what is kept of the weights, as a list [name, arguments...], e.g.
+#             ["final"], ["every", 100], ["ring", 100, 10] (see SimCore/Recorders.py)
+#   stop:     early termination, [criterion, every, window, tol, min_steps] (see
+#             SimCore/Convergence.py)
+#   progress: steps between two progress messages (0: every 5% of the run), or
+#             None for none. The progress is measured by a Monitor (see
+#             SimCore/Metrics.py), which times the phases of every step.
+#   backend:  "numpy" or "numba" (default: the backend of the server)
+# The precision and the integrator follow the params (precision, integrator, dt).
+# The server sends back to the client of each job, in order:
+#   ("accepted", id), ("started", id, worker), ("progress", id, record)...,
+#   then ("result", id, result of simulate, seconds) or ("error", id, traceback)
+# The jobs wait in one queue per client and the free workers take them from the
+# clients in turn, so a notebook is not held behind the hundreds of jobs of a
+# batch driver. A worker that dies (killed, or out of memory) is replaced, and
+# its job ends with an error.
+##################################################################################
+
+
+import os, copy, time, socket, secrets, ipaddress, tempfile, threading, traceback, collections
+import queue as queues
+import multiprocessing as mp
+import numpy as np
+from multiprocessing.connection import Listener, Client as connect
+
+from SimCore import Pipeline, Sweep, Scheduler, Recorders, Convergence, Metrics
+
+
+ROOT = os.path.dirname(Pipeline.CORE)
+
+SCRIPTS = {'fig4E': os.path.join('Figure4E','UP-state-mediated_plast_fig4E.py'),
+	'wake': os.path.join('Figure4CD','Step1-wake_learning','UP-state-mediated_plast_fig4CD_wake.py'),
+	'sleep': os.path.join('Figure4CD','Step2-sleep_learning','UP-state-mediated_plast_fig4CD_sleep.py')}
+
+# Arguments of simulate in a short run of each script, which warms up a worker
+WARMUP = {'fig4E': lambda p: ([0],), 'wake': lambda p: (), 'sleep': lambda p: (np.full((1,p.NE),0.1),)}
+
+RECORDERS = {'final': Recorders.Final, 'every': Recorders.Every, 'ring': Recorders.Ring, 'stream': Recorders.Stream}
+
+
+# ================================================================================
+# Address and key ----------------------------------------------------------------
+
+def default_address ():
+	# The environment variable SIMSTEP_SERVICE, or a socket of this user in the
+	# temporary folder (localhost:6150 where there are no Unix sockets)
+	if os.environ.get('SIMSTEP_SERVICE'):
+		return os.environ['SIMSTEP_SERVICE']
+	if not hasattr(socket,'AF_UNIX'):
+		return 'localhost:6150'
+	return os.path.join(tempfile.gettempdir(),'simcore-service-{0}.sock'.format(os.getuid()))
+
+def parse_address (text=None):
+	# ----------------------------------------------------------------------------
+	# 'host:port' -> (host,port); anything else is the path of a Unix socket.
+	# The requests are unpickled by the server, so only hosts that resolve to
+	# loopback addresses are accepted: the service is never reachable from
+	# other machines.
+	# ----------------------------------------------------------------------------
+	text = text or default_address()
+	host,_,port = text.rpartition(':')
+	if not (host and port.isdigit()):
+		return text
+	host = host.strip('[]')
+	try:
+		found = {info[4][0] for info in socket.getaddrinfo(host,int(port),proto=socket.IPPROTO_TCP)}
+	except socket.gaierror as error:
+		raise ValueError('Cannot resolve the host of {0}: {1}'.format(text,error))
+	if not all(ipaddress.ip_address(a.split('%')[0]).is_loopback for a in found):
+		raise ValueError('The service only listens on loopback addresses, not on {0}'.format(text))
+	return (host,int(port))
+
+def key_file ():
+	# File of the key of this user
+	return os.path.join(os.path.expanduser('~'),'.simcore','service.key')
+
+def authkey (key=None,create=False):
+	# ----------------------------------------------------------------------------
+	# The key the clients must know: key, the environment variable
+	# SIMSTEP_SERVICE_KEY, or a random key of this user kept in key_file(),
+	# readable by this user only. The server creates the file if it does not
+	# exist (create=True); a client without it cannot connect.
+	# ----------------------------------------------------------------------------
+	key = key or os.environ.get('SIMSTEP_SERVICE_KEY')
+	if key:
+		return key.encode() if isinstance(key,str) else key
+	path = key_file()
+	if not os.path.exists(path):
+		if not create:
+			raise RuntimeError('No service key in {0}: start the service, or set SIMSTEP_SERVICE_KEY'.format(path))
+		os.makedirs(os.path.dirname(path),mode=0o700,exist_ok=True)
+		try:
+			fd = os.open(path,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o600)
+		except FileExistsError:
+			pass # created by another server
+		else:
+			with os.fdopen(fd,'w') as f:
+				f.write(secrets.token_hex(32))
+	if os.stat(path).st_mode & 0o077:
+		raise RuntimeError('{0} can be read by other users, make it private (chmod 600)'.format(path))
+	with open(path) as f:
+		return f.read().strip().encode()
+
+
+# ================================================================================
+# Workers ------------------------------------------------------------------------
+
+class Progress (Metrics.Monitor):
+	# Monitor sending its reports to the client of the job instead of printing them
+
+	def __init__ (self,send,every=None,label=''):
+		Metrics.Monitor.__init__(self,None,every or None,label,quiet=True)
+		self.send = send
+
+	def report (self,event,step):
+		record = Metrics.Monitor.report(self,event,step)
+		self.send(record)
+		return record
+
+def recorder (spec):
+	# ["every", 100] -> Recorders.Every(100)
+	name = spec[0]
+	if name not in RECORDERS:
+		raise ValueError('Unknown recorder "{0}", use one of {1}'.format(name,', '.join(RECORDERS)))
+	return RECORDERS[name](*spec[1:])
+
+Worker = {}
+
+def _load (name):
+	# Loads the script of a job once, and keeps its initial parameters and backend
+	if name not in Worker['scripts']:
+		module = Pipeline.load_script(os.path.join(ROOT,SCRIPTS[name]))
+		if Worker['backend'] is not None:
+			module.SS.set_backend(Worker['backend'])
+		Worker['scripts'][name] = (module,copy.deepcopy(Pipeline.params_values(module.p)),module.SS.Backend)
+	return Worker['scripts'][name]
+
+def _run_job (job,send):
+	module,params,backend = _load(job['script'])
+	p, SS = module.p, module.SS
+	for name,value in params.items():
+		setattr(p,name,copy.deepcopy(value))
+	values = dict(job.get('params') or {})
+	if job.get('seed') is not None:
+		values['seed'] = job['seed']
+	Sweep.apply(p,values)
+	SS.set_backend(job.get('backend') or backend)
+	SS.set_precision(p.precision)
+	SS.set_integrator(p.integrator,p.dt)
+
+	kwargs = dict(job.get('kwargs') or {})
+	if job.get('recorder'):
+		kwargs['recorder'] = recorder(job['recorder'])
+	if job.get('stop'):
+		kwargs['stop'] = Convergence.Stop(*job['stop'])
+	SS.Monitor = None if job.get('progress') is None else Progress(send,job['progress'],job['script'])
+	try:
+		return module.simulate(*job.get('args',()),**kwargs)
+	finally:
+		SS.Monitor = None
+
+def _warm (name):
+	# Runs the script for a few steps, so that the first job finds the noise and
+	# the rules set up and, with the compiled backend, the kernel compiled
+	module = _load(name)[0]
+	_run_job({'script': name, 'args': WARMUP[name](module.p), 'params': {'t_max': 10*module.p.dt}},None)
+
+def _worker (index,scripts,backend,jobs,messages):
+	# ----------------------------------------------------------------------------
+	# Worker process: loads and warms up the scripts, says it is ready and runs the jobs it is
+	# given through jobs (a Pipe) until it gets None. Its messages go to the
+	# messages queue of the server as (worker, message).
+	# ----------------------------------------------------------------------------
+	Worker.update(scripts={},backend=backend)
+	for name in scripts:
+		_warm(name)
+	messages.put((index,('ready',)))
+	while True:
+		task = jobs.recv()
+		if task is None:
+			break
+		i,job = task
+		messages.put((index,('started',i,index)))
+		time_in = time.time()
+		try:
+			result = _run_job(job,lambda record: messages.put((index,('progress',i,record))))
+		except Exception:
+			messages.put((index,('error',i,traceback.format_exc())))
+		else:
+			messages.put((index,('result',i,result,time.time()-time_in)))
+
+
+# ================================================================================
+# Server -------------------------------------------------------------------------
+
+class _Peer:
+	# Connection of a client, and its jobs waiting for a worker
+
+	def __init__ (self,conn):
+		self.conn, self.lock = conn, threading.Lock()
+		self.waiting = collections.deque()
+		self.closed = False
+
+	def send (self,message):
+		# A client that went away does not stop the server
+		with self.lock:
+			if self.closed:
+				return
+			try:
+				self.conn.send(message)
+			except (OSError,EOFError,ValueError):
+				self.closed = True
+
+class Server:
+	# ----------------------------------------------------------------------------
+	#   address:   'host:port' or path of a Unix socket (see default_address)
+	#   processes: number of workers (default: CPUs - 1)
+	#   scripts:   scripts loaded by the workers when they start (the others are
+	#              loaded by their first job)
+	#   backend:   backend of the jobs that do not give one (default: SIMSTEP_BACKEND)
+	#   key:       authentication key (see authkey; by default the key of this
+	#              user, created on the first start)
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,address=None,processes=None,scripts=tuple(SCRIPTS),backend=None,key=None):
+		self.address = parse_address(address)
+		self.processes = processes or max(Scheduler.cpus()-1,1)
+		self.scripts, self.backend, self.key = list(scripts), backend, authkey(key,create=True)
+		for name in self.scripts:
+			if name not in SCRIPTS:
+				raise ValueError('Unknown script "{0}", use one of {1}'.format(name,', '.join(SCRIPTS)))
+		self.lock = threading.Lock()
+		self.messages = mp.Queue()
+		self.workers = {}	# index -> {'process', 'pipe', 'job', 'ready'}
+		self.peers = []		# clients, in the order they take turns
+		self.owner = {}		# job id -> client
+		self.next_id, self.done, self.failed = 0, 0, 0
+		self.running = False
+		self.started = time.time()
+
+	# ---- workers ----
+
+	def _start_worker (self,index):
+		pipe,child = mp.Pipe()
+		process = mp.Process(target=_worker,args=(index,self.scripts,self.backend,child,self.messages),daemon=True)
+		process.start()
+		child.close()
+		self.workers[index] = {'process': process, 'pipe': pipe, 'job': None, 'ready': False}
+
+	def _dispatch (self):
+		# Gives the waiting jobs to the free workers, one client after the other
+		# (called with the lock)
+		for worker in self.workers.values():
+			if not worker['ready'] or worker['job'] is not None:
+				continue
+			peer = next((peer for peer in self.peers if peer.waiting),None)
+			if peer is None:
+				return
+			i,job = peer.waiting.popleft()
+			self.peers.remove(peer)
+			self.peers.append(peer)
+			try:
+				worker['pipe'].send((i,job))
+			except OSError:
+				# The worker died: the job waits for another (see _check_workers)
+				peer.waiting.appendleft((i,job))
+				worker['ready'] = False
+				continue
+			worker['job'] = i
+
+	def _finish (self,i,message):
+		# The last message of job i (called with the lock)
+		peer = self.owner.pop(i,None)
+		if message[0] == 'result':
+			self.done += 1
+		else:
+			self.failed += 1
+		return peer
+
+	def _check_workers (self):
+		# Replaces the workers that died, and ends their jobs with an error
+		ended = []
+		with self.lock:
+			for index,worker in list(self.workers.items()):
+				if worker['process'].is_alive():
+					continue
+				if worker['job'] is not None:
+					message = ('error',worker['job'],'The worker process died (killed, or out of memory)')
+					ended.append((self._finish(worker['job'],message),message))
+				print('Service: worker {0} died (exit code {1}), starting a new one'.format(index,worker['process'].exitcode))
+				worker['pipe'].close()
+				self._start_worker(index)
+		for peer,message in ended:
+			if peer is not None:
+				peer.send(message)
+
+	def _route (self):
+		# Sends the messages of the workers to the clients of their jobs
+		checked = time.time()
+		while self.running:
+			if time.time()-checked > 1.:
+				self._check_workers()
+				checked = time.time()
+			try:
+				index,message = self.messages.get(timeout=1.)
+			except queues.Empty:
+				continue
+			with self.lock:
+				worker = self.workers.get(index)
+				if message[0] == 'ready':
+					worker['ready'] = True
+					self._dispatch()
+					continue
+				if message[0] in ('result','error'):
+					peer = self._finish(message[1],message)
+					if worker is not None and worker['job'] == message[1]:
+						worker['job'] = None
+					self._dispatch()
+				else:
+					peer = self.owner.get(message[1])
+			if peer is not None:
+				peer.send(message)
+
+	# ---- clients ----
+
+	def _check_job (self,job):
+		if not isinstance(job,dict) or job.get('script') not in SCRIPTS:
+			return 'Unknown script, use one of {0}'.format(', '.join(SCRIPTS))
+		if job.get('recorder') and job['recorder'][0] not in RECORDERS:
+			return 'Unknown recorder "{0}", use one of {1}'.format(job['recorder'][0],', '.join(RECORDERS))
+		return None
+
+	def _serve (self,peer):
+		# Requests of one client: ("submit", job), ("status",) or ("shutdown",)
+		try:
+			while self.running:
+				request = peer.conn.recv()
+				if request[0] == 'submit':
+					with self.lock:
+						i = self.next_id
+						self.next_id += 1
+					error = self._check_job(request[1])
+					peer.send(('accepted',i))
+					if error is not None:
+						with self.lock:
+							self.failed += 1
+						peer.send(('error',i,error))
+						continue
+					with self.lock:
+						self.owner[i] = peer
+						peer.waiting.append((i,request[1]))
+						self._dispatch()
+				elif request[0] == 'status':
+					peer.send(('status',self.status()))
+				elif request[0] == 'shutdown':
+					peer.send(('stopping',))
+					self.stop()
+				else:
+					peer.send(('error',None,'Unknown request "{0}"'.format(request[0])))
+		except (EOFError,OSError):
+			pass
+		finally:
+			# The jobs of a client that went away are not run, and the results of
+			# its running jobs are dropped
+			with self.lock:
+				for i,job in peer.waiting:
+					self.owner.pop(i,None)
+				peer.waiting.clear()
+				peer.closed = True
+				if peer in self.peers:
+					self.peers.remove(peer)
+			peer.conn.close()
+
+	def status (self):
+		with self.lock:
+			return {'address': self.address, 'uptime_s': time.time()-self.started,
+				'workers': len(self.workers), 'pids': {index: w['process'].pid for index,w in self.workers.items()},
+				'ready': sum(w['ready'] for w in self.workers.values()),
+				'running': {index: w['job'] for index,w in self.workers.items() if w['job'] is not None},
+				'waiting': sum(len(peer.waiting) for peer in self.peers), 'clients': len(self.peers),
+				'done': self.done, 'failed': self.failed}
+
+	# ---- main loop ----
+
+	def serve (self):
+		# Starts the workers and serves the clients until a shutdown request (or Ctrl-C)
+		if isinstance(self.address,str) and os.path.exists(self.address):
+			# The socket of a server that did not stop cleanly
+			try:
+				connect(self.address,authkey=self.key).close()
+			except (mp.AuthenticationError,EOFError):
+				raise RuntimeError('A service is already listening on {0}'.format(self.address))
+			except OSError:
+				os.remove(self.address)
+			else:
+				raise RuntimeError('A service is already listening on {0}'.format(self.address))
+		self.running = True
+		mask = os.umask(0o177)	# the Unix socket is created for this user only
+		try:
+			self.listener = Listener(self.address,authkey=self.key)
+		finally:
+			os.umask(mask)
+		for index in range(self.processes):
+			self._start_worker(index)
+		router = threading.Thread(target=self._route,daemon=True)
+		router.start()
+		print('Service: {0} workers, scripts {1}, listening on {2}'.format(self.processes,', '.join(self.scripts),self.address))
+		try:
+			while self.running:
+				try:
+					conn = self.listener.accept()
+				except mp.AuthenticationError:
+					print('Service: connection refused (wrong key)')
+					continue
+				if not self.running:
+					conn.close()
+					break
+				peer = _Peer(conn)
+				with self.lock:
+					self.peers.append(peer)
+				threading.Thread(target=self._serve,args=(peer,),daemon=True).start()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			self.running = False
+			self.listener.close()
+			router.join()
+			for worker in self.workers.values():
+				try:
+					worker['pipe'].send(None)
+				except OSError:
+					pass
+			for worker in self.workers.values():
+				worker['process'].join(5.)
+				if worker['process'].is_alive():
+					worker['process'].terminate()
+			print('Service: stopped ({0} jobs done, {1} failed)'.format(self.done,self.failed))
+
+	def stop (self):
+		# Ends serve() (from another thread): the accept is woken by a connection
+		self.running = False
+		try:
+			connect(self.address,authkey=self.key).close()
+		except OSError:
+			pass
+
+
+# ================================================================================
+# Client -------------------------------------------------------------------------
+
+class Client:
+	# ----------------------------------------------------------------------------
+	# Connection to a Server. The messages of all the jobs submitted come through
+	# it; those of other jobs that arrive while waiting are kept for later.
+	#   submit(job):         sends a job (see above) and returns its id
+	#   messages(ids):       the messages of the jobs ids, as they come, until
+	#                        all of them end
+	#   map(jobs,on_progress): runs the jobs (in parallel in the workers) and returns
+	#                        their results in order; on_progress(k,record) is called
+	#                        with the progress reports of the k-th job
+	#   run(job,on_progress): runs one job and returns its result
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,address=None,key=None):
+		self.conn = connect(parse_address(address),authkey=authkey(key))
+		self.pending = collections.defaultdict(collections.deque)	# job id -> messages
+
+	def close (self):
+		self.conn.close()
+
+	def __enter__ (self):
+		return self
+
+	def __exit__ (self,*exc):
+		self.close()
+
+	def _receive (self):
+		message = self.conn.recv()
+		if len(message) > 1 and message[0] in ('started','progress','result','error') and message[1] is not None:
+			self.pending[message[1]].append(message)
+			return None
+		return message
+
+	def _request (self,request,reply):
+		# Sends a request and waits for its reply (the job messages in between are kept)
+		self.conn.send(request)
+		while True:
+			message = self._receive()
+			if message is not None and message[0] == reply:
+				return message
+			if message is not None and message[0] == 'error':
+				raise RuntimeError(message[2])
+
+	def submit (self,job):
+		return self._request(('submit',job),'accepted')[1]
+
+	def messages (self,ids):
+		ids = set(ids)
+		while ids:
+			i = next((i for i in ids if self.pending[i]),None)
+			if i is None:
+				self._receive()
+				continue
+			message = self.pending[i].popleft()
+			if message[0] in ('result','error'):
+				ids.discard(i)
+				del self.pending[i]
+			yield message
+
+	def map (self,jobs,on_progress=None):
+		ids = [self.submit(job) for job in jobs]
+		order = {i: k for k,i in enumerate(ids)}
+		results = {}
+		for message in self.messages(ids):
+			if message[0] == 'progress' and on_progress is not None:
+				on_progress(order[message[1]],message[2])
+			elif message[0] == 'result':
+				results[message[1]] = message[2]
+			elif message[0] == 'error':
+				raise RuntimeError('Job {0} failed:\n{1}'.format(message[1],message[2]))
+		return [results[i] for i in ids]
+
+	def run (self,job,on_progress=None):
+		return self.map([job],on_progress)[0]
+
+	def status (self):
+		return self._request(('status',),'status')[1]
+
+	def shutdown (self):
+		self._request(('shutdown',),'stopping')
@@ -0,0 +1,162 @@
+##################################################################################
+# SharedResults.py -- Results of the trials collected in shared memory
+#
+# The driver of a run (see SimCore/Scheduler.py) creates the arrays in shared
+# memory (multiprocessing.shared_memory) before the workers start, and the
+# workers attach them by name and write their results in place, so no array is
+# pickled through the pool nor written to disk on the way:
+#   Rows:    the result of every trial, [NTrials x shape] (e.g. the initial and
+#            final weights), row = trial number
+#   Summary: the running mean and variance (see SimCore/Moments.py) of a summary
+#            of the results (e.g. w0 and dw/w0), one slot per chunk of trials
+#            and one for the results added by the driver, merged by the driver.
+#            It holds as many slots as chunks, so it takes less memory than Rows
+#            when the chunks have more than two trials.
+# Each row (or slot) has a flag set once it is written, so a chunk whose worker
+# died leaves no partial result, and a chunk run again overwrites its own rows.
+# The driver owns the memory: close() releases it (after copying what is kept).
+##################################################################################
+
+
+from multiprocessing import shared_memory
+import numpy as np
+
+from SimCore import Moments, Pipeline
+
+
+class SharedArray:
+	# ----------------------------------------------------------------------------
+	# Array in shared memory: created (zeros) if name is None, attached otherwise.
+	# spec() gives what another process needs to attach it.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,shape,dtype='float64',name=None):
+		self.shape, self.dtype = tuple(shape), np.dtype(dtype)
+		self.owner = name is None
+		size = max(int(np.prod(self.shape))*self.dtype.itemsize,1)
+		self.shm = shared_memory.SharedMemory(name=name,create=self.owner,size=size)
+		self.array = np.ndarray(self.shape,self.dtype,buffer=self.shm.buf)
+		if self.owner:
+			self.array[...] = 0
+
+	def spec (self):
+		return (self.shm.name,self.shape,self.dtype.str)
+
+	def close (self):
+		self.array = None
+		self.shm.close()
+		if self.owner:
+			self.shm.unlink()
+
+
+class Rows:
+	# ----------------------------------------------------------------------------
+	# Results of the trials 0, ..., n-1, [n x shape], and the flags of the rows
+	# written. Created by the driver (Rows(n,shape)) or attached (attach(spec)).
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,n,shape,dtype='float64',names=(None,None)):
+		self.W = SharedArray((n,)+tuple(shape),dtype,names[0])
+		self.flags = SharedArray((n,),np.uint8,names[1])
+
+	def spec (self):
+		return ('rows',self.W.spec(),self.flags.spec())
+
+	def put (self,index,trials,W):
+		# Results W [len(trials) x shape] of the trials of a chunk
+		trials = np.asarray(trials)
+		self.flags.array[trials] = 0
+		self.W.array[trials] = W
+		self.flags.array[trials] = 1
+
+	def get (self,index,trials):
+		# Results of the trials of a chunk (a view for consecutive trials)
+		trials = np.asarray(trials)
+		if len(trials) and np.all(np.diff(trials) == 1):
+			return self.W.array[trials[0]:trials[-1]+1]
+		return self.W.array[trials]
+
+	def done (self):
+		return np.flatnonzero(self.flags.array)
+
+	def close (self):
+		self.W.close()
+		self.flags.close()
+
+
+class Summary:
+	# ----------------------------------------------------------------------------
+	# Running moments of summary(W) (W: results [n x ...] of the trials of a chunk,
+	# giving [n x shape]), for the trials 0, ..., NTrials-1 in chunks of up to
+	# `chunk` trials that do not cross a multiple of chunk (see Scheduler.chunks):
+	# the chunk starting at trial index has the slot index//chunk, and the last
+	# slot keeps what the driver adds (add).
+	#   summary: (script, name of the function in it), loaded in each process
+	#            with Pipeline.load_script, or None for the results themselves
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,NTrials,chunk,shape,summary=None,names=(None,None,None,None)):
+		self.NTrials, self.chunk, self.summary = int(NTrials), int(chunk), summary
+		slots = -(-self.NTrials//self.chunk) + 1
+		self.n = SharedArray((slots,),np.int64,names[0])
+		self.mean = SharedArray((slots,)+tuple(shape),np.float64,names[1])
+		self.M2 = SharedArray((slots,)+tuple(shape),np.float64,names[2])
+		self.flags = SharedArray((slots,),np.uint8,names[3])
+		self._function = None
+
+	def spec (self):
+		return ('summary',self.summary,self.NTrials,self.chunk)+tuple(a.spec() for a in (self.n,self.mean,self.M2,self.flags))
+
+	def function (self):
+		if self._function is None:
+			if self.summary is None:
+				self._function = lambda W: W
+			else:
+				self._function = getattr(Pipeline.load_script(self.summary[0]),self.summary[1])
+		return self._function
+
+	def _set (self,slot,m):
+		self.flags.array[slot] = 0
+		self.n.array[slot], self.mean.array[slot], self.M2.array[slot] = m.n, m.mean, m.M2
+		self.flags.array[slot] = 1
+
+	def _get (self,slot):
+		return Moments.Moments(self.n.array[slot],self.mean.array[slot],self.M2.array[slot])
+
+	def put (self,index,trials,W):
+		# Results W of the chunk starting at trial index
+		self._set(index//self.chunk,Moments.Moments().add_block(self.function()(W)))
+
+	def get (self,index,trials):
+		# Moments of the chunk starting at trial index
+		return self._get(index//self.chunk)
+
+	def add (self,W):
+		# Adds results computed in this process (e.g. found in a cache) to the last slot
+		slot = len(self.flags.array)-1
+		m = self._get(slot) if self.flags.array[slot] else Moments.Moments()
+		self._set(slot,m.add_block(self.function()(W)))
+
+	def total (self):
+		# Moments of all the slots written
+		m = Moments.Moments()
+		for slot in np.flatnonzero(self.flags.array):
+			m.merge(self._get(slot))
+		return m
+
+	def close (self):
+		for a in (self.n,self.mean,self.M2,self.flags):
+			a.close()
+
+
+def attach (spec):
+	# The Rows or Summary of spec (see their spec()), in another process
+	kind = spec[0]
+	if kind == 'rows':
+		(name,shape,dtype),(flags,_,_) = spec[1],spec[2]
+		return Rows(shape[0],shape[1:],dtype,(name,flags))
+	if kind == 'summary':
+		summary, NTrials, chunk = spec[1:4]
+		names = [s[0] for s in spec[4:]]
+		return Summary(NTrials,chunk,spec[5][1][1:],summary,names)
+	raise ValueError('Unknown shared results "{0}"'.format(kind))
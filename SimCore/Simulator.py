@@ -0,0 +1,246 @@
+##################################################################################
+# Simulator.py -- Stateful simulator advancing the network in place
+#
+# SimStep and SimRun take the seven state variables (u, ref, xbar_pre,
+# xbar_post, gSynE, WEE, Iext) and return new ones every step. A Simulator
+# instead owns them: they are copied once into one contiguous buffer, in the
+# precision of the run (see SimStep.set_precision), and every step overwrites
+# them in place with NumPy out= operations on work arrays allocated with it.
+# The constant gain of the external current (R*preferred) is computed once.
+#   run(nSteps): advances nSteps steps
+#   step():      advances one step
+#   variables:   the state variables, views of the buffer, in the order of SimStep
+#                (e.g. for SimCore/Checkpoint.py), also u, ref, ..., Iext
+# With the NumPy backend and the "euler" integrator a step allocates no array:
+# the external current is copied from the block of the noise source (see
+# NoiseSource.next_into), which allocates only when it generates a new block.
+# The compiled backend already advances the arrays in place (see
+# SimCore/StepKernel.py). The "exponential" integrator, an instrumented run (metrics)
+# and rules without an in-place step go through Network.run, whose results are
+# copied back into the buffer.
+# The numbers are the same as with SimRun.
+##################################################################################
+
+
+import numpy as np
+
+from SimCore import Network, Plasticity
+
+
+def _buffer (shapes,dtype):
+	# One contiguous array holding arrays of the shapes given, and views of them
+	sizes = [int(np.prod(shape)) for shape in shapes]
+	buffer = np.zeros(sum(sizes),dtype=dtype)
+	views, start = [], 0
+	for shape,size in zip(shapes,sizes):
+		views.append(buffer[start:start+size].reshape(shape))
+		start += size
+	return buffer, views
+
+
+class Simulator:
+	# ----------------------------------------------------------------------------
+	#   p:         params module
+	#   backend:   "numpy" or "numba" (see StepKernel.resolve_backend)
+	#   rule:      plasticity rule (see SimCore/Plasticity.py). With
+	#              Plasticity.Frozen, WEE is kept fixed and the weight changes are
+	#              added to rule.Wacc in place
+	#   state:     initial (u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext), with or
+	#              without the leading trial axis (copied)
+	#   source:    NoiseSource giving the external current (see SimCore/NoiseSource.py)
+	#   preferred: [NE+1] gain of the external current, or None
+	#   raster:    SpikeRaster recording the spikes (see SimCore/Spikes.py), or None
+	#   metrics:   Monitor of the runs (see SimCore/Metrics.py), or None
+	# ----------------------------------------------------------------------------
+
+	__slots__ = ('p','backend','rule','source','preferred','raster','metrics','inplace',
+		'buffer','variables','u','ref','xbar_pre','xbar_post','gSynE','WEE','Iext','Wacc',
+		'gain','coefficients','work','flags','spikes','mN','mE','mW','S','S_E','S_post',
+		'tN','kN','tE','kE','tE_W','tW','kW','t1','c','d','Wn')
+
+	def __init__ (self,p,backend,rule,state,source,preferred=None,raster=None,metrics=None):
+		self.p, self.backend, self.rule, self.source = p, backend, rule, source
+		self.preferred, self.raster, self.metrics = preferred, raster, metrics
+		dtype = np.dtype(getattr(p,'precision','float64'))
+
+		# State variables
+		self.buffer, self.variables = _buffer([np.shape(x) for x in state],dtype)
+		for view,x in zip(self.variables,state):
+			view[...] = x
+		self.u,self.ref,self.xbar_pre,self.xbar_post,self.gSynE,self.WEE,self.Iext = self.variables
+		frozen = isinstance(rule,Plasticity.Frozen)
+		self.Wacc = rule.Wacc if frozen else None
+		self.coefficients = rule.coefficients()
+		self.inplace = backend == "numpy" and p.integrator == "euler" and metrics is None \
+			and getattr(rule,'kernel',None) in (0,1)
+
+		# Work arrays, with the shapes of u, gSynE, WEE, xbar_post and u[...,-1].
+		# NumPy allocates a buffer in every operation whose operands are broadcast,
+		# strided or bool arrays multiplied by numbers, so every operation of the
+		# step is done on contiguous arrays of the same shape, and the masks are
+		# also kept as numbers (S, kN, kE, kW).
+		u, E, W, post = self.u.shape, self.gSynE.shape, self.WEE.shape, self.xbar_post.shape
+		self.work, (self.S,self.tN,self.kN,self.S_E,self.tE,self.kE,self.tW,self.kW,
+			self.S_post,self.t1,self.c,self.d,Wn) \
+			= _buffer([u,u,u,E,E,E,W,W,post,post,u[:-1],u[:-1],W if frozen else (0,)],dtype)
+		self.tE_W = self.tE.reshape(W)
+		self.Wn = Wn if frozen else self.WEE # new weights, before the bounds
+		self.flags, (self.spikes,self.mN,self.mE,self.mW) = _buffer([u,u,E,W],bool)
+
+		# Gain of the external current, R*preferred (for every trial)
+		if preferred is None:
+			self.gain = p.R*1.
+		else:
+			self.gain = np.empty(u,dtype=dtype)
+			self.gain[...] = p.R*np.asarray(preferred,dtype=dtype)
+
+	# ---- time loop ----
+
+	def step (self):
+		# Advances one integration step
+		self.run(1)
+
+	def run (self,nSteps):
+		# Advances nSteps integration steps
+		if not self.inplace:
+			out = Network.run(self.p,self.backend,self.rule,*self.variables,nSteps,self.source,
+				self.preferred,self.raster,self.metrics)
+			for view,x in zip(self.variables,out):
+				if x is not view:
+					view[...] = x
+			return
+		for i in range(nSteps):
+			self._euler()
+
+	def _rect (self,x,k,m):
+		# x = x*(x>0.) in place, with the work arrays k (number) and m (bool)
+		np.greater(x,0.,out=m)
+		np.copyto(k,m)
+		np.multiply(x,k,out=x)
+
+	def _euler (self):
+		# Forward Euler step, as in Network._step_euler
+		p, NE = self.p, self.p.NE
+		u, ref, gSynE, tN, kN, mN = self.u, self.ref, self.gSynE, self.tN, self.kN, self.mN
+		S, c, d = self.S, self.c, self.d
+		np.greater(u,p.Vth,out=self.spikes) # Verify all the neurons that fired an action potential
+		np.copyto(S,self.spikes)
+		np.copyto(self.S_E,S[...,:NE])
+		np.copyto(self.S_post,S[...,NE:])
+		if self.raster is not None:
+			self.raster.add(self.spikes)
+		np.multiply(S,p.Tref,out=tN)
+		np.add(ref,tN,out=ref) # update the refractory variable
+
+		# Synaptic input, with the conductances and potential at t
+		np.einsum('...ij,...j->...',self.WEE,gSynE,out=c)
+		np.copyto(d,u[...,-1])
+		np.subtract(d,p.EsynE,out=d)
+		np.negative(d,out=d)
+		np.multiply(d,c,out=c)
+
+		# Update the synaptic conductances
+		np.multiply(self.S_E,p.gBarEx,out=self.tE)
+		np.add(gSynE,self.tE,out=gSynE)
+		np.multiply(gSynE,p.step_tauSynEx,out=self.tE)
+		np.subtract(gSynE,self.tE,out=gSynE)
+
+		self.source.next_into(self.Iext)
+
+		# Update the membrane potential
+		np.subtract(p.Vres,u,out=tN)
+		np.multiply(tN,S,out=tN)
+		np.add(u,tN,out=u) # reset the voltage for those who spiked
+		np.multiply(self.gain,self.Iext,out=tN)
+		np.subtract(tN,u,out=tN)
+		np.multiply(tN,p.step_tau_m,out=tN)
+		np.add(u,tN,out=u) # presynaptic neurons receive only external input
+		np.multiply(c,p.step_tau_m,out=c)
+		np.copyto(d,u[...,-1])
+		np.add(d,c,out=d)
+		np.copyto(u[...,-1],d) # the postsynaptic neuron also receives the synaptic input
+		np.greater(ref,0.001,out=mN)
+		np.copyto(u,p.Vres,where=mN)
+		np.subtract(p.Vspike,u,out=tN)
+		np.add(tN,p.Vth,out=tN)
+		np.greater(u,p.Vth,out=mN)
+		np.copyto(kN,mN)
+		np.multiply(tN,kN,out=tN)
+		np.add(u,tN,out=u) # add a constant to "see" the spikes
+
+		np.subtract(ref,p.dt,out=ref)
+		self._rect(ref,kN,mN)
+
+		# Update the synaptic traces and weights
+		if self.rule.kernel == 0:
+			self._stdp()
+		else:
+			self._up()
+		Wn, tW = self.Wn, self.tW
+		np.subtract(Wn,p.w_max,out=tW)
+		self._rect(tW,self.kW,self.mW)
+		self._rect(Wn,self.kW,self.mW)
+		np.subtract(Wn,tW,out=Wn) # apply bounds
+		if self.Wacc is not None:
+			np.subtract(Wn,self.WEE,out=Wn)
+			np.add(self.Wacc,Wn,out=self.Wacc)
+
+	# ---- plasticity rules (see SimCore/Plasticity.py) ----
+	# The terms [1] of every trial are spread over its synapses in tE before they
+	# are added to the weights
+
+	def _stdp (self):
+		p = self.p
+		a_pre,a_post,a_plus,a_minus = self.coefficients
+		Wn, tE, tE_W, t1 = self.Wn, self.tE, self.tE_W, self.t1
+		xbar_pre, xbar_post = self.xbar_pre, self.xbar_post
+		if Wn is not self.WEE:
+			np.copyto(Wn,self.WEE)
+		if a_pre:
+			np.multiply(a_pre,self.S_E,out=tE)
+			np.add(Wn,tE_W,out=Wn)
+		if a_post:
+			np.multiply(a_post,self.S_post,out=t1)
+			np.copyto(tE,t1)
+			np.add(Wn,tE_W,out=Wn)
+		if a_plus:
+			np.multiply(a_plus,self.S_post,out=t1)
+			np.copyto(tE,t1)
+			np.multiply(tE,xbar_pre,out=tE)
+			np.add(Wn,tE_W,out=Wn)
+		if a_minus:
+			np.multiply(a_minus,xbar_post,out=t1)
+			np.copyto(tE,t1)
+			np.multiply(tE,self.S_E,out=tE)
+			np.add(Wn,tE_W,out=Wn)
+
+		np.add(xbar_pre,self.S_E,out=xbar_pre)
+		np.multiply(xbar_pre,p.step_tp_plast,out=tE)
+		np.subtract(xbar_pre,tE,out=xbar_pre)
+		np.add(xbar_post,self.S_post,out=xbar_post)
+		np.multiply(xbar_post,p.step_tm_plast,out=t1)
+		np.subtract(xbar_post,t1,out=xbar_post)
+
+	def _up (self):
+		p = self.p
+		a_pre = self.coefficients[0]
+		Wn, tE, tE_W, t1 = self.Wn, self.tE, self.tE_W, self.t1
+		xbar_pre, kE, mE = self.xbar_pre, self.kE, self.mE
+		if a_pre:
+			np.multiply(a_pre,self.S_E,out=tE)
+			np.add(self.WEE,tE_W,out=Wn)
+			np.multiply(-a_pre,self.S_post,out=t1)
+			np.copyto(tE,t1)
+			np.greater(xbar_pre,0.,out=mE)
+			np.copyto(kE,mE)
+			np.multiply(tE,kE,out=tE)
+			np.add(Wn,tE_W,out=Wn)
+		elif Wn is not self.WEE:
+			np.copyto(Wn,self.WEE)
+
+		np.subtract(Plasticity.UpState.window,xbar_pre,out=tE)
+		np.multiply(tE,self.S_E,out=tE)
+		np.add(xbar_pre,tE,out=xbar_pre)
+		np.subtract(xbar_pre,p.dt,out=xbar_pre)
+		self._rect(xbar_pre,kE,mE)
+		np.copyto(xbar_pre,0.,where=self.spikes[...,p.NE:]) # a postsynaptic spike closes the windows
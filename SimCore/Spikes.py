@@ -0,0 +1,153 @@
+##################################################################################
+# Spikes.py -- Compact record of the spikes of a run
+#
+# SpikeRaster keeps the spikes as int32 (step, neuron) pairs, with the trial of
+# each spike in batched runs, appended in chunks as the run goes (one chunk per
+# block of steps given by the simulator). A spike at step k is a neuron above
+# threshold at the start of step k, i.e. at time k*dt.
+#   csr(trial):     per-neuron layout (indptr [N+1], sorted steps)
+#   rates():        firing rate of each neuron [Hz]
+#   isi(), cv():    interspike intervals [ms] and their coefficient of variation
+#   pre_post(...):  histogram of the lags between the spikes of presynaptic
+#                   neurons and those of the postsynaptic neuron
+# A run records its spikes when a SpikeRaster is given to SimRun (raster=...).
+##################################################################################
+
+
+import numpy as np
+
+
+class SpikeRaster:
+	# ----------------------------------------------------------------------------
+	#   N:       number of neurons (NE+1, the postsynaptic neuron last)
+	#   NTrials: number of trials of a batched run (None for unbatched runs)
+	#   dt:      [ms] time step
+	#   buffer:  steps given one at a time (add) kept before they are compressed
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,N,NTrials=None,dt=1.,buffer=1000):
+		self.N, self.NTrials, self.dt = N, NTrials, float(dt)
+		self.nsteps = 0
+		self._chunks = []
+		self._buffer = np.zeros((buffer,NTrials or 1,N),dtype=bool)
+		self._nbuf = 0
+
+	# ---- recording ----
+
+	def add (self,spikes):
+		# Spikes [(NTrials x) N] of the next step
+		self._buffer[self._nbuf] = spikes
+		self._nbuf += 1
+		if self._nbuf == len(self._buffer):
+			self._flush()
+
+	def add_block (self,spikes):
+		# Spikes [n x (NTrials x) N] of the next n steps
+		self._flush()
+		self._compress(np.asarray(spikes).reshape((len(spikes),-1,self.N)))
+
+	def _flush (self):
+		if self._nbuf:
+			n, self._nbuf = self._nbuf, 0
+			self._compress(self._buffer[:n])
+
+	def _compress (self,block):
+		step,trial,neuron = np.nonzero(block)
+		self._chunks.append(((step+self.nsteps).astype(np.int32),trial.astype(np.int32),neuron.astype(np.int32)))
+		self.nsteps += len(block)
+
+	def spikes (self):
+		# All the spikes, as int32 arrays step, trial, neuron (in the order of time)
+		self._flush()
+		if not self._chunks:
+			return [np.zeros(0,np.int32)]*3
+		if len(self._chunks) > 1:
+			self._chunks = [tuple(np.concatenate(c) for c in zip(*self._chunks))]
+		return self._chunks[0]
+
+	def save (self,path):
+		step,trial,neuron = self.spikes()
+		np.savez(path,step=step,trial=trial,neuron=neuron,N=self.N,NTrials=self.NTrials or 0,
+			dt=self.dt,nsteps=self.nsteps)
+
+	def state (self):
+		# The spikes recorded so far (see SimCore/Checkpoint.py)
+		return {'spikes': tuple(np.copy(x) for x in self.spikes()), 'nsteps': self.nsteps}
+
+	def restore (self,state):
+		self._chunks = [state['spikes']]
+		self._nbuf = 0
+		self.nsteps = state['nsteps']
+
+	@classmethod
+	def load (cls,path):
+		with np.load(path) as data:
+			raster = cls(int(data['N']),int(data['NTrials']) or None,float(data['dt']),buffer=1)
+			raster._chunks = [(data['step'],data['trial'],data['neuron'])]
+			raster.nsteps = int(data['nsteps'])
+		return raster
+
+	# ---- readers ----
+
+	def csr (self,trial=0):
+		# indptr [N+1] and steps: the spikes of neuron i are steps[indptr[i]:indptr[i+1]]
+		step,tr,neuron = self.spikes()
+		sel = (tr == trial)
+		step, neuron = step[sel], neuron[sel]
+		order = np.argsort(neuron,kind='stable') # steps stay sorted within each neuron
+		indptr = np.zeros(self.N+1,dtype=np.int64)
+		indptr[1:] = np.cumsum(np.bincount(neuron,minlength=self.N))
+		return indptr, step[order]
+
+	def counts (self):
+		# [(NTrials x) N] number of spikes of each neuron
+		_,tr,neuron = self.spikes()
+		c = np.bincount(tr.astype(np.int64)*self.N+neuron,minlength=(self.NTrials or 1)*self.N)
+		return c.reshape(self.NTrials,self.N) if self.NTrials else c
+
+	def rates (self):
+		# [(NTrials x) N] firing rate of each neuron [Hz]
+		return self.counts()/(self.nsteps*self.dt/1000.)
+
+	def isi (self,neuron,trial=0):
+		# Interspike intervals of one neuron [ms]
+		indptr,steps = self.csr(trial)
+		return np.diff(steps[indptr[neuron]:indptr[neuron+1]])*self.dt
+
+	def cv (self,trial=0):
+		# [N] coefficient of variation of the interspike intervals (nan with less than 2)
+		indptr,steps = self.csr(trial)
+		owner = np.repeat(np.arange(self.N),np.diff(indptr))
+		same = owner[1:] == owner[:-1] # consecutive spikes of the same neuron
+		owner, d = owner[1:][same], np.diff(steps)[same]*self.dt
+		n = np.bincount(owner,minlength=self.N)
+		s1 = np.bincount(owner,d,minlength=self.N)
+		s2 = np.bincount(owner,d**2,minlength=self.N)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			mean = s1/n
+			std = np.sqrt(np.maximum(s2/n - mean**2,0.))
+			return np.where(n >= 2,std/mean,np.nan)
+
+	def pre_post (self,window=50.,pre=None,post=None,trial=0):
+		# ----------------------------------------------------------------------------
+		# Histogram of the lags t_post - t_pre [ms] within +-window between each of
+		# the neurons in pre (default: all but the last) and the neuron post
+		# (default: the last). Returns the lags [2W+1] and the counts [len(pre) x 2W+1].
+		# ----------------------------------------------------------------------------
+		pre = np.arange(self.N-1) if pre is None else np.atleast_1d(pre)
+		post = self.N-1 if post is None else post
+		W = int(round(window/self.dt))
+		indptr,steps = self.csr(trial)
+		tpost = steps[indptr[post]:indptr[post+1]].astype(np.int64)
+		hist = np.zeros((len(pre),2*W+1),dtype=np.int64)
+		for i,j in enumerate(pre):
+			tpre = steps[indptr[j]:indptr[j+1]].astype(np.int64)
+			lo = np.searchsorted(tpre,tpost-W,'left')
+			hi = np.searchsorted(tpre,tpost+W,'right')
+			n = hi - lo
+			if n.sum() == 0:
+				continue
+			first = np.repeat(lo - (np.cumsum(n)-n),n)
+			lags = np.repeat(tpost,n) - tpre[first+np.arange(n.sum())]
+			hist[i] = np.bincount(lags+W,minlength=2*W+1)
+		return np.arange(-W,W+1)*self.dt, hist
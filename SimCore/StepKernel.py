@@ -0,0 +1,395 @@
+##################################################################################
+# StepKernel.py -- Fused, compiled version of the time loop in SimStep.py
+#
+# The whole integration step (conductances, membrane, refractory period, input
+# current, synaptic traces, weights and bounds) is written as plain loops over
+# trials and neurons and compiled with Numba. One call advances nSteps steps and
+# updates all the state arrays in place, so no temporary arrays are created. The
+# external current is read from the blocks generated by NoiseSource.py.
+# _run follows the forward Euler steps of SimStep.py and _run_exponential the
+# exponential integrator of Integrator.py.
+#
+# Numba is optional: if it cannot be imported, available() returns False and
+# SimStep.py keeps using the NumPy implementation, with a RuntimeWarning (which
+# the callers can silence or turn into an error with the warnings module).
+##################################################################################
+
+
+import warnings
+import numpy as np
+
+from SimCore import Plasticity
+
+try:
+	from numba import njit
+except ImportError:
+	njit = None
+
+
+# ================================================================================
+# Plasticity rules understood by the kernel --------------------------------------
+
+RULE_STDP = Plasticity.STDP.kernel		# exponential pre and post traces (wake)
+RULE_UP = Plasticity.UpState.kernel		# Up-state-mediated: 10 ms linear pre trace reset by post spikes (sleep)
+
+
+def available():
+	return njit is not None
+
+def resolve_backend (name):
+	# Returns the backend that will actually be used for the requested one
+	if name not in ("numpy","numba"):
+		raise ValueError('Unknown backend "{0}", use "numpy" or "numba"'.format(name))
+	if name == "numba" and not available():
+		warnings.warn('Numba is not installed, falling back to the NumPy backend',RuntimeWarning,stacklevel=2)
+		return "numpy"
+	return name
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def _run (u,ref,xbar_pre,xbar_post,gSynE,WEE,Wacc,Iext,Inoise,preferred,nSteps,
+		Vth,Vres,Vspike,Tref,R,EsynE,gBarEx,dt,step_tauSynEx,step_tau_m,step_tp_plast,step_tm_plast,
+		a_pre,a_post,a_plus,a_minus,w_max,tiny,rule,frozen,raster,record,counts,count):
+	# ----------------------------------------------------------------------------
+	# All the arrays carry a leading trial axis:
+	#   u, ref, Iext: [NTrials x NE+1]; xbar_pre, gSynE: [NTrials x NE]
+	#   xbar_post: [NTrials x 1]; WEE, Wacc: [NTrials x 1 x NE]; preferred: [NE+1]
+	#   Inoise: [nSteps x NTrials x NE+1] external current of each step
+	# If frozen, WEE is kept constant and the weight changes are summed in Wacc.
+	# If record, the spikes of each step are written in raster [nSteps x NTrials x NE+1].
+	# If count, counts [NTrials x 4] gets the presynaptic and postsynaptic spikes and
+	# the weight updates clipped at 0 and at w_max (see SimCore/Metrics.py).
+	# Decaying conductances and traces below tiny are set to 0 (see run).
+	# ----------------------------------------------------------------------------
+	NTrials = u.shape[0]
+	NE = gSynE.shape[1]
+	decay_g = 1. - step_tauSynEx
+	decay_p = 1. - step_tp_plast
+	decay_m = 1. - step_tm_plast
+
+	for step in range(nSteps):
+		for b in range(NTrials):
+
+			# Postsynaptic neuron (uses the state at time t) ----------------------
+			upost = u[b,NE]
+			spost = upost > Vth
+			if record:
+				raster[step,b,NE] = spost
+			if spost and count:
+				counts[b,1] += 1
+			xpost = xbar_post[b,0]
+
+			drive = 0.
+			for j in range(NE):
+				drive += WEE[b,0,j]*gSynE[b,j]
+			Isyn = -(upost - EsynE)*drive
+
+			# Presynaptic neurons, conductances, traces and weights ---------------
+			nspk, nlow, nhigh = 0, 0, 0
+			for j in range(NE):
+				spk = u[b,j] > Vth
+				if record:
+					raster[step,b,j] = spk
+				nspk += spk
+				g = gSynE[b,j]
+				if spk:
+					g += gBarEx
+				g = g*decay_g
+				gSynE[b,j] = g if g >= tiny else 0.
+
+				Iext[b,j] = Inoise[step,b,j]
+
+				r = ref[b,j]
+				v = u[b,j]
+				if spk:
+					r += Tref
+					v = Vres
+				v = v + (-v + R*preferred[j]*Iext[b,j])*step_tau_m
+				if r > 0.001:
+					v = Vres
+				if v > Vth:
+					v = Vspike + Vth
+				u[b,j] = v
+				r -= dt
+				ref[b,j] = r if r > 0. else 0.
+
+				x = xbar_pre[b,j]
+				if rule == RULE_STDP:
+					dW = 0.
+					if spk:
+						dW += a_pre + a_minus*xpost
+					if spost:
+						dW += a_post + a_plus*x
+					xn = (x + spk)*decay_p
+					xbar_pre[b,j] = xn if xn >= tiny else 0.
+				else:
+					dW = 0.
+					xn = x
+					if spk:
+						dW += a_pre
+						xn = 10.
+					if spost and x > 0.:
+						dW -= a_pre
+					xn -= dt
+					if spost or xn < 0.:
+						xn = 0.
+					xbar_pre[b,j] = xn
+
+				w = WEE[b,0,j] + dW
+				if w < 0.:
+					w = 0.
+					nlow += 1
+				elif w > w_max:
+					w = w_max
+					nhigh += 1
+				if frozen:
+					Wacc[b,0,j] += w - WEE[b,0,j]
+				else:
+					WEE[b,0,j] = w
+			if count:
+				counts[b,0] += nspk
+				counts[b,2] += nlow
+				counts[b,3] += nhigh
+
+			# Postsynaptic neuron -------------------------------------------------
+			Iext[b,NE] = Inoise[step,b,NE]
+
+			r = ref[b,NE]
+			v = upost
+			if spost:
+				r += Tref
+				v = Vres
+			v = v + (-v + R*preferred[NE]*Iext[b,NE])*step_tau_m + Isyn*step_tau_m
+			if r > 0.001:
+				v = Vres
+			if v > Vth:
+				v = Vspike + Vth
+			u[b,NE] = v
+			r -= dt
+			ref[b,NE] = r if r > 0. else 0.
+
+			if rule == RULE_STDP:
+				xbar_post[b,0] = (xpost + spost)*decay_m
+
+
+def _run_exponential (u,ref,xbar_pre,xbar_post,gSynE,WEE,Wacc,Iext,Inoise,preferred,nSteps,
+		Vth,Vres,Vspike,Tref,R,EsynE,gBarEx,dt,tauSynEx,tau_m,tp_plast,tm_plast,delay_syn,window_up,
+		step_tauSynEx,step_tp_plast,step_tm_plast,avg_tauSynEx,
+		a_pre,a_post,a_plus,a_minus,w_max,tiny,rule,frozen,raster,record,counts,count):
+	# ----------------------------------------------------------------------------
+	# Same as _run for the "exponential" integrator (see SimCore/Integrator.py):
+	# exponential decays and spikes placed at the time of the threshold crossing,
+	# which is stored as a negative refractory variable until the next step.
+	#   tauSynEx, tau_m, tp_plast, tm_plast: effective time constants (tau_eff)
+	# ----------------------------------------------------------------------------
+	NTrials = u.shape[0]
+	NE = gSynE.shape[1]
+	decay_g = 1. - step_tauSynEx
+	decay_p = 1. - step_tp_plast
+	decay_m = 1. - step_tm_plast
+
+	for step in range(nSteps):
+		for b in range(NTrials):
+
+			# Postsynaptic spike and kicks of the presynaptic conductances --------
+			upost = u[b,NE]
+			spost = upost > Vth
+			if record:
+				raster[step,b,NE] = spost
+			if spost and count:
+				counts[b,1] += 1
+			lpost = 0.
+			if spost and ref[b,NE] < 0.:
+				lpost = -ref[b,NE]
+			xpost = xbar_post[b,0]
+
+			G = 0.
+			for j in range(NE):
+				g = gSynE[b,j]
+				gMean = g*avg_tauSynEx
+				g = g*decay_g
+				if u[b,j] > Vth:
+					lag = -ref[b,j] if ref[b,j] < 0. else 0.
+					new = gBarEx*np.exp(-(lag - delay_syn + dt)/tauSynEx) # starts delay_syn after the spike
+					gMean += (gBarEx - new)*tauSynEx/dt
+					g += new
+				G += WEE[b,0,j]*gMean
+				gSynE[b,j] = g if g >= tiny else 0.
+
+			# Presynaptic neurons, traces and weights -----------------------------
+			nspk, nlow, nhigh = 0, 0, 0
+			for j in range(NE):
+				spk = u[b,j] > Vth
+				if record:
+					raster[step,b,j] = spk
+				nspk += spk
+				lag = 0.
+				if spk and ref[b,j] < 0.:
+					lag = -ref[b,j]
+
+				Iext[b,j] = Inoise[step,b,j]
+
+				r = ref[b,j] if ref[b,j] > 0. else 0.
+				v = u[b,j]
+				if spk:
+					r += Tref - lag
+				if spk or r > 0.001:
+					v = Vres
+				Vinf = R*preferred[j]*Iext[b,j]
+				h = dt - r if dt > r else 0.
+				v0 = v
+				v = Vinf + (v0 - Vinf)*np.exp(-h/tau_m)
+				r -= dt
+				ref[b,j] = r if r > 0. else 0.
+				if v > Vth:
+					ref[b,j] = (dt - h) + tau_m*np.log((Vinf - v0)/(Vinf - Vth)) - dt
+					v = Vspike + Vth
+				u[b,j] = v
+
+				x = xbar_pre[b,j]
+				pre_first = spk and spost and lag > lpost
+				post_first = spk and spost and lpost > lag
+				dW = 0.
+				if rule == RULE_STDP:
+					if spk:
+						y = xpost*np.exp(lag/tm_plast)
+						if post_first:
+							y += np.exp(-(lpost-lag)/tm_plast)
+						dW += a_pre + a_minus*y
+						x_new = (x + np.exp(-lag/tp_plast))*decay_p
+					else:
+						x_new = x*decay_p
+					if spost:
+						y = x*np.exp(lpost/tp_plast)
+						if pre_first:
+							y += np.exp(-(lag-lpost)/tp_plast)
+						dW += a_post + a_plus*y
+					xbar_pre[b,j] = x_new if x_new >= tiny else 0.
+				else:
+					if spk:
+						dW += a_pre
+					if spost and (x - dt + lpost > 0. or pre_first): # x: time left in the window + dt
+						dW -= a_pre
+					xn = window_up - lag + dt if spk else x
+					if spost and not post_first:
+						xn = 0.
+					xn -= dt
+					xbar_pre[b,j] = xn if xn > 0. else 0.
+
+				w = WEE[b,0,j] + dW
+				if w < 0.:
+					w = 0.
+					nlow += 1
+				elif w > w_max:
+					w = w_max
+					nhigh += 1
+				if frozen:
+					Wacc[b,0,j] += w - WEE[b,0,j]
+				else:
+					WEE[b,0,j] = w
+			if count:
+				counts[b,0] += nspk
+				counts[b,2] += nlow
+				counts[b,3] += nhigh
+
+			# Postsynaptic neuron -------------------------------------------------
+			Iext[b,NE] = Inoise[step,b,NE]
+
+			r = ref[b,NE] if ref[b,NE] > 0. else 0.
+			v = upost
+			if spost:
+				r += Tref - lpost
+			if spost or r > 0.001:
+				v = Vres
+			Vinf = (R*preferred[NE]*Iext[b,NE] + EsynE*G)/(1. + G)
+			tau_e = tau_m/(1. + G)
+			h = dt - r if dt > r else 0.
+			v0 = v
+			v = Vinf + (v0 - Vinf)*np.exp(-h/tau_e)
+			r -= dt
+			ref[b,NE] = r if r > 0. else 0.
+			if v > Vth:
+				ref[b,NE] = (dt - h) + tau_e*np.log((Vinf - v0)/(Vinf - Vth)) - dt
+				v = Vspike + Vth
+			u[b,NE] = v
+
+			if rule == RULE_STDP:
+				xbar_post[b,0] = (xpost + (np.exp(-lpost/tm_plast) if spost else 0.))*decay_m
+
+
+_run_compiled = njit(cache=True)(_run) if available() else None
+_run_exponential_compiled = njit(cache=True)(_run_exponential) if available() else None
+
+
+_no_raster = np.zeros((1,1,1),dtype=np.bool_)
+
+COUNTS = ('spikes_pre','spikes_post','clipped_low','clipped_high')	# columns of counts in _run
+_no_counts = np.zeros((1,len(COUNTS)),dtype=np.int64)
+
+def run (p,rule,u,ref,xbar_pre,xbar_post,gSynE,WEE,Iext,nSteps,source,preferred=None,raster=None,metrics=None):
+	# ----------------------------------------------------------------------------
+	# Advances nSteps integration steps in place.
+	#   p: params module; preferred: [NE+1] gain of the external current
+	#   rule: plasticity rule (see SimCore/Plasticity.py). With Plasticity.Frozen,
+	#         WEE is kept fixed and the weight changes are added to rule.Wacc
+	#   source: NoiseSource giving the external current (see SimCore/NoiseSource.py)
+	#   raster: SpikeRaster recording the spikes (see SimCore/Spikes.py), or None
+	#   metrics: Monitor timing the kernel, the noise and the recording, and
+	#         counting the spikes and clipped weights (see SimCore/Metrics.py), or None
+	# The arrays may be given with or without the leading trial axis. The
+	# integration method is taken from p.integrator (see SimCore/Integrator.py).
+	# ----------------------------------------------------------------------------
+	Iext_in = Iext
+	frozen = isinstance(rule,Plasticity.Frozen)
+	Wacc = rule.Wacc if frozen else WEE
+	batched = (u.ndim == 2)
+	if not batched:
+		u,ref,Iext = u[None],ref[None],Iext[None]
+		xbar_pre,xbar_post,gSynE,WEE = xbar_pre[None],xbar_post[None],gSynE[None],WEE[None]
+		Wacc = Wacc[None]
+	if preferred is None:
+		preferred = np.ones(p.NE+1)
+	a_pre,a_post,a_plus,a_minus = rule.coefficients()
+	# In float32, conductances and traces that decay below the smallest normal
+	# number are set to 0: the subnormal numbers they would reach are several
+	# times slower to compute with. float64 runs are left unchanged.
+	tiny = float(np.finfo(np.float32).tiny) if u.dtype == np.float32 else 0.
+	count = metrics is not None
+	counts = np.zeros((u.shape[0],len(COUNTS)),dtype=np.int64) if count else _no_counts
+
+	# The external current is taken from the noise source one block at a time
+	done = 0
+	while done < nSteps:
+		if count:
+			metrics.mark()
+		Inoise = source.take(Iext_in,nSteps-done)
+		n = len(Inoise)
+		Inoise = Inoise.reshape((n,)+Iext.shape)
+		spikes = _no_raster if raster is None else np.zeros((n,)+Iext.shape,dtype=np.bool_)
+		if count:
+			metrics.lap('noise')
+		if getattr(p,'integrator','euler') == "exponential":
+			_run_exponential_compiled(u,ref,xbar_pre,xbar_post,gSynE,WEE,Wacc,Iext,Inoise,preferred,n,
+				float(p.Vth),float(p.Vres),float(p.Vspike),float(p.Tref_eff),float(p.R),float(p.EsynE),
+				float(p.gBarEx_eff),float(p.dt),float(p.tauSynEx_eff),float(p.tau_m_eff),
+				float(p.tp_plast_eff),float(p.tm_plast_eff),float(p.delay_syn),float(p.window_up),
+				float(p.step_tauSynEx),float(p.step_tp_plast),float(p.step_tm_plast),float(p.avg_tauSynEx),
+				a_pre,a_post,a_plus,a_minus,float(p.w_max),tiny,rule.kernel,frozen,spikes,raster is not None,counts,count)
+		else:
+			_run_compiled(u,ref,xbar_pre,xbar_post,gSynE,WEE,Wacc,Iext,Inoise,preferred,n,
+				float(p.Vth),float(p.Vres),float(p.Vspike),float(p.Tref),float(p.R),float(p.EsynE),
+				float(p.gBarEx),float(p.dt),float(p.step_tauSynEx),float(p.step_tau_m),
+				float(p.step_tp_plast),float(p.step_tm_plast),
+				a_pre,a_post,a_plus,a_minus,float(p.w_max),tiny,rule.kernel,frozen,spikes,raster is not None,counts,count)
+		if count:
+			metrics.lap('kernel')
+		if raster is not None:
+			raster.add_block(spikes)
+			if count:
+				metrics.lap('recording')
+		done += n
+	if count:
+		for name,n in zip(COUNTS,counts.sum(0)):
+			metrics.count(name,n)
@@ -0,0 +1,36 @@
+##################################################################################
+# Streams.py -- Reproducible random streams for each trial
+#
+# Every (experiment, trial, phase) has its own counter-based generator (Philox),
+# whose key is derived from the base seed p.seed and the three labels:
+#   experiment: [str] e.g. "fig4E" or "fig4CD" (p.experiment)
+#   trial: [int] number of the trial
+#   phase: [str] e.g. "init" (initial weights), "wake", "sleep" or "up" (noise)
+# The numbers drawn for a trial do not depend on the other trials simulated in
+# the same batch or process, nor on the number of processes, so a trial or any
+# subset of trials can be re-run on its own and gives the same results.
+##################################################################################
+
+
+import zlib
+import numpy as np
+
+
+def _label (x):
+	# Labels given as strings are mapped to integers with a fixed hash
+	return zlib.crc32(x.encode()) if isinstance(x,str) else int(x)
+
+def key (seed,experiment,trial,phase):
+	# [2] 128-bit Philox key of one stream
+	entropy = [int(seed),_label(experiment),int(trial),_label(phase)]
+	return np.random.SeedSequence(entropy).generate_state(2,np.uint64)
+
+def generator (p,trial,phase):
+	# Generator of one trial, for the experiment and base seed in the params module p
+	return np.random.Generator(np.random.Philox(key=key(p.seed,p.experiment,trial,phase)))
+
+def generators (p,trials,phase):
+	# One generator for a single trial number, or a list with one per trial
+	if np.ndim(trials) == 0:
+		return generator(p,trials,phase)
+	return [generator(p,trial,phase) for trial in trials]
@@ -0,0 +1,200 @@
+##################################################################################
+# Sweep.py -- Simulations of a figure over a set of parameter values
+#
+# A sweep runs NTrials trials for each combination of parameter values, e.g.
+#   {'a_pre["up"]': [-0.001,-0.002], 'gBarEx': [0.5,1.], 'std_pre': [1.8,2.]}
+# as a grid (every combination) or as lists of the same length (zipped). A name
+# is an attribute of the params module, or an entry of a dict of it (a_pre["up"]).
+#
+# The trials of a combination are simulated as one batch (vectorized over the
+# trials, see simulate in the scripts of the figures), and the batches are spread
+# over a pool of processes. Each process loads the script once and, for every
+# batch, resets the params module, applies the values of the combination and
+# reconfigures the integrator (nSteps and step factors follow t_max, dt, taus).
+# The trials use the same random streams in all the combinations.
+#
+# The results go to a Table: the trials of all the combinations in one
+# TrialStore (row combination*NTrials + trial, see SimCore/TrialStore.py) and an
+# index of the combinations (index.json). A batch whose trials are all in the
+# table is not run again, so an interrupted sweep continues where it stopped.
+##################################################################################
+
+
+import os, re, ast, copy, json, itertools
+import multiprocessing as mp
+import numpy as np
+
+from SimCore import Pipeline, TrialStore
+
+
+# ================================================================================
+# Combinations -------------------------------------------------------------------
+
+def parse_name (name):
+	# 'gBarEx' -> ('gBarEx',None); 'a_pre["up"]' -> ('a_pre','up')
+	m = re.match(r'^\s*(\w+)\s*(?:\[\s*(.+?)\s*\])?\s*$',name)
+	if m is None:
+		raise ValueError('Invalid parameter name "{0}"'.format(name))
+	key = m.group(2)
+	if key is not None:
+		try:
+			key = ast.literal_eval(key)
+		except (ValueError,SyntaxError):
+			pass # a_pre[up]
+	return m.group(1), key
+
+def grid (values):
+	# All the combinations of the values given for each name, [{name: value}]
+	names = list(values)
+	return [dict(zip(names,combo)) for combo in itertools.product(*[values[n] for n in names])]
+
+def zipped (values):
+	# The i-th value of every name, for i = 0, 1, ..., [{name: value}]
+	names = list(values)
+	if len(set(len(values[n]) for n in names)) > 1:
+		raise ValueError('All the parameters need the same number of values')
+	return [dict(zip(names,combo)) for combo in zip(*[values[n] for n in names])]
+
+def check (p,combination):
+	# Raises an error if a name of the combination is not in the params module p
+	for name in combination:
+		attr,key = parse_name(name)
+		if not hasattr(p,attr) or (key is not None and not isinstance(getattr(p,attr),dict)):
+			raise ValueError('Unknown parameter "{0}"'.format(name))
+
+def apply (p,combination):
+	# Sets the values of one combination in the params module p
+	check(p,combination)
+	for name,value in combination.items():
+		attr,key = parse_name(name)
+		if key is None:
+			setattr(p,attr,value)
+		else:
+			getattr(p,attr)[key] = value
+
+
+# ================================================================================
+# Table of results ---------------------------------------------------------------
+
+class Table:
+	# ----------------------------------------------------------------------------
+	# Results of a sweep in folder:
+	#   index.json:    combinations, NTrials and the metadata of the sweep
+	#   results.store: result of every trial (see SimCore/TrialStore.py), created
+	#                  with the first results written
+	# An existing table is opened if it is of the same sweep, and raises an
+	# error otherwise.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,folder,combinations=None,NTrials=None,meta=None):
+		self.folder = folder
+		path = os.path.join(folder,'index.json')
+		index = {'combinations': combinations, 'NTrials': NTrials, 'meta': meta or {}}
+		if os.path.exists(path):
+			with open(path) as f:
+				found = json.load(f)
+			if combinations is not None and json.loads(json.dumps(index)) != found:
+				raise ValueError('{0} holds another sweep, remove it or use another folder'.format(folder))
+			index = found
+		elif combinations is None:
+			raise FileNotFoundError('No sweep in {0}'.format(folder))
+		else:
+			os.makedirs(folder,exist_ok=True)
+			with open(path+'.tmp','w') as f:
+				json.dump(index,f,indent=1)
+			os.replace(path+'.tmp',path)
+		self.combinations, self.NTrials, self.meta = index['combinations'], index['NTrials'], index['meta']
+		self.size = len(self.combinations)*self.NTrials
+		self.store = None
+		if os.path.exists(self._store_path()):
+			self.store = TrialStore.TrialStore(self._store_path())
+
+	def _store_path (self):
+		return os.path.join(self.folder,'results.store')
+
+	def done (self):
+		# [NCombinations x NTrials] True for the trials in the table (read only: the
+		# trials beyond the end of the store are not done)
+		done = np.zeros(self.size,dtype=bool)
+		if self.store is not None:
+			written = self.store.records()['done'][:self.size]
+			done[:len(written)] = written
+		return done.reshape(-1,self.NTrials)
+
+	def write (self,c,trials,W):
+		# Results W [len(trials) x shape] of some trials of combination c
+		if self.store is None:
+			self.store = TrialStore.TrialStore(self._store_path(),W.shape[1:],W.dtype,chunk=max(self.NTrials,1))
+		self.store.reserve(self.size)
+		rec = self.store.records('r+')
+		rows = c*self.NTrials + np.asarray(trials)
+		rec['W'][rows] = W
+		rec.flush()
+		rec['done'][rows] = 1
+		rec.flush()
+
+	def results (self):
+		# [NCombinations x NTrials x shape] memory-mapped results
+		return self.store.W[:self.size].reshape((len(self.combinations),self.NTrials)+self.store.shape)
+
+
+# ================================================================================
+# Workers ------------------------------------------------------------------------
+
+Worker = {}
+
+def _init (script,backend):
+	# Loads the script of the figure in a worker, and keeps the initial parameters
+	module = Pipeline.load_script(script)
+	if backend is not None:
+		module.SS.set_backend(backend)
+	Worker['script'] = module
+	Worker['params'] = copy.deepcopy(Pipeline.params_values(module.p))
+
+def _run_batch (task):
+	c,combination,trials = task
+	script = Worker['script']
+	p = script.p
+	for name,value in Worker['params'].items():
+		setattr(p,name,copy.deepcopy(value))
+	apply(p,combination)
+	script.SS.set_integrator(p.integrator,p.dt)
+	W = script.simulate(list(trials))	# [snapshots x NTrials x ...]
+	return c, trials, np.moveaxis(W,1,0)
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+def run (script,folder,combinations,NTrials,batch=None,processes=None,backend=None):
+	# ----------------------------------------------------------------------------
+	# Runs the sweep and returns its Table.
+	#   script:       script of the figure, with simulate(trials) returning
+	#                 [snapshots x NTrials x ...] (e.g. Figure4E)
+	#   folder:       folder of the table
+	#   combinations: [{name: value}] (see grid and zipped)
+	#   batch:        largest number of trials simulated at once (default NTrials)
+	#   processes:    size of the pool (default: number of CPUs - 1)
+	# ----------------------------------------------------------------------------
+	module = Pipeline.load_script(script)
+	engine = Pipeline.code_hash([os.path.abspath(script),module.SS.__file__,module.p.__file__]+Pipeline.dependencies(module,module.SS))
+	for combination in combinations:
+		check(module.p,combination)
+	table = Table(folder,combinations,NTrials,{'script': os.path.relpath(script,os.path.dirname(Pipeline.CORE)),
+		'engine': engine, 'params': {k: Pipeline.canonical(v) for k,v in sorted(Pipeline.params_values(module.p).items())}})
+
+	batch = batch or NTrials
+	done = table.done()
+	tasks = [(c,combinations[c],tuple(range(t,min(t+batch,NTrials))))
+		for c in range(len(combinations)) for t in range(0,NTrials,batch)
+		if not done[c,t:t+batch].all()]
+	print('Sweep: {0} combinations x {1} trials, {2} batches to run'.format(len(combinations),NTrials,len(tasks)))
+	if not tasks:
+		return table
+
+	processes = processes or max(mp.cpu_count()-1,1)
+	with mp.Pool(processes,_init,(script,backend)) as pool:
+		for i,(c,trials,W) in enumerate(pool.imap_unordered(_run_batch,tasks)):
+			table.write(c,trials,W)
+			print('Sweep: batch {0}/{1} done (combination {2})'.format(i+1,len(tasks),c))
+	return table
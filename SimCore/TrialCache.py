@@ -0,0 +1,141 @@
+##################################################################################
+# TrialCache.py -- Results of single trials, stored under a hash of what made them
+#
+# The result of a trial (an array) is stored under a key hashing:
+#   - all the values of the params module (which include the base seed and the
+#     experiment, see SimCore/Streams.py), after the integrator is configured
+#   - the number of the trial
+#   - the engine version: the content of the code that simulates it (SimCore and
+#     the scripts of the figure, see engine)
+# so a trial is simulated only once for a given set of parameters and code, and
+# results of other parameters are kept side by side. Each entry is a .npy file
+# with a .json file next to it recording the trial, the parameters, the engine
+# version, its size and the time spent. The cache can be bounded in size: evict
+# removes the least recently used entries.
+##################################################################################
+
+
+import os, glob, json, hashlib
+import numpy as np
+from time import time as time_now
+
+from SimCore import Pipeline
+
+
+def engine (files,*namespaces):
+	# Version of the code simulating a trial: the files given and the SimCore
+	# modules used by the namespaces given (see Pipeline.dependencies)
+	return Pipeline.code_hash([os.path.abspath(f) for f in files]+Pipeline.dependencies(*namespaces))
+
+def key (p,trial,engine_version):
+	# Key of one trial of the params module p
+	h = hashlib.sha256()
+	h.update(Pipeline.canonical(Pipeline.params_values(p)).encode())
+	h.update(repr(int(trial)).encode())
+	h.update(engine_version.encode())
+	return h.hexdigest()
+
+
+class TrialCache:
+	# ----------------------------------------------------------------------------
+	# Entries in folder, as <key[:2]>/<key>.npy and <key[:2]>/<key>.json.
+	#   max_bytes: size above which evict removes entries (None: no bound)
+	# Entries are written to a temporary file and renamed, so several processes
+	# can add entries at the same time and an interrupted run leaves no partial
+	# entry. The time of last use of an entry is the modification time of its
+	# .json file.
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,folder,max_bytes=None):
+		self.folder, self.max_bytes = folder, max_bytes
+		os.makedirs(folder,exist_ok=True)
+
+	def _path (self,key,ext):
+		return os.path.join(self.folder,key[:2],'{0}.{1}'.format(key,ext))
+
+	def has (self,key):
+		return os.path.exists(self._path(key,'json'))
+
+	def get (self,key):
+		# Result of the trial, or None if it is not in the cache
+		if not self.has(key):
+			return None
+		try:
+			result = np.load(self._path(key,'npy'))
+			os.utime(self._path(key,'json'))
+		except (OSError,ValueError):
+			return None
+		return result
+
+	def meta (self,key):
+		with open(self._path(key,'json')) as f:
+			return json.load(f)
+
+	def put (self,key,result,meta=None):
+		# ----------------------------------------------------------------------------
+		# Stores the result of a trial. meta: dict with other information to keep
+		# (e.g. trial, params, engine and time spent), saved as JSON.
+		# ----------------------------------------------------------------------------
+		os.makedirs(os.path.dirname(self._path(key,'npy')),exist_ok=True)
+		result = np.asarray(result)
+		meta = dict(meta or {},key=key,shape=list(result.shape),dtype=str(result.dtype),
+			nbytes=int(result.nbytes),created=time_now())
+		tmp = '{0}.{1}.tmp'.format(self._path(key,'npy'),os.getpid())
+		with open(tmp,'wb') as f:
+			np.save(f,result)
+		os.replace(tmp,self._path(key,'npy'))
+		tmp = '{0}.{1}.tmp'.format(self._path(key,'json'),os.getpid())
+		with open(tmp,'w') as f:
+			json.dump(meta,f,indent=1)
+		os.replace(tmp,self._path(key,'json'))
+
+	def entries (self):
+		# [(time of last use, size in bytes, key)] of all the entries
+		out = []
+		for path in glob.glob(os.path.join(self.folder,'??','*.json')):
+			key = os.path.splitext(os.path.basename(path))[0]
+			try:
+				size = os.path.getsize(path) + os.path.getsize(self._path(key,'npy'))
+				out.append((os.path.getmtime(path),size,key))
+			except OSError:
+				pass
+		return out
+
+	def size (self):
+		return sum(size for _,size,_ in self.entries())
+
+	def remove (self,key):
+		# The .json file goes first, so the entry is never seen without its result
+		for ext in ('json','npy'):
+			try:
+				os.remove(self._path(key,ext))
+			except OSError:
+				pass
+
+	def evict (self,max_bytes=None,keep=()):
+		# ----------------------------------------------------------------------------
+		# Removes the least recently used entries, except those in keep, until the
+		# cache takes at most max_bytes (self.max_bytes by default). Returns the
+		# number of entries removed.
+		# ----------------------------------------------------------------------------
+		max_bytes = self.max_bytes if max_bytes is None else max_bytes
+		if max_bytes is None:
+			return 0
+		entries = sorted(self.entries())
+		total = sum(size for _,size,_ in entries)
+		keep = set(keep)
+		removed = 0
+		for _,size,key in entries:
+			if total <= max_bytes:
+				break
+			if key in keep:
+				continue
+			self.remove(key)
+			total -= size
+			removed += 1
+		return removed
+
+
+def params_record (p):
+	# Values of the params module p as text, for the metadata of an entry
+	return {name: Pipeline.canonical(value) for name,value in sorted(Pipeline.params_values(p).items())}
@@ -0,0 +1,149 @@
+##################################################################################
+# TrialStore.py -- Results of all the trials of a simulation in one file
+#
+# The file has a header of HEADER bytes (a JSON record with the shape and dtype
+# of the result of one trial, the chunk size and the metadata given when it was
+# created, e.g. params and seed), followed by one record per
+# trial:
+#   done: [uint64] 1 once the result of the trial is written
+#   W:    [shape] result of the trial, e.g. [snapshots x 1 x NE] weights
+# The file grows by whole chunks of trials. Several processes can write their
+# trials at the same time: each one writes only its own records, and the file
+# is extended under a lock. Readers get memory-mapped views, e.g. store.W[:,0]
+# are the initial weights of all the trials, without copying them.
+##################################################################################
+
+
+import os, json, fcntl
+import numpy as np
+
+
+MAGIC = b'TRIALSTORE1\n'
+HEADER = 4096	# [bytes] size of the header
+
+
+class TrialStore:
+	# ----------------------------------------------------------------------------
+	# Opens the store in path. If it does not exist, it is created when shape is
+	# given, with:
+	#   shape: shape of the result of one trial
+	#   dtype: dtype of the results
+	#   meta:  dict saved in the header (JSON)
+	#   chunk: number of trials added each time the file grows
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,path,shape=None,dtype='float64',meta=None,chunk=64):
+		self.path = path
+		if not os.path.exists(path):
+			if shape is None:
+				raise FileNotFoundError('No trial store in {0}'.format(path))
+			self._create(shape,dtype,meta,chunk)
+		with open(path,'rb') as f:
+			head = f.read(HEADER)
+		if not head.startswith(MAGIC):
+			raise ValueError('{0} is not a trial store'.format(path))
+		self.header = json.loads(head[len(MAGIC):].decode().rstrip())
+		self.shape = tuple(self.header['shape'])
+		self.dtype = np.dtype(self.header['dtype'])
+		self.chunk = self.header['chunk']
+		self.meta = self.header['meta']
+		self.record = np.dtype([('done',np.uint64),('W',self.dtype,self.shape)])
+
+	def _create (self,shape,dtype,meta,chunk):
+		header = json.dumps({'shape': list(shape), 'dtype': np.dtype(dtype).str,
+			'chunk': int(chunk), 'meta': meta or {}}).encode()
+		if len(MAGIC)+len(header) > HEADER:
+			raise ValueError('Header of the trial store larger than {0} bytes'.format(HEADER))
+		tmp = '{0}.{1}.tmp'.format(self.path,os.getpid())
+		with open(tmp,'wb') as f:
+			f.write(MAGIC + header.ljust(HEADER-len(MAGIC)))
+		try:
+			os.link(tmp,self.path) # fails if another process created it first
+		except FileExistsError:
+			pass
+		os.remove(tmp)
+
+	# ---- size ----
+
+	def capacity (self):
+		return (os.path.getsize(self.path)-HEADER)//self.record.itemsize
+
+	def reserve (self,n):
+		# Grows the file (by whole chunks) to hold at least n trials
+		with open(self.path,'r+b') as f:
+			fcntl.lockf(f,fcntl.LOCK_EX)
+			try:
+				if self.capacity() < n:
+					n = -(-n//self.chunk)*self.chunk
+					f.truncate(HEADER+n*self.record.itemsize)
+			finally:
+				fcntl.lockf(f,fcntl.LOCK_UN)
+
+	# ---- reading and writing ----
+
+	def records (self,mode='r'):
+		# Memory-mapped records of all the trials (done and W)
+		n = self.capacity()
+		if n == 0:
+			return np.zeros(0,self.record)
+		return np.memmap(self.path,self.record,mode,HEADER,(n,))
+
+	@property
+	def W (self):
+		# [capacity x shape] results of the trials (zeros for those not written)
+		return self.records()['W']
+
+	def trials (self):
+		# Numbers of the trials written
+		return np.flatnonzero(self.records()['done'])
+
+	def write (self,trial,W):
+		# Writes the result of one trial; done is set after the result is on disk
+		self.reserve(trial+1)
+		rec = self.records('r+')
+		rec['W'][trial] = W
+		rec.flush()
+		rec['done'][trial] = 1
+		rec.flush()
+
+	def blocks (self,trials=None,size=None):
+		# ----------------------------------------------------------------------------
+		# Yields the results of the trials given (by default, all those written) in
+		# blocks of size trials (by default, one chunk): [n x shape] arrays.
+		# ----------------------------------------------------------------------------
+		trials = self.trials() if trials is None else np.asarray(trials)
+		size = size or self.chunk
+		W = self.W
+		for i in range(0,len(trials),size):
+			yield W[trials[i:i+size]]
+
+
+def import_files (path,fnames,trials=None,meta=None,chunk=64,shape=None,dtype='float64'):
+	# ----------------------------------------------------------------------------
+	# Creates the store in path with the results saved one per file (.npy), e.g.
+	# Data/Wall_XXX.npy, as trials 0, 1, ... (or the numbers given in trials).
+	# The number of files imported is added to meta. Without files, the store is
+	# created empty, with the shape and dtype given.
+	# ----------------------------------------------------------------------------
+	trials = range(len(fnames)) if trials is None else trials
+	if len(fnames):
+		first = np.load(fnames[0],mmap_mode='r')
+		shape, dtype = first.shape, first.dtype
+	elif shape is None:
+		raise ValueError('No files to import into {0}, and no shape for an empty store'.format(path))
+	store = TrialStore(path,shape,dtype,dict(meta or {},imported=len(fnames)),chunk)
+	if not len(fnames):
+		return store
+	store.reserve(max(trials)+1)
+	rec = store.records('r+')
+	for trial,fname in zip(trials,fnames):
+		rec['W'][trial] = np.load(fname,mmap_mode='r')
+		rec['done'][trial] = 1
+	rec.flush()
+	return store
+
+def archived (folder,prefix):
+	# The files prefix_XXX.npy of folder and their trial numbers XXX, sorted
+	names = sorted(f for f in os.listdir(folder) if f.startswith(prefix+'_') and f.endswith('.npy')) \
+		if os.path.isdir(folder) else []
+	return [os.path.join(folder,f) for f in names], [int(f[len(prefix)+1:-4]) for f in names]
@@ -0,0 +1,6 @@
+##################################################################################
+# SimCore -- Code shared by the simulations of Figure 4CD and Figure 4E
+#
+# The scripts in each figure directory add the root of the repository to the
+# path (see SimStep.py) and import the modules in here as "from SimCore import X".
+##################################################################################
@@ -0,0 +1,69 @@
+##################################################################################
+# run_sweep.py -- Runs Figure 4E over a set of parameter values (see SimCore/Sweep.py)
+#
+# Usage: python Sweeps/run_sweep.py name --param 'a_pre["up"]' -0.001 -0.002
+#        --param gBarEx 0.5 1.0 [--trials 50] [--zip] [--batch 50] [--processes 8]
+#        [--backend numba]
+# Every --param gives a parameter of Figure4E/params.py and its values, e.g.
+# a_pre["up"], gBarEx, w_max, Tref, std_pre (std of the noise of the external
+# current) or t_max. All the combinations of the values are run (or, with --zip,
+# the i-th values of all the parameters together), with --trials trials each.
+# The results go to Sweeps/Data/name/ (index.json and results.store); running
+# the same command again continues an interrupted sweep.
+#
+# Sweep.Table('Sweeps/Data/name').results() gives the initial and final weights,
+# [NCombinations x NTrials x 2 x 1 x NE], and this script prints the mean
+# relative weight change of each combination.
+##################################################################################
+
+
+import os, sys, ast
+import argparse
+import numpy as np
+from time import time as time_now
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir))
+sys.path.insert(0,ROOT)
+from SimCore import Sweep
+
+
+def value (text):
+	# Numbers (and other Python literals) are parsed; anything else is kept as text
+	try:
+		return ast.literal_eval(text)
+	except (ValueError,SyntaxError):
+		return text
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Parameter sweep of Figure 4E')
+	parser.add_argument('name',help='name of the sweep (folder in Sweeps/Data/)')
+	parser.add_argument('--param',nargs='+',action='append',required=True,metavar=('NAME','VALUE'),
+		help='parameter and its values')
+	parser.add_argument('--trials',type=int,default=50,help='trials per combination')
+	parser.add_argument('--zip',action='store_true',help='take the values of all the parameters together')
+	parser.add_argument('--batch',type=int,default=None,help='largest number of trials simulated at once')
+	parser.add_argument('--processes',type=int,default=None,help='number of processes')
+	parser.add_argument('--backend',default=None,help='"numpy" or "numba" (default: SIMSTEP_BACKEND)')
+	args = parser.parse_args()
+
+	values = {p[0]: [value(v) for v in p[1:]] for p in args.param}
+	combinations = (Sweep.zipped if args.zip else Sweep.grid)(values)
+
+	time_in = time_now()
+	table = Sweep.run(os.path.join(ROOT,'Figure4E','UP-state-mediated_plast_fig4E.py'),
+		os.path.join(ROOT,'Sweeps','Data',args.name),combinations,args.trials,
+		args.batch,args.processes,args.backend)
+
+	# Mean relative weight change (over synapses and trials) of each combination
+	done = table.done()
+	W = table.results()
+	print('')
+	print(' '.join('{0:>14s}'.format(n) for n in values) + ' {0:>7s} {1:>12s}'.format('trials','dw/w0'))
+	for c,combination in enumerate(table.combinations):
+		w0,w1 = W[c,done[c],0,0],W[c,done[c],1,0]
+		change = np.mean((w1-w0)/w0) if len(w0) else np.nan
+		print(' '.join('{0:>14s}'.format(repr(combination[n])) for n in values)
+			+ ' {0:7d} {1:12.5f}'.format(int(done[c].sum()),change))
+	print('')
+	print('Total time = {0:.2f} minutes'.format((time_now()-time_in)/60.))
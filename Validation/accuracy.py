@@ -0,0 +1,124 @@
+##################################################################################
+# accuracy.py -- Runs of Figure 4CD and Figure 4E with a given integrator or precision
+#
+# Shared by check_integrator.py and check_precision.py. The runs are made with
+# the simulate() functions of the scripts of each figure, so they start from the
+# same initial state as the scripts:
+#   wake:  UP-state-mediated_plast_fig4CD_wake.py
+#   sleep: UP-state-mediated_plast_fig4CD_sleep.py (from the weights after wake)
+#   fig4E: UP-state-mediated_plast_fig4E.py
+# A run is set by a dict with any of:
+#   integrator, dt: integration method and time step (SimStep.set_integrator)
+#   precision:      "float64" or "float32" (SimStep.set_precision)
+# and the values of params.py are used for the others. For each run, compare()
+# reports:
+#   - Figure 4CD: S/N = max(w)/mean(w) before, after wake and after sleep
+#     (mean and standard error over seeds), and the difference of the means from
+#     the first run in units of the standard error
+#   - Figure 4E: the curve dw/w0 averaged over trials, and its largest deviation
+#     from the first run, also in units of the standard error
+# With paired=True the runs use the same random streams (e.g. the integrators),
+# and the standard error is that of the first run; otherwise (e.g. float32, which
+# draws its own noise) the runs are compared as samples, with the standard error
+# of the difference.
+##################################################################################
+
+
+import os, sys
+import numpy as np
+from time import time as time_now
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir)
+sys.path.insert(0,ROOT)
+from SimCore import Pipeline
+
+
+SCRIPTS = {'wake': os.path.join('Figure4CD','Step1-wake_learning','UP-state-mediated_plast_fig4CD_wake.py'),
+	'sleep': os.path.join('Figure4CD','Step2-sleep_learning','UP-state-mediated_plast_fig4CD_sleep.py'),
+	'fig4E': os.path.join('Figure4E','UP-state-mediated_plast_fig4E.py')}
+
+
+# ================================================================================
+# Load and set up the scripts ----------------------------------------------------
+
+class Scripts:
+	# ----------------------------------------------------------------------------
+	# The scripts of both figures, each with its own p and SS, run with
+	#   backend: "numpy" or "numba"
+	#   tscale:  fraction of t_max of each script to simulate
+	# ----------------------------------------------------------------------------
+
+	def __init__ (self,backend='numba',tscale=1.):
+		self.backend = backend
+		self.tscale = tscale
+		self.script = {name: Pipeline.load_script(os.path.join(ROOT,path)) for name,path in SCRIPTS.items()}
+		self.t_max = {name: s.p.t_max for name,s in self.script.items()}
+		self.defaults = {name: {'integrator': s.p.integrator, 'dt': s.p.dt, 'precision': s.p.precision}
+			for name,s in self.script.items()}
+
+	def setup (self,name,run):
+		# Sets the backend, precision, length and integrator of a script for a run
+		s = self.script[name]
+		run = dict(self.defaults[name],**run)
+		s.SS.set_backend(self.backend)
+		s.SS.set_precision(run['precision'])
+		s.p.t_max = self.t_max[name]*self.tscale
+		s.SS.set_integrator(run['integrator'],run['dt'])
+		return s
+
+
+# ================================================================================
+# Figure 4CD ---------------------------------------------------------------------
+
+def sn (w): return np.max(w)/np.mean(w)
+
+def run_4CD (scripts,run,trial):
+	# S/N of the initial weights, after wake and after sleep, for one trial
+	wake = scripts.setup('wake',run)
+	W = wake.simulate(trial,recorder=wake.SS.Recorders.Final())
+	sleep = scripts.setup('sleep',run)
+	W1 = sleep.simulate(W,trial,recorder=sleep.SS.Recorders.Final(initial=False))
+	return sn(W[0]),sn(W[-1]),sn(W1[-1])
+
+
+# ================================================================================
+# Figure 4E ----------------------------------------------------------------------
+
+def run_4E (scripts,run,NTrials):
+	# dw/w0 of trials 0, ..., NTrials-1, [NTrials x NE]
+	fig4E = scripts.setup('fig4E',run)
+	W = fig4E.simulate(list(range(NTrials))).astype(float)
+	return ((W[1]-W[0])/W[0])[:,0]
+
+
+# ================================================================================
+# Comparison of the runs ---------------------------------------------------------
+
+def compare (scripts,runs,seeds,trials,paired=False):
+	# ----------------------------------------------------------------------------
+	# Runs Figure 4CD for seeds trials and Figure 4E for trials trials with each
+	# run of runs, a list of (label, run), and prints one line per run. The first
+	# run is the reference.
+	# ----------------------------------------------------------------------------
+	print('{0:>11s} | {1:>13s} {2:>13s} {3:>13s} | {4:>17s} | {5:>9s} {6:>9s} {7:>10s} | {8:>8s}'.format(
+		'run','S/N initial','S/N wake','S/N sleep','dS/N / se','max|E|','max|dE|','max|dE|/se','time [s]'))
+	ref = None
+	for label,run in runs:
+		time_in = time_now()
+		SN = np.array([run_4CD(scripts,run,i) for i in range(seeds)])
+		dW = run_4E(scripts,run,trials)
+		curve,se = np.mean(dW,axis=0),np.std(dW,axis=0)/np.sqrt(trials)
+		m,e = np.mean(SN,axis=0),np.std(SN,axis=0)/np.sqrt(seeds)
+		if ref is None:
+			ref = curve,se,m,e
+		curve_ref,se_ref,m_ref,e_ref = ref
+		se_SN = e_ref if paired else np.sqrt(e**2+e_ref**2)
+		se_E = se_ref if paired else np.sqrt(se**2+se_ref**2)
+		z = (m-m_ref)/np.maximum(se_SN,1e-12)
+		err = np.abs(curve-curve_ref)
+		print('{0:>11s} | {1:6.3f}+-{2:5.3f} {3:6.3f}+-{4:5.3f} {5:6.3f}+-{6:5.3f} | {7:5.2f} {8:5.2f} {9:5.2f} | {10:9.2e} {11:9.2e} {12:10.2f} | {13:8.1f}'.format(
+			label,m[0],e[0],m[1],e[1],m[2],e[2],z[0],z[1],z[2],np.max(np.abs(curve)),np.max(err),
+			np.max(err/np.maximum(se_E,1e-12)),time_now()-time_in))
+	print('')
+	print('S/N: mean +- standard error over {0} seeds; dS/N / se: difference from {1}'.format(seeds,runs[0][0]))
+	print('E: dw/w0 curve of Figure 4E; dE: its deviation from {0} ({1} trials)'.format(runs[0][0],trials))
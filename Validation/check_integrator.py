@@ -0,0 +1,41 @@
+##################################################################################
+# check_integrator.py -- Accuracy of the exponential integrator with coarse time steps
+#
+# Runs the simulations of Figure 4CD (wake + sleep) and Figure 4E with the forward
+# Euler method at dt = 1 ms (reference) and with the exponential integrator at the time
+# steps given, and reports for each one:
+#   - Figure 4CD: S/N = max(w)/mean(w) before, after wake and after sleep
+#     (mean and standard error over seeds) and its deviation from the reference
+#   - Figure 4E: the curve dw/w0 averaged over trials, and its largest deviation
+#     from the reference, also in units of the standard error of the reference
+#
+# Usage: python Validation/check_integrator.py [--seeds 8] [--trials 50] [--dt 1 2 5]
+#        [--backend numba] [--tscale 1.0]
+# --tscale shortens all the simulations (e.g. 0.1 for a quick check).
+# All the methods use the same random streams for each seed and trial. The runs
+# are made by Validation/accuracy.py with the simulate() of the scripts.
+##################################################################################
+
+
+import os, sys
+import argparse
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import accuracy
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Accuracy of the exponential integrator')
+	parser.add_argument('--seeds',type=int,default=8,help='runs of Figure 4CD per method')
+	parser.add_argument('--trials',type=int,default=50,help='trials of Figure 4E per method')
+	parser.add_argument('--dt',type=float,nargs='+',default=[1.,2.,5.],help='[ms] time steps to test')
+	parser.add_argument('--backend',default='numba',help='"numpy" or "numba"')
+	parser.add_argument('--tscale',type=float,default=1.,help='fraction of t_max to simulate')
+	args = parser.parse_args()
+
+	runs = [('euler 1',{'integrator': "euler", 'dt': 1.})] \
+		+ [('expon. {0:g}'.format(dt),{'integrator': "exponential", 'dt': dt}) for dt in args.dt]
+	accuracy.compare(accuracy.Scripts(args.backend,args.tscale),runs,args.seeds,args.trials,paired=True)
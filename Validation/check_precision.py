@@ -0,0 +1,40 @@
+##################################################################################
+# check_precision.py -- Accuracy of the float32 mode (see SimStep.set_precision)
+#
+# Runs the simulations of Figure 4CD (wake + sleep) and Figure 4E in float64
+# (reference) and in float32, and reports for each precision:
+#   - Figure 4CD: S/N = max(w)/mean(w) before, after wake and after sleep
+#     (mean and standard error over seeds), and the difference of the means from
+#     the reference in units of the standard error of the difference
+#   - Figure 4E: the curve dw/w0 averaged over trials, and its largest deviation
+#     from the reference, also in units of the standard error of the difference
+# float32 draws its own noise (in single precision), so the runs are compared as
+# samples over seeds and trials, not trajectory by trajectory. The runs are made
+# by Validation/accuracy.py with the simulate() of the scripts.
+#
+# Usage: python Validation/check_precision.py [--seeds 8] [--trials 50]
+#        [--backend numba] [--tscale 1.0]
+# --tscale shortens all the simulations (e.g. 0.1 for a quick check).
+##################################################################################
+
+
+import os, sys
+import argparse
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+import accuracy
+
+
+# ================================================================================
+# Main code ----------------------------------------------------------------------
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Accuracy of the float32 mode')
+	parser.add_argument('--seeds',type=int,default=8,help='runs of Figure 4CD per precision')
+	parser.add_argument('--trials',type=int,default=50,help='trials of Figure 4E per precision')
+	parser.add_argument('--backend',default='numba',help='"numpy" or "numba"')
+	parser.add_argument('--tscale',type=float,default=1.,help='fraction of t_max to simulate')
+	args = parser.parse_args()
+
+	runs = [(precision,{'precision': precision}) for precision in ("float64","float32")]
+	accuracy.compare(accuracy.Scripts(args.backend,args.tscale),runs,args.seeds,args.trials)
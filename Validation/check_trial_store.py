@@ -0,0 +1,69 @@
+##################################################################################
+# check_trial_store.py -- Import of archived trials into the trial store of Figure 4E
+#
+# Checks, in a temporary folder, the cycle used by run_code.py and Make_fig4E.py:
+#   - trials saved one per file (Wall_XXX.npy) are imported by trial_store of
+#     Figure4E/SimStep.py, which then accepts the store as its own
+#   - new trials are written next to them, and the store is reopened with all
+#     of them
+#   - without archived files an empty store is created
+#   - a store of other parameters is refused
+#
+# Usage: python Validation/check_trial_store.py
+##################################################################################
+
+
+import os, sys
+import shutil, tempfile
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir)
+sys.path.insert(0,ROOT)
+from SimCore import Pipeline, TrialStore
+
+
+# ================================================================================
+# Main code
+# ================================================================================
+
+if __name__ == '__main__':
+	p, SS = Pipeline.load_stage(os.path.abspath(os.path.join(ROOT,'Figure4E')))
+	rng = np.random.RandomState(0)
+	folder = tempfile.mkdtemp()
+	try:
+		# ---- import of the archived trials ----
+		archived = {tr: rng.rand(2,1,p.NE).astype(p.precision) for tr in (0,1,3)}
+		for tr,W in archived.items():
+			np.save(os.path.join(folder,'Wall_{0:03d}.npy'.format(tr)),W)
+		path = os.path.join(folder,'Wall.store')
+		store = SS.trial_store(path)
+		assert list(store.trials()) == [0,1,3], store.trials()
+		assert store.meta['imported'] == 3
+		for tr,W in archived.items():
+			assert np.array_equal(store.W[tr],W)
+
+		# ---- new trials written next to them ----
+		new = rng.rand(2,1,p.NE).astype(p.precision)
+		store.write(2,new)
+		store = SS.trial_store(path)
+		assert list(store.trials()) == [0,1,2,3], store.trials()
+		assert np.array_equal(store.W[2],new) and np.array_equal(store.W[3],archived[3])
+
+		# ---- no archived files ----
+		empty = os.path.join(folder,'empty')
+		os.mkdir(empty)
+		store = SS.trial_store(os.path.join(empty,'Wall.store'))
+		assert len(store.trials()) == 0 and store.shape == (2,1,p.NE)
+
+		# ---- store of other parameters ----
+		other = os.path.join(folder,'other.store')
+		TrialStore.TrialStore(other,(2,1,p.NE),p.precision,{'experiment': p.experiment, 'seed': -1})
+		try:
+			SS.trial_store(other)
+		except ValueError:
+			pass
+		else:
+			raise AssertionError('trial_store accepted a store of other parameters')
+	finally:
+		shutil.rmtree(folder)
+	print('Trial store: import, reopen and write OK')